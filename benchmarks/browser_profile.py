@@ -0,0 +1,75 @@
+"""Render book pages with the default and the lean browser profile and report the page load time and the bytes
+transferred per page.
+
+Run from the repository root: python benchmarks/browser_profile.py --url https://www.saxo.com/dk/... [--url ...]
+Without --url the pages of the local Saxo stand-in are rendered, which have no images, fonts or trackers to block.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from browser_pool import BrowserPool, lean_chrome_options, LEAN_BLOCKED_URLS  # noqa: E402
+from scraping import wait_for_book_details_page_load  # noqa: E402
+from saxo_standin import Catalogue, StandinSettings, start_standin_server, DEFAULT_PORT  # noqa: E402
+
+PROFILES = {
+    "default": {},
+    "lean": {"options_factory": lean_chrome_options, "blocked_urls": LEAN_BLOCKED_URLS},
+}
+# bytes of the document and of every resource it loaded, cross-origin resources without a Timing-Allow-Origin
+# header report 0
+TRANSFERRED_BYTES_SCRIPT = """return performance.getEntriesByType('navigation')
+    .concat(performance.getEntriesByType('resource'))
+    .reduce((total, entry) => total + (entry.transferSize || 0), 0)"""
+
+
+def render_pages(profile, urls, rounds):
+    """Render every url `rounds` times in one browser, return the load times and transferred bytes"""
+    pool = BrowserPool(size=1, max_pages_per_browser=len(urls) * rounds + 1, **PROFILES[profile])
+    load_times, transferred = [], []
+    try:
+        with pool.browser() as browser:
+            for _ in range(rounds):
+                for url in urls:
+                    start = time.monotonic()
+                    browser.get(url)
+                    wait_for_book_details_page_load(browser)
+                    load_times.append(time.monotonic() - start)
+                    transferred.append(browser.execute_script(TRANSFERRED_BYTES_SCRIPT))
+                    # a cache hit would transfer nothing on the next round
+                    browser.execute_cdp_cmd("Network.clearBrowserCache", {})
+    finally:
+        pool.close()
+    return load_times, transferred
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", action="append", default=[], help="book page to render, repeatable")
+    parser.add_argument("--pages", type=int, default=20, help="stand-in pages rendered without --url")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    server = None
+    urls = args.url
+    if not urls:
+        server = start_standin_server(Catalogue(), StandinSettings(), DEFAULT_PORT)
+        urls = [f"http://127.0.0.1:{DEFAULT_PORT}/dk/standin-book-{k}_{Catalogue.isbn(k)}" for k in range(args.pages)]
+    try:
+        print(f"{'profile':<10}{'pages':>7}{'median load':>14}{'p90 load':>11}{'median KiB':>12}{'total MiB':>11}")
+        for profile in PROFILES:
+            load_times, transferred = render_pages(profile, urls, args.rounds)
+            p90 = statistics.quantiles(load_times, n=10)[-1] if len(load_times) > 1 else load_times[0]
+            print(f"{profile:<10}{len(load_times):>7}{statistics.median(load_times):>13.2f}s{p90:>10.2f}s"
+                  f"{statistics.median(transferred) / 1024:>12.1f}{sum(transferred) / 1024 ** 2:>11.1f}")
+    finally:
+        if server is not None:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
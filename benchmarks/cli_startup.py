@@ -0,0 +1,74 @@
+"""Time the cold start of the main.py commands and check the quick ones against their targets.
+
+Run from the repository root: python benchmarks/cli_startup.py [--runs 5]
+Every command runs in a fresh interpreter against a small database, the best of the runs is reported. The exit code
+is 1 when a command with a target is slower than it.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+# seconds from starting the interpreter to the exit of the command, None where the time is only reported
+STARTUP_TARGETS = {
+    "--help": 0.25,
+    "status": 0.25,
+    "export --help": None,
+    "export": 2.0,
+    "reextract --help": None,
+    "crawl --help": None,
+}
+
+
+def create_small_database(path, books=1000):
+    from database import create_database_engine, Book
+    engine = create_database_engine(path)
+    with engine.begin() as connection:
+        connection.execute(Book.__table__.insert(), [{"isbn": str(i), "title": f"Book {i}", "url": f"/book/{i}",
+                                                      "top10k": i} for i in range(books)])
+    engine.dispose()
+
+
+def best_time(command, runs, directory):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=directory, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="saxo_startup_") as directory:
+        database_path = os.path.join(directory, "books.db")
+        create_small_database(database_path)
+        extra_arguments = {"status": ["--database", database_path],
+                           "export": ["--database", database_path, "--output", os.path.join(directory, "export")]}
+
+        interpreter = best_time([sys.executable, "-c", "pass"], args.runs, directory)
+        print(f"{'command':<20}{'cold start':>12}{'target':>10}")
+        print(f"{'(interpreter)':<20}{interpreter:>11.3f}s")
+        too_slow = []
+        for command, target in STARTUP_TARGETS.items():
+            arguments = command.split()
+            elapsed = best_time([sys.executable, MAIN_PATH, *arguments, *extra_arguments.get(command, [])],
+                                args.runs, directory)
+            print(f"{command:<20}{elapsed:>11.3f}s" + (f"{target:>9.2f}s" if target is not None else f"{'-':>10}"))
+            if target is not None and elapsed > target:
+                too_slow.append(command)
+
+    if too_slow:
+        sys.exit(f"Slower than the target: {', '.join(too_slow)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Micro-benchmarks of the scraping and persistence hot paths over the Saxo pages in benchmarks/fixtures.
+
+Run from the repository root:
+python benchmarks/hot_paths.py [--filter extract] [--json results.json] [--compare baseline.json]
+
+Every benchmark is timed in repeated batches and reported as the best and the median time per call. The table and
+the JSON file are sorted by benchmark name, so the results of two commits can be diffed or compared with --compare.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+from book_index import reset_book_index  # noqa: E402
+from extractor import extract_book_details  # noqa: E402
+from scraping import find_book_by_title_in_search_results_return_book_url, \
+    find_book_by_isbn_in_search_results_return_book_url, save_book_details_to_database  # noqa: E402
+from utils import extract_book_details_dict, extract_recommendations_list, normalize_author_string, \
+    normalize_book_title_string, ISBN, URL, TOP10K  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+REPEAT = 5
+# each batch of calls runs for at least this long
+MIN_BATCH_TIME = 0.2
+
+# the author and title the search fixture is matched against, as the crawl normalizes them from the input CSV
+SEARCH_AUTHOR = "Jane Austen"
+SEARCH_TITLE = "Pride and Prejudice"
+SEARCH_ISBN = "9780141439518"
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def page_benchmarks():
+    product_page = read_fixture("product.html")
+    title_search_page = read_fixture("search_title.html")
+    isbn_search_page = read_fixture("search_isbn.html")
+    author = normalize_author_string(SEARCH_AUTHOR)
+    title = normalize_book_title_string(SEARCH_TITLE)
+    return {
+        "extract_book_details_dict": lambda: extract_book_details_dict(product_page),
+        "extractor.extract_book_details": lambda: extract_book_details(product_page),
+        "extract_recommendations_list": lambda: extract_recommendations_list(product_page),
+        "find_book_by_title": lambda: find_book_by_title_in_search_results_return_book_url(title_search_page, author,
+                                                                                           title),
+        "find_book_by_isbn": lambda: find_book_by_isbn_in_search_results_return_book_url(isbn_search_page,
+                                                                                         SEARCH_ISBN),
+    }
+
+
+def normalization_benchmarks():
+    """The names and titles of the fixtures, normalized from scratch and through the memo like in the crawl"""
+    book_details = extract_book_details_dict(read_fixture("product.html"))
+    names = ["Jane Austen", "Vivien Jones (Editor)", "Seth Grahame-Smith", "Ærø Østergård", "P. D. James",
+             "Penguin Books Ltd", "Karen Joy Fowler", "Curtis Sittenfeld"]
+    titles = [SEARCH_TITLE, "Pride and Prejudice (Penguin Classics)", "Stolthed og fordom", "Søster, min søster",
+              "Bridget Jones's Diary", book_details["Title"]]
+    return {
+        "normalize_author_string": lambda: [normalize_author_string.__wrapped__(name) for name in names],
+        "normalize_author_string.memoized": lambda: [normalize_author_string(name) for name in names],
+        "normalize_book_title_string": lambda: [normalize_book_title_string.__wrapped__(t) for t in titles],
+        "normalize_book_title_string.memoized": lambda: [normalize_book_title_string(t) for t in titles],
+    }
+
+
+def database_benchmarks(directory):
+    """Save the fixture book under a new ISBN on every call, with its recommendations pushed to the frontier"""
+    database.set_database_path(os.path.join(directory, "benchmark.db"))
+    reset_book_index()
+    session = database.create_session()
+    book_details = extract_book_details_dict(read_fixture("product.html"))
+    numbers = itertools.count()
+
+    def save_book():
+        n = next(numbers)
+        save_book_details_to_database({**book_details, ISBN: f"bench{n:08d}", URL: f"{book_details[ISBN]}/{n}",
+                                       TOP10K: n + 1}, session)
+
+    return {"save_book_details_to_database": save_book}
+
+
+def time_benchmark(function):
+    timer = timeit.Timer(function)
+    loops = 1
+    while timer.timeit(loops) < MIN_BATCH_TIME:
+        loops *= 2
+    per_call = [t / loops for t in timer.repeat(REPEAT, loops)]
+    return {"best_us": min(per_call) * 1e6, "median_us": statistics.median(per_call) * 1e6, "loops": loops}
+
+
+def print_results(results, baseline):
+    print(f"{'benchmark':<40}{'best':>12}{'median':>12}" + (f"{'baseline':>12}{'change':>9}" if baseline else ""))
+    for name, result in results.items():
+        line = f"{name:<40}{result['best_us']:>10.1f}us{result['median_us']:>10.1f}us"
+        if name in baseline:
+            base = baseline[name]["best_us"]
+            line += f"{base:>10.1f}us{(result['best_us'] - base) / base:>+9.1%}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--filter", default="", help="run only the benchmarks whose name contains this")
+    parser.add_argument("--json", default=None, help="write the results to this file")
+    parser.add_argument("--compare", default=None, help="results file of an earlier run to compare against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        benchmarks = {**page_benchmarks(), **normalization_benchmarks(), **database_benchmarks(directory)}
+        results = {name: time_benchmark(benchmarks[name]) for name in sorted(benchmarks) if args.filter in name}
+        if database.engine is not None:
+            database.engine.dispose()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["benchmarks"]
+    print_results(results, baseline)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"python": platform.python_version(), "benchmarks": results}, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Crawl a synthetic catalogue served by the local Saxo stand-in end to end and report the throughput, peak memory
+and database growth.
+
+Run from the repository root: python benchmarks/load_harness.py --rows 1000 [--latency 0.05] [-- --browsers 8]
+Arguments after `--` are passed on to main.py. With --refresh the crawled database is refreshed after a share of the
+book pages changed.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from saxo_standin import add_standin_arguments, standin_from_arguments, start_standin_server, DEFAULT_PORT  # noqa
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+# how often the database size is sampled during the run
+SAMPLE_INTERVAL = 1.0
+
+
+def database_bytes(path):
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+
+def count_rows(path):
+    with sqlite3.connect(path) as connection:
+        return {
+            "books": connection.execute("SELECT COUNT(*) FROM book").fetchone()[0],
+            "top10k_books": connection.execute("SELECT COUNT(*) FROM book WHERE top10k != 0").fetchone()[0],
+            "default_books": connection.execute("SELECT COUNT(*) FROM book WHERE url = 'N/A'").fetchone()[0],
+            "recommendations": connection.execute("SELECT COUNT(*) FROM recommendation").fetchone()[0],
+        }
+
+
+def peak_child_memory_mb():
+    """Peak resident memory of the largest crawl process, ru_maxrss is in KiB on Linux and in bytes on macOS"""
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def run_crawl(directory, base_url, rows_csv, max_depth, main_args, run="crawl"):
+    database_path = os.path.join(directory, "harness.db")
+    stats_path = os.path.join(directory, "data", f"{run}_stats.json")
+    command = [sys.executable, MAIN_PATH, "--input-csv", rows_csv, "--database", database_path, "--fast",
+               "--no-cache", "--saxo-url", base_url, "--max-depth", str(max_depth), "--initial-rate", "1000",
+               "--max-rate", "100000", "--stats-file", stats_path, "--stats-interval", "5", *main_args]
+
+    growth = []
+    start = time.monotonic()
+    with open(os.path.join(directory, f"{run}_output.log"), "w") as output:
+        crawl = subprocess.Popen(command, cwd=directory, stdout=output, stderr=subprocess.STDOUT)
+        while crawl.poll() is None:
+            time.sleep(SAMPLE_INTERVAL)
+            growth.append((time.monotonic() - start, database_bytes(database_path)))
+    elapsed = time.monotonic() - start
+    if crawl.returncode != 0:
+        sys.exit(f"The {run} failed with exit code {crawl.returncode}, see {directory}/{run}_output.log")
+
+    stats = None
+    if os.path.exists(stats_path):
+        with open(stats_path) as f:
+            stats = json.load(f)
+    return database_path, elapsed, growth, stats
+
+
+def print_report(rows, elapsed, database_path, growth, stats):
+    counts = count_rows(database_path)
+    size = database_bytes(database_path)
+    print(f"input rows            {rows}")
+    print(f"elapsed               {elapsed:.1f} s")
+    for name, value in counts.items():
+        print(f"{name:<22}{value}")
+    print(f"books per minute      {counts['books'] / elapsed * 60:.1f}")
+    print(f"peak memory           {peak_child_memory_mb():.1f} MiB")
+    print(f"database size         {size / 1024 ** 2:.1f} MiB, {size / max(counts['books'], 1):.0f} bytes per book")
+    if len(growth) > 1:
+        (first_time, first_size), (last_time, last_size) = growth[0], growth[-1]
+        if last_time > first_time:
+            print(f"database growth       {(last_size - first_size) / (last_time - first_time) / 1024:.1f} KiB/s")
+    if stats is not None:
+        print(f"{'stage':<26}{'count':>8}{'p50':>10}{'p90':>10}{'/min':>10}")
+        for stage, stage_stats in stats["stages"].items():
+            latency = stage_stats["latency"]
+            if latency is not None:
+                print(f"{stage:<26}{latency['count']:>8}{latency['p50']:>9.3f}s{latency['p90']:>9.3f}s"
+                      f"{stage_stats['per_minute']:>10.1f}")
+
+
+def print_refresh_report(elapsed, crawl_elapsed, stats):
+    print(f"refresh elapsed       {elapsed:.1f} s, {elapsed / crawl_elapsed:.0%} of the crawl")
+    if stats is not None and "refresh" in stats["stages"]:
+        outcomes = stats["stages"]["refresh"]["outcomes"]
+        print("refreshed books       " + ", ".join(f"{outcome} {count}" for outcome, count in sorted(outcomes.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_standin_arguments(parser)
+    parser.add_argument("--rows", type=int, default=1000, help="top10k books in the input, 1k to 100k")
+    parser.add_argument("--max-depth", type=int, default=1)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--keep", action="store_true", help="keep the run directory with the database and logs")
+    parser.add_argument("--refresh", action="store_true",
+                        help="after the crawl, change a share of the book pages and refresh the database")
+    parser.add_argument("main_args", nargs=argparse.REMAINDER, help="arguments passed on to main.py after --")
+    args = parser.parse_args()
+    main_args = args.main_args[1:] if args.main_args[:1] == ["--"] else args.main_args
+    # the catalogue holds the input books and their recommendations
+    args.books = max(args.books, args.rows)
+
+    catalogue, settings = standin_from_arguments(args)
+    server = start_standin_server(catalogue, settings, args.port)
+    directory = tempfile.mkdtemp(prefix="saxo_harness_")
+    try:
+        os.makedirs(os.path.join(directory, "data"))
+        rows_csv = os.path.join(directory, "input.csv")
+        catalogue.write_input_csv(rows_csv, args.rows)
+        database_path, elapsed, growth, stats = run_crawl(directory, f"http://127.0.0.1:{args.port}", rows_csv,
+                                                          args.max_depth, main_args)
+        print_report(args.rows, elapsed, database_path, growth, stats)
+        if args.refresh:
+            settings.revision += 1
+            _, refresh_elapsed, _, refresh_stats = run_crawl(
+                directory, f"http://127.0.0.1:{args.port}", rows_csv, args.max_depth,
+                ["--refresh", "--refresh-age-days", "0", *main_args], run="refresh")
+            print_refresh_report(refresh_elapsed, elapsed, refresh_stats)
+    finally:
+        server.shutdown()
+        if args.keep:
+            print(f"run directory         {directory}")
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""Local stand-in for Saxo.com serving a synthetic catalogue: search pages, ISBN redirects, book pages and the
+recommendation carousel, with configurable latency, error rate and recommendation graph.
+
+Run from the repository root: python benchmarks/saxo_standin.py [--books 10000] [--port 8765]
+The crawl is pointed at it with `python main.py --fast --saxo-url http://127.0.0.1:8765`.
+"""
+import argparse
+import html
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import normalize_book_title_string  # noqa: E402
+
+DEFAULT_PORT = 8765
+DEFAULT_BOOKS = 10000
+DEFAULT_RECOMMENDATIONS = 10
+# recommendation graphs: every book equally likely to be recommended, or a few popular books recommended a lot
+UNIFORM = "uniform"
+ZIPF = "zipf"
+ZIPF_EXPONENT = 1.1
+# other books shown in a search page next to the one searched for
+SEARCH_DECOYS = 7
+# carousel rendering: covers in the page itself, or loaded client-side from a data request
+STATIC = "static"
+AJAX = "ajax"
+
+
+class Catalogue:
+    """Deterministic synthetic books numbered from 0, the top10k input is the first books of the catalogue"""
+
+    def __init__(self, books=DEFAULT_BOOKS, recommendations=DEFAULT_RECOMMENDATIONS, graph=UNIFORM, seed=0):
+        self.books = books
+        self.recommendations = recommendations
+        self.graph = graph
+        self.seed = seed
+        if graph == ZIPF:
+            weights = [1 / (k + 1) ** ZIPF_EXPONENT for k in range(books)]
+            total = sum(weights)
+            self._cumulative_weights = list(_accumulate(w / total for w in weights))
+        self._numbers_by_title = {normalize_book_title_string(self.title(k)): k for k in range(books)}
+
+    @staticmethod
+    def isbn(k):
+        return f"978{k:010d}"
+
+    @staticmethod
+    def number(isbn):
+        return int(isbn[3:]) if re.fullmatch(r"978\d{10}", isbn) else None
+
+    @staticmethod
+    def title(k):
+        return f"Standin Book {k} Volume {k % 7 + 1}"
+
+    @staticmethod
+    def author(k):
+        return f"Author Number {k % 997}"
+
+    def find_by_title(self, query):
+        return self._numbers_by_title.get(normalize_book_title_string(query))
+
+    def recommended(self, k):
+        rng = random.Random(self.seed * 1000003 + k)
+        if self.graph == ZIPF:
+            picks = rng.choices(range(self.books), cum_weights=self._cumulative_weights, k=self.recommendations)
+        else:
+            picks = [rng.randrange(self.books) for _ in range(self.recommendations)]
+        return list(dict.fromkeys(self.isbn(p) for p in picks if p != k))
+
+    def revision_of(self, k, revision, changed_fraction):
+        """The last revision of the site, up to `revision`, in which book k's page changed"""
+        for r in range(revision, 0, -1):
+            if random.Random(self.seed * 1000003 + k * 7919 + r).random() < changed_fraction:
+                return r
+        return 0
+
+    def write_input_csv(self, path, rows):
+        """Write the top10k input CSV of the first `rows` books, in the encoding main.py reads it with"""
+        with open(path, "w", encoding="ISO-8859-1") as f:
+            f.write("book_title,book_author\n")
+            for k in range(min(rows, self.books)):
+                f.write(f"{self.title(k)},{self.author(k)}\n")
+
+
+def _accumulate(values):
+    total = 0.0
+    for value in values:
+        total += value
+        yield total
+
+
+PAGE = """<!DOCTYPE html>
+<html lang="da"><head><meta charset="utf-8"><title>{title}</title>
+<script>window.dataLayer = window.dataLayer || [];</script></head>
+<body><header class="site-header"><nav><a href="/dk">Saxo</a></nav></header>
+{main}
+<footer class="site-footer"><p class="small">Saxo stand-in</p></footer></body></html>
+"""
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real site
+    server_version = "SaxoStandin/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def base_url(self):
+        return f"http://{self.headers.get('Host')}"
+
+    def book_url(self, k):
+        return f"{self.base_url}/dk/standin-book-{k}_{Catalogue.isbn(k)}"
+
+    def do_GET(self):
+        settings = self.server.settings
+        if settings.latency:
+            time.sleep(random.uniform(0.5, 1.5) * settings.latency)
+        if random.random() < settings.error_rate:
+            self.send_text(503, "Service Unavailable", "text/plain")
+            return
+
+        url = urlsplit(self.path)
+        match = re.fullmatch(r"/dk/standin-book-(\d+)_978\d{10}", url.path)
+        if url.path == "/dk/products/search":
+            self.search(parse_qs(url.query).get("query", [""])[0])
+        elif match and int(match.group(1)) < self.server.catalogue.books:
+            k = int(match.group(1))
+            revision = self.server.catalogue.revision_of(k, settings.revision, settings.changed_fraction)
+            etag = f'"{k}-{revision}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+            else:
+                self.send_text(200, self.book_page(k, revision), headers={"ETag": etag})
+        elif url.path.startswith("/dk/api/recommendations/"):
+            k = Catalogue.number(url.path.rsplit("/", 1)[1])
+            items = [{"Id": isbn} for isbn in self.server.catalogue.recommended(k)] if k is not None else []
+            self.send_text(200, json.dumps({"Items": items}), "application/json")
+        else:
+            self.send_text(404, "Not Found", "text/plain")
+
+    def search(self, query):
+        catalogue = self.server.catalogue
+        k = Catalogue.number(query)
+        if k is not None and k < catalogue.books:
+            # a search for an ISBN goes straight to the book page
+            self.send_response(302)
+            self.send_header("Location", self.book_url(k))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        k = catalogue.find_by_title(query)
+        rng = random.Random(query)
+        numbers = [rng.randrange(catalogue.books) for _ in range(SEARCH_DECOYS)]
+        if k is not None:
+            numbers.insert(rng.randrange(len(numbers) + 1), k)
+        teasers = "".join(self.teaser(n) for n in numbers)
+        main = f'<main class="search-results"><div class="row product-list">{teasers}</div></main>'
+        self.send_text(200, PAGE.format(title=f"Søgeresultater for {html.escape(query)}", main=main))
+
+    def teaser(self, k):
+        payload = {"Id": Catalogue.isbn(k), "Title": Catalogue.title(k), "Authors": [Catalogue.author(k)],
+                   "Work": "Paperback", "Url": self.book_url(k)}
+        return (f'<div class="product-list-teaser col-6 col-md-3"><a href="{self.book_url(k)}" '
+                f'data-val="{html.escape(json.dumps(payload))}"><h3 class="text-m">{Catalogue.title(k)}</h3></a>'
+                f'<p class="text-s">{Catalogue.author(k)}</p></div>')
+
+    def book_page(self, k, revision=0):
+        catalogue = self.server.catalogue
+        isbn = Catalogue.isbn(k)
+        if self.server.settings.carousel == STATIC:
+            covers = "".join(f'<div class="new-teaser slick-slide"><a class="cover-container" href="/dk/{r}" '
+                             f'data-product-identifier="{r}"></a></div>' for r in catalogue.recommended(k))
+            banner = (f'<div id="product-page-banner-container"><div class="book-slick-slider slick-initialized '
+                      f'slick-slider">{covers}</div></div>')
+        else:
+            banner = (f'<div id="product-page-banner-container" data-url="/dk/api/recommendations/{isbn}">'
+                      f'<div class="book-slick-slider"></div></div>')
+        main = f"""<main class="product-page">
+<h1 class="text-xl sm:text-l text-800 mb-0">{Catalogue.title(k)}</h1>
+<div class="text-s product-autor"><a class="link link--black" href="/dk/a">{Catalogue.author(k)}</a></div>
+<div class="product-rating"><span class="text-l text-800">{(k + revision) % 5},{(k + 3 * revision) % 10}</span> <span class="text-s">({(k + 37 * revision) % 500} anmeldelser)</span></div>
+<div class="product-variant"><a class="active icon-book" href="/dk/standin-book-{k}_{isbn}">Paperback</a></div>
+<p class="mb-0">{"Synthetic description of a stand-in book. " * 8}</p>
+<ul class="description-dot-list">
+<li><span class="text-700">Sprog</span> Dansk</li>
+<li><span class="text-700">Sidetal</span> {100 + k % 400}</li>
+<li><span class="text-700">Udgivelsesdato</span> 01-01-2020</li>
+<li><span class="text-700">ISBN13</span> {isbn}</li>
+<li><span class="text-700">Forlag</span> Standin Forlag</li>
+<li><span class="text-700">Format</span> Paperback</li>
+</ul>
+{banner}
+</main>"""
+        return PAGE.format(title=Catalogue.title(k), main=main)
+
+    def send_text(self, status, text, content_type="text/html; charset=utf-8", headers=None):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StandinSettings:
+    """How the stand-in behaves, `revision` can be raised while it runs to change a share of the book pages"""
+
+    def __init__(self, latency=0.0, error_rate=0.0, carousel=STATIC, revision=0, changed_fraction=0.1):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.carousel = carousel
+        self.revision = revision
+        self.changed_fraction = changed_fraction
+
+
+def start_standin_server(catalogue, settings, port=DEFAULT_PORT):
+    """Serve the catalogue from a background thread and return the server, stop it with `shutdown()`"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), StandinHandler)
+    server.daemon_threads = True
+    server.catalogue = catalogue
+    server.settings = settings
+    threading.Thread(target=server.serve_forever, name="saxo-standin", daemon=True).start()
+    return server
+
+
+def add_standin_arguments(parser):
+    parser.add_argument("--books", type=int, default=DEFAULT_BOOKS, help="size of the catalogue")
+    parser.add_argument("--recommendations", type=int, default=DEFAULT_RECOMMENDATIONS,
+                        help="recommendations on every book page")
+    parser.add_argument("--graph", choices=(UNIFORM, ZIPF), default=UNIFORM, help="shape of the recommendation graph")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="mean response latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 503")
+    parser.add_argument("--carousel", choices=(STATIC, AJAX), default=STATIC,
+                        help="recommendations in the page or loaded from a data request")
+    parser.add_argument("--revision", type=int, default=0,
+                        help="revision of the site, every revision changes the ratings of a share of the books")
+    parser.add_argument("--changed-fraction", type=float, default=0.1,
+                        help="share of the books whose page changes in a revision")
+
+
+def standin_from_arguments(args):
+    return (Catalogue(args.books, args.recommendations, args.graph, args.seed),
+            StandinSettings(args.latency, args.error_rate, args.carousel, args.revision, args.changed_fraction))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_standin_arguments(parser)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--write-input-csv", default=None, metavar="PATH",
+                        help="write the top10k input CSV of the catalogue's first books and exit")
+    parser.add_argument("--input-rows", type=int, default=10000, help="rows of the written input CSV")
+    args = parser.parse_args()
+
+    catalogue, settings = standin_from_arguments(args)
+    if args.write_input_csv:
+        catalogue.write_input_csv(args.write_input_csv, args.input_rows)
+        return
+
+    server = start_standin_server(catalogue, settings, args.port)
+    print(f"Serving {args.books} books on http://127.0.0.1:{args.port}, Ctrl+C to stop")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Compare reading the search result teasers with BeautifulSoup against the streaming teaser scanner.
+
+Run from the repository root on the search pages recorded in the page cache:
+python benchmarks/search_teasers.py [--cache-dir data/cache] [--pages 500]
+"""
+import argparse
+import gzip
+import os
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from page_cache import PageCache, DEFAULT_CACHE_DIR, SEARCH, ISBN_SEARCH  # noqa: E402
+from teasers import iter_teaser_payloads  # noqa: E402
+
+
+def read_recorded_search_pages(cache_dir, limit):
+    cache = PageCache(cache_dir)
+    pages = []
+    try:
+        for kind in (SEARCH, ISBN_SEARCH):
+            for _, blob_path, _ in cache.entries(kind)[:limit - len(pages)]:
+                with gzip.open(blob_path, "rb") as f:
+                    pages.append(f.read().decode("utf-8"))
+    finally:
+        cache.close()
+    return pages
+
+
+def soup_teaser_payloads(search_page_html):
+    """The payloads the way the search functions read them before the streaming scanner"""
+    soup = BeautifulSoup(search_page_html, "html.parser")
+    for book in soup.find_all("div", class_="product-list-teaser"):
+        link = book.find("a")
+        yield link.get("data-val") if link is not None else None
+
+
+def time_all_teasers(teaser_payloads, pages):
+    start = time.perf_counter()
+    for page in pages:
+        for _ in teaser_payloads(page):
+            pass
+    return (time.perf_counter() - start) / len(pages)
+
+
+def time_first_teaser(teaser_payloads, pages):
+    """The best case of the search functions, the first teaser is the book they look for"""
+    start = time.perf_counter()
+    for page in pages:
+        next(teaser_payloads(page), None)
+    return (time.perf_counter() - start) / len(pages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--pages", type=int, default=500, help="maximum number of recorded pages to use")
+    args = parser.parse_args()
+
+    pages = read_recorded_search_pages(args.cache_dir, args.pages)
+    if not pages:
+        sys.exit(f"No search pages are recorded in {args.cache_dir}, run a crawl with the page cache first")
+
+    mismatches = sum(list(soup_teaser_payloads(page)) != list(iter_teaser_payloads(page)) for page in pages)
+    print(f"{len(pages)} recorded search pages, {mismatches} with different teaser payloads")
+
+    print(f"{'operation':<16}{'soup':>14}{'streaming':>14}{'speedup':>10}")
+    for operation, timer in (("all teasers", time_all_teasers), ("first teaser", time_first_teaser)):
+        timings = [timer(teaser_payloads, pages) for teaser_payloads in (soup_teaser_payloads, iter_teaser_payloads)]
+        print(f"{operation:<16}" + "".join(f"{t * 1e3:>11.2f} ms" for t in timings) +
+              f"{timings[0] / timings[1]:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
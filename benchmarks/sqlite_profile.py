@@ -0,0 +1,110 @@
+"""Compare lookups and inserts on a 100k-book database without and with the storage profiles and indexes.
+
+Run from the repository root: python benchmarks/sqlite_profile.py [--books 100000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, event, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Base, Book, recommendation_table, STORAGE_PROFILES  # noqa: E402
+
+RECOMMENDATIONS_PER_BOOK = 5
+LOOKUPS = 2000
+INSERTED_BOOKS = 500
+
+
+def create_benchmark_engine(path, profile):
+    engine = create_engine(f"sqlite:///{path}")
+    if profile is not None:
+        @event.listens_for(engine, "connect")
+        def apply_profile(dbapi_connection, connection_record):
+            for pragma, value in STORAGE_PROFILES[profile].items():
+                dbapi_connection.execute(f"PRAGMA {pragma} = {value}")
+
+    Base.metadata.create_all(engine)
+    if profile is None:
+        # the database as it was created before the indexes existed
+        with engine.begin() as connection:
+            for table in Base.metadata.sorted_tables:
+                for index in table.indexes:
+                    connection.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+    return engine
+
+
+def book_row(n, top10k=0):
+    return {"isbn": f"978{n:010d}", "title": f"book {n}", "page_count": 300, "published_date": "2020-01-01",
+            "publisher": "publisher", "format": "Paperback", "num_of_ratings": 10, "rating": "4.5",
+            "description": "description " * 20, "url": f"https://www.saxo.com/dk/book-{n}_978{n:010d}",
+            "top10k": top10k}
+
+
+def populate(engine, books):
+    rows = [book_row(n, top10k=n + 1 if n < 10000 else 0) for n in range(books)]
+    edges = [{"book_isbn": f"978{n:010d}", "recommended_isbn": f"978{random.randrange(books):010d}"}
+             for n in range(books) for _ in range(RECOMMENDATIONS_PER_BOOK)]
+    with engine.begin() as connection:
+        connection.execute(Book.__table__.insert(), rows)
+        connection.execute(recommendation_table.insert().prefix_with("OR IGNORE"), edges)
+
+
+def time_lookups(engine, books):
+    queries = {
+        "lookup by url": ("SELECT isbn FROM book WHERE url = :value",
+                          lambda n: f"https://www.saxo.com/dk/book-{n}_978{n:010d}"),
+        "lookup by top10k": ("SELECT isbn FROM book WHERE top10k = :value", lambda n: n % 10000 + 1),
+        "recommended_by": ("SELECT book_isbn FROM recommendation WHERE recommended_isbn = :value",
+                           lambda n: f"978{n:010d}"),
+    }
+    results = {}
+    with engine.connect() as connection:
+        for name, (query, value) in queries.items():
+            start = time.perf_counter()
+            for _ in range(LOOKUPS):
+                connection.execute(text(query), {"value": value(random.randrange(books))}).fetchall()
+            results[name] = (time.perf_counter() - start) / LOOKUPS
+    return results
+
+
+def time_inserts(engine, books):
+    """Insert books the way the crawl does: one transaction per book with its recommendation edges"""
+    start = time.perf_counter()
+    for n in range(books, books + INSERTED_BOOKS):
+        with engine.begin() as connection:
+            connection.execute(Book.__table__.insert(), book_row(n))
+            connection.execute(recommendation_table.insert().prefix_with("OR IGNORE"),
+                               [{"book_isbn": f"978{n:010d}", "recommended_isbn": f"978{random.randrange(n):010d}"}
+                                for _ in range(RECOMMENDATIONS_PER_BOOK)])
+    return {"insert book + edges": (time.perf_counter() - start) / INSERTED_BOOKS}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--books", type=int, default=100000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for profile in (None, "default", "bulk"):
+            label = profile or "untuned"
+            engine = create_benchmark_engine(os.path.join(directory, f"{label}.db"), profile)
+            populate(engine, args.books)
+            results[label] = {**time_lookups(engine, args.books), **time_inserts(engine, args.books)}
+            engine.dispose()
+
+    print(f"{'operation':<22}" + "".join(f"{label:>14}" for label in results) + f"{'speedup':>10}")
+    for operation in results["untuned"]:
+        timings = [results[label][operation] for label in results]
+        print(f"{operation:<22}" + "".join(f"{t * 1e6:>11.1f} us" for t in timings) +
+              f"{timings[0] / min(timings[1:]):>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
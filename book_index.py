@@ -0,0 +1,185 @@
+import logging
+import threading
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from database import Book, Author
+
+
+class BookIndex:
+    """In-memory sets of the scraped top10k ids, ISBNs, book urls and author names.
+
+    Loaded in bulk once and kept up to date by session events: the rows a flush writes are kept with the session
+    and published to the shared sets when its transaction commits, dropped when it rolls back. So the checks never
+    need a database round-trip and never see the uncommitted rows of another session.
+    """
+
+    def __init__(self):
+        self.top10k_ids = set()
+        self.isbns = set()
+        self.urls = set()
+        self.author_names = set()
+        self._lock = threading.Lock()
+
+    def load(self, session):
+        # on a connection of its own, the session's transaction may hold uncommitted rows
+        with session.get_bind().connect() as connection:
+            for isbn, url, top10k in connection.execute(select(Book.isbn, Book.url, Book.top10k)):
+                self.isbns.add(isbn)
+                self.urls.add(url)
+                if top10k:
+                    self.top10k_ids.add(top10k)
+            self.author_names.update(name for (name,) in connection.execute(select(Author.name)))
+        logging.info(f"Loaded the book index: {len(self.isbns)} books, {len(self.top10k_ids)} top10k books, "
+                     f"{len(self.author_names)} authors")
+
+    def has_top10k(self, top10k):
+        return top10k in self.top10k_ids
+
+    def has_isbn(self, isbn):
+        return isbn in self.isbns
+
+    def has_url(self, url):
+        return url in self.urls
+
+    def has_author(self, name):
+        return name in self.author_names
+
+    def add_book(self, isbn, url, top10k=0):
+        """Record a book written outside of the ORM sessions, e.g. buffered by the write-behind writer"""
+        with self._lock:
+            self.isbns.add(isbn)
+            self.urls.add(url)
+            if top10k:
+                self.top10k_ids.add(top10k)
+
+    def add_author(self, name):
+        with self._lock:
+            self.author_names.add(name)
+
+    def publish(self, changes):
+        """Apply the committed changes of a transaction, {(set name, value): added or removed}"""
+        with self._lock:
+            for (name, value), added in changes.items():
+                if added:
+                    getattr(self, name).add(value)
+                else:
+                    getattr(self, name).discard(value)
+
+
+class SessionBookIndex:
+    """The shared index as one session sees it, with the uncommitted changes of its transaction on top"""
+
+    def __init__(self, index, changes):
+        self.index = index
+        self.changes = changes
+
+    def _has(self, name, value):
+        return self.changes.get((name, value), value in getattr(self.index, name))
+
+    def has_top10k(self, top10k):
+        return self._has("top10k_ids", top10k)
+
+    def has_isbn(self, isbn):
+        return self._has("isbns", isbn)
+
+    def has_url(self, url):
+        return self._has("urls", url)
+
+    def has_author(self, name):
+        return self._has("author_names", name)
+
+    def add_book(self, isbn, url, top10k=0):
+        self.index.add_book(isbn, url, top10k)
+
+    def add_author(self, name):
+        self.index.add_author(name)
+
+
+def _keep_replaced_value(target, value, old_value, initiator):
+    pass
+
+
+# the indexed columns of a book keep the value they replace, also when it was expired, so that it can be removed
+for _attribute in (Book.isbn, Book.url, Book.top10k):
+    event.listen(_attribute, "set", _keep_replaced_value, active_history=True)
+
+
+def old_value(instance, attribute):
+    """The value the attribute had before the flush, None if it's unchanged"""
+    deleted = inspect(instance).attrs[attribute].history.deleted
+    return deleted[0] if deleted else None
+
+
+def record_flush(session, changes):
+    """Record the rows written by the flush in the transaction's changes, {(set name, value): added or removed}"""
+    def record(name, value, added):
+        if value is None or (name == "top10k_ids" and not value):
+            return
+        # books share urls, e.g. the default books and a top10k book saved twice under a suffixed ISBN
+        if name == "urls" and not added and session.connection().execute(
+                select(Book.isbn).where(Book.url == value).limit(1)).first() is not None:
+            return
+        changes[(name, value)] = added
+
+    for instance in session.dirty:
+        if isinstance(instance, Book):
+            # a changed book no longer has its old ISBN, url or top10k id
+            for name, attribute in (("isbns", "isbn"), ("urls", "url"), ("top10k_ids", "top10k")):
+                record(name, old_value(instance, attribute), False)
+    for instance in (*session.new, *session.dirty):
+        if isinstance(instance, Book):
+            record("isbns", instance.isbn, True)
+            record("urls", instance.url, True)
+            record("top10k_ids", instance.top10k, True)
+        elif isinstance(instance, Author):
+            record("author_names", instance.name, True)
+    for instance in session.deleted:
+        if isinstance(instance, Book):
+            record("isbns", instance.isbn, False)
+            record("urls", instance.url, False)
+            record("top10k_ids", instance.top10k, False)
+        elif isinstance(instance, Author):
+            record("author_names", instance.name, False)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+# key of the index changes of the open transaction in `session.info`
+PENDING_CHANGES = "book_index_changes"
+
+
+def book_index(session):
+    """Return the shared book index as the session sees it, loading it in bulk with the session on first use"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = BookIndex()
+            _index.load(session)
+        return SessionBookIndex(_index, session.info.setdefault(PENDING_CHANGES, {}))
+
+
+def reset_book_index():
+    """Drop the shared index, e.g. after the database was changed outside of the sessions"""
+    global _index
+    with _index_lock:
+        _index = None
+
+
+@event.listens_for(Session, "after_flush")
+def _record_book_index_changes(session, flush_context):
+    record_flush(session, session.info.setdefault(PENDING_CHANGES, {}))
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_book_index_changes(session):
+    changes = session.info.pop(PENDING_CHANGES, None)
+    if _index is not None and changes:
+        _index.publish(changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_book_index_changes(session):
+    session.info.pop(PENDING_CHANGES, None)
@@ -0,0 +1,234 @@
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver import Chrome
+from selenium.webdriver.chrome.options import Options
+
+from metrics import timed, BROWSER_STARTUP
+
+# number of browsers, i.e. how many book pages can be rendered in parallel
+DEFAULT_POOL_SIZE = 2
+# a browser is restarted after serving this many pages to keep its memory usage in check
+DEFAULT_MAX_PAGES_PER_BROWSER = 50
+
+
+# bounds of the page readiness timeout, which follows the observed readiness times
+MIN_PAGE_READY_TIMEOUT = 5.0
+MAX_PAGE_READY_TIMEOUT = 30.0
+# the timeout is this many times the 95th percentile of the recent readiness times
+PAGE_READY_TIMEOUT_FACTOR = 3.0
+PAGE_READY_WINDOW = 200
+# readiness times needed before the timeout adapts, until then it's the max
+PAGE_READY_MIN_SAMPLES = 20
+
+# requests the lean profile blocks: images, fonts, stylesheets, media and trackers are not needed to read a book page
+LEAN_BLOCKED_URLS = (
+    "*.jpg", "*.jpeg", "*.png", "*.gif", "*.webp", "*.avif", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*.css",
+    "*.mp4", "*.webm", "*.mp3",
+    "*googletagmanager.com*", "*google-analytics.com*", "*doubleclick.net*", "*facebook.net*", "*facebook.com/tr*",
+    "*hotjar.com*", "*clarity.ms*", "*bing.com*", "*criteo.*", "*trustpilot.com*",
+)
+
+
+def default_chrome_options():
+    chrome_options = Options()
+    chrome_options.add_argument("--headless")
+    return chrome_options
+
+
+def lean_chrome_options():
+    """Headless Chrome that hands the page over once its DOM is parsed and that doesn't load images"""
+    chrome_options = default_chrome_options()
+    chrome_options.page_load_strategy = "eager"
+    chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+    chrome_options.add_argument("--disable-extensions")
+    chrome_options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+    return chrome_options
+
+
+class AdaptiveTimeout:
+    """A timeout that follows the observed durations, `factor` times their 95th percentile within the bounds"""
+
+    def __init__(self, minimum=MIN_PAGE_READY_TIMEOUT, maximum=MAX_PAGE_READY_TIMEOUT,
+                 factor=PAGE_READY_TIMEOUT_FACTOR, window=PAGE_READY_WINDOW, min_samples=PAGE_READY_MIN_SAMPLES):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.min_samples = min_samples
+        self._durations = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def current(self):
+        with self._lock:
+            if len(self._durations) < self.min_samples:
+                return self.maximum
+            durations = sorted(self._durations)
+        percentile = durations[int(0.95 * (len(durations) - 1))]
+        return min(max(self.factor * percentile, self.minimum), self.maximum)
+
+    def record(self, duration):
+        with self._lock:
+            self._durations.append(duration)
+
+    def record_timeout(self, timeout):
+        """A wait that timed out took at least the timeout, which raises the next ones"""
+        self.record(timeout)
+
+
+class PooledBrowser:
+    """A long-lived WebDriver together with the number of pages it has served"""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages_served = 0
+
+
+class BrowserPool:
+    """Thread-safe pool of long-lived headless Chrome instances.
+
+    Browsers are started lazily up to `size`, health checked on checkout and recycled after
+    `max_pages_per_browser` pages or when they fail.
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, max_pages_per_browser=DEFAULT_MAX_PAGES_PER_BROWSER,
+                 options_factory=default_chrome_options, blocked_urls=()):
+        self.size = size
+        self.max_pages_per_browser = max_pages_per_browser
+        self.options_factory = options_factory
+        self.blocked_urls = blocked_urls
+        self._idle = []  # a stack, so that the warmest browser is reused first
+        # guards the idle browsers and the started count, notified whenever a browser is checked in or retired
+        self._available = threading.Condition()
+        self._started = 0
+        self._closed = False
+
+    def _start_browser(self):
+        with timed(BROWSER_STARTUP):
+            driver = Chrome(options=self.options_factory())
+            if self.blocked_urls:
+                try:
+                    driver.execute_cdp_cmd("Network.enable", {})
+                    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": list(self.blocked_urls)})
+                except WebDriverException:
+                    driver.quit()
+                    raise
+            return PooledBrowser(driver)
+
+    def _release_slot(self):
+        """Free the slot of a browser that is gone, a waiting checkout can start a new one in it"""
+        with self._available:
+            self._started -= 1
+            self._available.notify()
+
+    def _retire(self, browser):
+        self._release_slot()
+        try:
+            browser.driver.quit()
+        except WebDriverException as e:
+            logging.info(f"Failed to quit a retired browser: {e!r}")
+
+    @staticmethod
+    def is_healthy(browser):
+        try:
+            return browser.driver.execute_script("return 1") == 1
+        except WebDriverException:
+            return False
+
+    def checkout(self):
+        """Return an idle browser, start a new one if the pool is not full, otherwise wait for a checkin"""
+        while True:
+            with self._available:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("The browser pool is closed")
+                    if self._idle:
+                        browser = self._idle.pop()
+                        break
+                    if self._started < self.size:
+                        self._started += 1
+                        browser = None
+                        break
+                    self._available.wait()
+
+            if browser is None:
+                try:
+                    return self._start_browser()
+                except Exception:
+                    self._release_slot()
+                    raise
+            if self.is_healthy(browser):
+                return browser
+            logging.info("Browser failed the health check RESTARTING")
+            self._retire(browser)
+
+    def checkin(self, browser, broken=False):
+        browser.pages_served += 1
+        with self._available:
+            keep = not (broken or self._closed or browser.pages_served >= self.max_pages_per_browser)
+            if keep:
+                self._idle.append(browser)
+                self._available.notify()
+        if not keep:
+            self._retire(browser)
+
+    @contextmanager
+    def browser(self):
+        """Check out a WebDriver for the duration of the block"""
+        browser = self.checkout()
+        broken = False
+        try:
+            yield browser.driver
+        except WebDriverException:
+            broken = True
+            raise
+        finally:
+            self.checkin(browser, broken)
+
+    def close(self):
+        with self._available:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._available.notify_all()  # the waiting checkouts raise
+        for browser in idle:
+            self._retire(browser)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+# shared by all browsers, the book pages of a crawl take about as long to get ready in any of them
+page_ready_timeout = AdaptiveTimeout()
+
+
+def configure_browser_pool(size=DEFAULT_POOL_SIZE, max_pages_per_browser=DEFAULT_MAX_PAGES_PER_BROWSER, lean=False):
+    """Replace the shared browser pool, e.g. with a different size or the lean profile, closing the previous one"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        if lean:
+            _pool = BrowserPool(size, max_pages_per_browser, lean_chrome_options, LEAN_BLOCKED_URLS)
+        else:
+            _pool = BrowserPool(size, max_pages_per_browser)
+        return _pool
+
+
+def get_browser_pool():
+    """Return the shared browser pool, creating it with the default settings on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool()
+        return _pool
+
+
+def close_browser_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
@@ -0,0 +1,303 @@
+"""Crawl the top10k books of the input CSV and the books they recommend, the `crawl` command of main.py"""
+import argparse
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import frontier
+from book_index import book_index
+from browser_pool import configure_browser_pool, close_browser_pool, DEFAULT_POOL_SIZE, \
+    DEFAULT_MAX_PAGES_PER_BROWSER
+from crawl_logging import configure_logging, book_context, DEFAULT_LOG_FILE, DEFAULT_SAMPLE_RATE, LOG_FORMATS
+import database
+from database import get_engine, create_session, set_storage_profile, set_database_path, STORAGE_PROFILES, \
+    DEFAULT_DATABASE_PATH
+from fetching import DEFAULT_CONCURRENCY
+from frontier import DEFAULT_MAX_DEPTH
+from metrics import metrics, StatsReporter, DEFAULT_STATS_FILE, DEFAULT_STATS_INTERVAL
+from page_cache import configure_page_cache, DEFAULT_CACHE_DIR, DEFAULT_TTL, DEFAULT_MAX_BYTES, DEFAULT_NEGATIVE_TTL
+from pipeline import run_pipeline, DEFAULT_PARSE_WORKERS, DEFAULT_QUEUE_SIZE
+from rate_limit import configure_rate_limits, DEFAULT_INITIAL_RATE, DEFAULT_MIN_RATE, DEFAULT_MAX_RATE
+from refresh import refresh_stale_books, DEFAULT_REFRESH_AGE, DEFAULT_REFRESH_WORKERS
+import retry_queue
+from retry import drain_retry_queue, DEFAULT_RETRY_WORKERS
+from retry_queue import set_retry_base_delay, RETRY_BASE_DELAY, DEFAULT_MAX_ATTEMPTS
+from scraping import enable_fast_path, enable_write_behind, enable_retry_queue, set_max_crawl_depth, \
+    set_saxo_base_url, scrape_and_save_recommended_book
+from utils import normalize_author_series, normalize_book_title_series, SAXO_BASE_URL
+from write_behind import WriteBehindWriter, DEFAULT_BATCH_SIZE, DEFAULT_FLUSH_INTERVAL, DEFAULT_JOURNAL_PATH
+
+DEFAULT_INPUT_CSV = "data/top_10k_books.csv"
+# frontier workers, they share the browser pool with the top10k books
+DEFAULT_FRONTIER_WORKERS = 2
+# extra pause of a frontier worker between two books, the requests are already paced by the rate limiter
+DEFAULT_FRONTIER_DELAY = 0.0
+# how long an idle frontier worker waits before looking for new entries
+FRONTIER_IDLE_POLL = 2.0
+
+
+# todo add a check for book 34 with url error
+
+def read_input_csv(file_path):
+    """Read the CSV file and return the list of tuples (book_title, book_author) with the strings normalized.
+
+    The whole columns are normalized at once, a missing title or author becomes an empty string."""
+    # pandas is imported only here, a refresh doesn't read the input
+    import pandas as pd
+    df = pd.read_csv(file_path, encoding="ISO-8859-1")
+    titles = normalize_book_title_series(df["book_title"]).fillna('')
+    authors = normalize_author_series(df["book_author"]).fillna('')
+    book_info = list(zip(titles, authors))
+    return book_info
+
+
+def is_book_scraped_top10k(session, i):
+    """Check if the book is already in the database based on top10k value"""
+    return book_index(session).has_top10k(i)
+
+
+def shard_row_range(total_rows, shard, shards):
+    """Return the range of the row indexes in the shard-th of `shards` equal slices of the input, counting from 1"""
+    return range(total_rows * (shard - 1) // shards, total_rows * shard // shards)
+
+
+def parse_shard(value):
+    try:
+        shard, shards = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, e.g. 1/4, got {value}")
+    if not 1 <= shard <= shards:
+        raise argparse.ArgumentTypeError(f"the shard must be between 1 and {shards}, got {shard}")
+    return shard, shards
+
+
+def parse_row_range(value):
+    try:
+        first, last = (int(part) for part in value.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected FIRST:LAST, e.g. 1:2500, got {value}")
+    if not 1 <= first <= last:
+        raise argparse.ArgumentTypeError(f"expected 1 <= FIRST <= LAST, got {value}")
+    return range(first - 1, last)
+
+
+def write_behind_journal_path(database_path):
+    """Each database gets its own journal, so that shards crawled on the same machine don't share one"""
+    if database_path == DEFAULT_DATABASE_PATH:
+        return DEFAULT_JOURNAL_PATH
+    return os.path.join(os.path.dirname(DEFAULT_JOURNAL_PATH),
+                        f"write_behind_journal_{os.path.splitext(os.path.basename(database_path))[0]}.jsonl")
+
+
+def books_to_scrape(book_info, session, row_range=None):
+    """Yield (i, title, author) for every book in the row range, all by default, that is not scraped yet"""
+    for i in row_range if row_range is not None else range(len(book_info)):
+        if i >= len(book_info):
+            break
+        title, author = book_info[i]
+        if is_book_scraped_top10k(session, i + 1):
+            logging.info(f"Book {i + 1} already scraped SKIPPING")
+            continue
+
+        if not title:
+            logging.critical(f"Title is missing for book {i + 1} ABORTING")
+            continue
+        if not author:
+            logging.info(f"Author is missing for book {i + 1}: {title}")
+        yield (i, title, author)
+
+
+def drain_frontier(producers_done, stop, delay=DEFAULT_FRONTIER_DELAY):
+    """Scrape the books in the crawl frontier until it's empty and no more books can be pushed to it"""
+    session = create_session()
+    try:
+        while not stop.is_set():
+            entry = frontier.claim(session)
+            if entry is None:
+                if producers_done.is_set() and not frontier.has_unfinished_work(session):
+                    return
+                time.sleep(FRONTIER_IDLE_POLL)
+                continue
+
+            with book_context(isbn=entry.isbn):
+                scrape_and_save_recommended_book(entry, session)
+            if delay:
+                time.sleep(delay)
+    finally:
+        session.close()
+
+
+def add_input_arguments(parser):
+    """The arguments choosing the input rows and the database they go to, shared with the reextract command.
+
+    Returns the group of the mutually exclusive ways to pick the rows."""
+    parser.add_argument("--input-csv", default=DEFAULT_INPUT_CSV)
+    parser.add_argument("--database", default=None,
+                        help=f"SQLite database file to crawl into, by default {DEFAULT_DATABASE_PATH} "
+                             f"or the shard's own")
+    rows = parser.add_mutually_exclusive_group()
+    rows.add_argument("--shard", type=parse_shard, default=None, metavar="I/N",
+                      help="crawl only the I-th of N equal slices of the input into the shard's own database")
+    rows.add_argument("--rows", type=parse_row_range, default=None, metavar="FIRST:LAST",
+                      help="crawl only the input rows FIRST to LAST, counting from 1, into their own database")
+    parser.add_argument("--storage-profile", choices=sorted(STORAGE_PROFILES), default="default",
+                        help="SQLite pragmas, 'bulk' writes faster but an OS crash or power loss may corrupt "
+                             "the database, which must then be rebuilt")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="directory of the fetched pages cache")
+    parser.add_argument("--log-file", default=DEFAULT_LOG_FILE)
+    parser.add_argument("--log-format", choices=LOG_FORMATS, default="text",
+                        help="'json' writes every record as a JSON object with its structured fields")
+    parser.add_argument("--log-sample-rate", type=float, default=DEFAULT_SAMPLE_RATE,
+                        help="INFO records per second kept from one place in the code, 0 keeps them all")
+    parser.add_argument("--trace-book", action="append", default=[], metavar="ROW|ISBN",
+                        help="log everything that happens to the book at DEBUG, by its input row (top10k books) or "
+                             "ISBN (recommended and refreshed books), repeatable")
+    return rows
+
+
+def add_arguments(parser):
+    rows = add_input_arguments(parser)
+    rows.add_argument("--refresh", action="store_true",
+                      help="scrape the saved books again once they are stale instead of the input, writing only "
+                           "what changed")
+    parser.add_argument("--search-concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="number of search queries kept in flight")
+    parser.add_argument("--browsers", type=int, default=DEFAULT_POOL_SIZE,
+                        help="size of the browser pool, i.e. number of book pages rendered in parallel")
+    parser.add_argument("--parse-workers", type=int, default=DEFAULT_PARSE_WORKERS,
+                        help="number of processes matching search results and extracting book pages")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="capacity of the queues between the pipeline stages")
+    parser.add_argument("--max-pages-per-browser", type=int, default=DEFAULT_MAX_PAGES_PER_BROWSER,
+                        help="restart a browser after it has rendered this many pages")
+    parser.add_argument("--lean-browser", action="store_true",
+                        help="render the book pages without images, fonts, stylesheets and trackers, reading them as "
+                             "soon as their details and recommendations are in")
+    parser.add_argument("--fast", action="store_true",
+                        help="fetch book pages over plain HTTP and use the browser only as a fallback")
+    parser.add_argument("--cache-ttl-days", type=float, default=DEFAULT_TTL / (24 * 60 * 60),
+                        help="fetch cached pages again once they are older than this")
+    parser.add_argument("--cache-max-gb", type=float, default=DEFAULT_MAX_BYTES / 1024 ** 3,
+                        help="evict the least recently used pages above this size")
+    parser.add_argument("--negative-ttl-days", type=float, default=DEFAULT_NEGATIVE_TTL / (24 * 60 * 60),
+                        help="search again for a book that was not found once the result is older than this")
+    parser.add_argument("--no-cache", action="store_true", help="do not cache the fetched pages")
+    parser.add_argument("--write-behind", action="store_true",
+                        help="buffer the database writes and flush them in bulk, journaled batches")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="flush the write-behind buffer every this many records")
+    parser.add_argument("--flush-interval", type=float, default=DEFAULT_FLUSH_INTERVAL,
+                        help="flush the write-behind buffer at least every this many seconds")
+    parser.add_argument("--max-depth", type=int, default=DEFAULT_MAX_DEPTH,
+                        help="crawl depth of the recommendations, 1 scrapes the recommendations of the top10k books")
+    parser.add_argument("--frontier-workers", type=int, default=DEFAULT_FRONTIER_WORKERS,
+                        help="number of workers scraping the recommended books from the crawl frontier")
+    parser.add_argument("--frontier-delay", type=float, default=DEFAULT_FRONTIER_DELAY,
+                        help="extra pause of a frontier worker between two books, in seconds")
+    parser.add_argument("--retry-workers", type=int, default=DEFAULT_RETRY_WORKERS,
+                        help="number of background workers scraping the failed books again, 0 saves them as default "
+                             "books right away like before")
+    parser.add_argument("--retry-delay", type=float, default=RETRY_BASE_DELAY,
+                        help="seconds before the first retry of a failed book, doubled for every further one")
+    parser.add_argument("--retry-max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS,
+                        help="give a failed book up after this many retries")
+    parser.add_argument("--refresh-age-days", type=float, default=DEFAULT_REFRESH_AGE / (24 * 60 * 60),
+                        help="refresh the books not scraped for this many days")
+    parser.add_argument("--refresh-limit", type=int, default=None, help="refresh at most this many books, the stalest")
+    parser.add_argument("--refresh-workers", type=int, default=DEFAULT_REFRESH_WORKERS,
+                        help="number of workers refreshing books")
+    parser.add_argument("--initial-rate", type=float, default=DEFAULT_INITIAL_RATE,
+                        help="requests per second to Saxo to start with, adapted to how the site responds")
+    parser.add_argument("--min-rate", type=float, default=DEFAULT_MIN_RATE,
+                        help="lowest requests per second the rate limiter backs off to")
+    parser.add_argument("--max-rate", type=float, default=DEFAULT_MAX_RATE,
+                        help="highest requests per second the rate limiter speeds up to")
+    parser.add_argument("--saxo-url", default=SAXO_BASE_URL,
+                        help="base url of Saxo, e.g. a local stand-in server for load tests")
+    parser.add_argument("--stats-file", default=DEFAULT_STATS_FILE,
+                        help="JSON file the per-stage latencies, outcome counts and throughput are dumped to")
+    parser.add_argument("--stats-interval", type=float, default=DEFAULT_STATS_INTERVAL,
+                        help="dump the stats file every this many seconds")
+
+
+def open_input(args, read_rows=True):
+    """Configure the logging and the database of the run, return the input books and the row range to crawl.
+
+    A shard or a row range goes to its own database file unless --database is given."""
+    configure_logging(args.log_file, args.log_format, args.log_sample_rate, args.trace_book)
+    logging.info("Starting the scraping process")
+    set_storage_profile(args.storage_profile)
+    book_info = read_input_csv(args.input_csv) if read_rows else []
+    row_range = args.rows
+    database_path = args.database or DEFAULT_DATABASE_PATH
+    if args.shard is not None:
+        row_range = shard_row_range(len(book_info), *args.shard)
+        database_path = args.database or f"scraped_books_shard_{args.shard[0]}_of_{args.shard[1]}.db"
+    elif row_range is not None:
+        database_path = args.database or f"scraped_books_rows_{row_range.start + 1}_{row_range.stop}.db"
+    set_database_path(database_path)
+    if row_range is not None:
+        logging.info(f"Crawling the input rows {row_range.start + 1} to {row_range.stop} into {database_path}")
+    return book_info, row_range
+
+
+def run(args):
+    book_info, row_range = open_input(args, read_rows=not args.refresh)
+    configure_rate_limits(args.initial_rate, args.min_rate, args.max_rate)
+    set_saxo_base_url(args.saxo_url)
+    session = create_session()
+    if not args.no_cache:
+        configure_page_cache(args.cache_dir, args.cache_ttl_days * 24 * 60 * 60, int(args.cache_max_gb * 1024 ** 3),
+                             args.negative_ttl_days * 24 * 60 * 60)
+
+    configure_browser_pool(args.browsers, args.max_pages_per_browser, args.lean_browser)
+    enable_fast_path(args.fast)
+    writer = WriteBehindWriter(get_engine(), args.batch_size, args.flush_interval,
+                               write_behind_journal_path(database.database_path)) if args.write_behind else None
+    enable_write_behind(writer)
+
+    set_max_crawl_depth(args.max_depth)
+    enable_retry_queue(args.retry_workers > 0)
+    set_retry_base_delay(args.retry_delay)
+    frontier.requeue_in_progress(session)
+    retry_queue.requeue_in_progress(session)
+    stats_reporter = StatsReporter(metrics, args.stats_file, args.stats_interval)
+    # the retries push to the frontier, so the frontier workers run until the retry workers are done
+    crawl_done = threading.Event()
+    producers_done = threading.Event()
+    stop = threading.Event()
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.frontier_workers + args.retry_workers) as frontier_executor:
+            workers = [frontier_executor.submit(drain_frontier, producers_done, stop, args.frontier_delay)
+                       for _ in range(args.frontier_workers)]
+            retry_workers = [frontier_executor.submit(drain_retry_queue, crawl_done, stop, args.retry_max_attempts,
+                                                     args.frontier_workers > 0)
+                             for _ in range(args.retry_workers)]
+            try:
+                if args.refresh:
+                    refresh_stale_books(session, args.refresh_age_days * 24 * 60 * 60, args.refresh_limit,
+                                        args.refresh_workers, stop)
+                else:
+                    rows = list(books_to_scrape(book_info, session, row_range))
+                    asyncio.run(run_pipeline(rows, session, args.search_concurrency, args.parse_workers,
+                                             args.browsers, args.queue_size))
+                crawl_done.set()
+                for worker in retry_workers:
+                    worker.result()
+            except BaseException:
+                stop.set()
+                raise
+            finally:
+                crawl_done.set()
+                producers_done.set()
+            for worker in workers:
+                worker.result()
+    finally:
+        close_browser_pool()
+        if writer is not None:
+            writer.close()
+        stats_reporter.close()
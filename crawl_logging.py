@@ -0,0 +1,194 @@
+"""Logging of the crawl through a queue, so that the threads scraping books never wait on the log file.
+
+The calling thread only puts the record on a queue, a listener thread writes it. Every record carries the book it
+was logged for, by input row and/or ISBN (see `book_context`), and the stage, outcome and duration when they are
+given as `extra`. Chatty INFO call sites are rate limited, WARNING and above is always kept and DEBUG only for the
+traced books.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_LOG_FILE = "data/app_errors.log"
+LOG_FORMATS = ("text", "json")
+# records per second kept from one INFO call site, 0 keeps them all, and how many it may log at once
+DEFAULT_SAMPLE_RATE = 20.0
+SAMPLE_BURST = 100
+TEXT_FORMAT = '%(asctime)s:%(levelname)s:%(message)s'
+# the structured fields of a record, in the order they are written
+FIELDS = ("book", "isbn", "stage", "outcome", "duration", "suppressed")
+# libraries whose DEBUG records are too large to trace, e.g. selenium logs the whole page source
+QUIET_LOGGERS = ("selenium",)
+
+# (input row, ISBN) of the book the calling thread or task is working on
+current_book = contextvars.ContextVar("current_book", default=(None, None))
+# input rows, as strings, and ISBNs of the books logged at DEBUG
+traced_books = frozenset()
+
+_listener = None
+_worker_listener = None
+_worker_queue = None
+# passed on to the worker processes, so that they sample and trace like the main process
+_settings = None
+
+
+@contextmanager
+def book_context(book=None, isbn=None):
+    """Attribute the records logged in the block to the book, by its input row counting from 1 and/or its ISBN"""
+    token = current_book.set((book, isbn))
+    try:
+        yield
+    finally:
+        current_book.reset(token)
+
+
+def is_traced(book, isbn):
+    return str(book) in traced_books or isbn in traced_books
+
+
+def tracing_current_book():
+    """Whether the book of the calling context is traced, to log what happens to it at DEBUG"""
+    return bool(traced_books) and is_traced(*current_book.get())
+
+
+def record_fields(record):
+    return [(name, getattr(record, name)) for name in FIELDS if getattr(record, name, None) is not None]
+
+
+class SamplingFilter(logging.Filter):
+    """Adds the book of the calling context to the record and drops the records over the sampling limits.
+
+    It runs in the calling thread, so a dropped record never reaches the queue. The records dropped at an INFO call
+    site are counted in the `suppressed` field of the next record kept there."""
+
+    def __init__(self, sample_rate=DEFAULT_SAMPLE_RATE, burst=SAMPLE_BURST):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.burst = burst
+        # call site -> [tokens, last refill, records suppressed since the last one kept]
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        book, isbn = current_book.get()
+        record.__dict__.setdefault("book", book)
+        record.__dict__.setdefault("isbn", isbn)
+        if record.levelno >= logging.WARNING or (traced_books and is_traced(record.book, record.isbn)):
+            return True
+        if record.levelno < logging.INFO:
+            return False
+        return self.sample_rate <= 0 or self._take_token(record)
+
+    def _take_token(self, record):
+        site = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(site)
+            if bucket is None:
+                bucket = self._buckets[site] = [self.burst, now, 0]
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.sample_rate)
+            bucket[1] = now
+            if tokens < 1:
+                bucket[0] = tokens
+                bucket[2] += 1
+                return False
+            bucket[0] = tokens - 1
+            record.suppressed, bucket[2] = bucket[2] or None, 0
+        return True
+
+
+class StructuredFormatter(logging.Formatter):
+    """The usual text line followed by the record's structured fields as key=value"""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record):
+        line = super().format(record)
+        fields = " ".join(f"{name}={value:.3f}" if isinstance(value, float) else f"{name}={value}"
+                          for name, value in record_fields(record))
+        return f"{line} [{fields}]" if fields else line
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record"""
+
+    def format(self, record):
+        return json.dumps({"time": record.created, "level": record.levelname, "logger": record.name,
+                           "message": record.getMessage(), **dict(record_fields(record))}, default=str)
+
+
+def install_queue_handler(log_queue, settings):
+    """Make the root logger put the records on `log_queue`, replacing its handlers"""
+    global traced_books, _settings
+    sample_rate, traced = settings
+    traced_books = traced
+    _settings = settings
+    handler = logging.handlers.QueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(sample_rate))
+    root = logging.getLogger()
+    for old_handler in root.handlers[:]:
+        root.removeHandler(old_handler)
+    root.addHandler(handler)
+    # without traced books the DEBUG records aren't even created
+    root.setLevel(logging.DEBUG if traced else logging.INFO)
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(logging.INFO)
+
+
+def configure_logging(path=DEFAULT_LOG_FILE, log_format="text", sample_rate=DEFAULT_SAMPLE_RATE, trace_books=()):
+    """Log the records of the root logger to `path` through a queue and a listener thread.
+
+    `trace_books` are the input rows and ISBNs of the books logged at DEBUG, without sampling."""
+    global _listener
+    close_logging()
+    file_handler = logging.FileHandler(path)
+    file_handler.setFormatter(JsonFormatter() if log_format == "json" else StructuredFormatter())
+    log_queue = queue.SimpleQueue()
+    install_queue_handler(log_queue, (sample_rate, frozenset(str(book) for book in trace_books)))
+    _listener = logging.handlers.QueueListener(log_queue, file_handler)
+    _listener.start()
+    atexit.register(close_logging)
+
+
+def configure_worker_logging(log_queue, settings):
+    """Initializer of the worker processes, their records go through `log_queue` to the main process"""
+    install_queue_handler(log_queue, settings)
+
+
+def worker_logging_options():
+    """The initializer arguments of a ProcessPoolExecutor whose workers log like the main process"""
+    global _worker_listener, _worker_queue
+    if _listener is None:
+        return {}
+    if _worker_queue is None:
+        _worker_queue = multiprocessing.Queue()
+        _worker_listener = logging.handlers.QueueListener(_worker_queue, *_listener.handlers)
+        _worker_listener.start()
+    return {"initializer": configure_worker_logging, "initargs": (_worker_queue, _settings)}
+
+
+def close_logging():
+    """Write the queued records and stop the listeners, the records logged after go to the default handling"""
+    global _listener, _worker_listener, _worker_queue
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        if isinstance(handler, logging.handlers.QueueHandler):
+            root.removeHandler(handler)
+    if _worker_listener is not None:
+        _worker_listener.stop()
+        _worker_queue.close()
+        _worker_queue.join_thread()
+        _worker_listener = _worker_queue = None
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
@@ -1,4 +1,8 @@
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Table, Text
+import threading
+import time
+
+from sqlalchemy import create_engine, event, inspect, text, Column, Integer, String, ForeignKey, Table, Text, Index, \
+    Float
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
 
@@ -15,6 +19,8 @@ recommendation_table = Table('recommendation', Base.metadata,
                              Column('book_isbn', ForeignKey('book.isbn'), primary_key=True),
                              Column('recommended_isbn', ForeignKey('book.isbn'), primary_key=True)
                              )
+# the primary key only covers lookups by book_isbn, this one serves the recommended_by side
+Index('ix_recommendation_recommended_isbn', recommendation_table.c.recommended_isbn)
 
 
 class Book(Base):
@@ -29,8 +35,14 @@ class Book(Base):
     num_of_ratings = Column(Integer)
     rating = Column(String)
     description = Column(Text)
-    url = Column(String)
-    top10k = Column(Integer, default=0)
+    url = Column(String, index=True)
+    top10k = Column(Integer, default=0, index=True)
+    # bookkeeping of the refresh, see refresh.py: when the book was last scraped, the hash of its scraped content and
+    # the validators of its page for conditional requests
+    scraped_at = Column(Float, default=time.time, index=True)
+    content_hash = Column(String)
+    etag = Column(String)
+    last_modified = Column(String)
 
     authors = relationship('Author', secondary=book_author, back_populates='books')
 
@@ -42,6 +54,10 @@ class Book(Base):
                                    backref='recommended_by')
 
 
+# the book columns that are not the book's data
+REFRESH_COLUMNS = ("scraped_at", "content_hash", "etag", "last_modified")
+
+
 class Author(Base):
     __tablename__ = 'author'
 
@@ -49,11 +65,143 @@ class Author(Base):
     books = relationship('Book', secondary=book_author, back_populates='authors')
 
 
-engine = create_engine('sqlite:///scraped_books.db')
-Base.metadata.create_all(engine)
+class FrontierEntry(Base):
+    """A recommended book waiting to be scraped, see frontier.py"""
+    __tablename__ = 'frontier'
+
+    isbn = Column(String, primary_key=True)
+    depth = Column(Integer, nullable=False)
+    priority = Column(Integer, nullable=False)
+    status = Column(String, nullable=False, default='pending')
+    attempts = Column(Integer, nullable=False, default=0)
+    discovered_at = Column(Float, nullable=False)
+
+
+Index('ix_frontier_status_priority', FrontierEntry.status, FrontierEntry.priority, FrontierEntry.discovered_at)
+
+# the books that recommended a frontier entry, linked to it once it's scraped
+frontier_parent_table = Table('frontier_parent', Base.metadata,
+                              Column('isbn', String, primary_key=True),
+                              Column('parent_isbn', String, primary_key=True)
+                              )
+
+
+class RetryEntry(Base):
+    """A book whose scrape failed, scraped again in the background, see retry_queue.py"""
+    __tablename__ = 'retry'
+
+    # the ISBN of a recommended book, or the input row of a top10k book, which is also the ISBN of its default book
+    isbn = Column(String, primary_key=True)
+    top10k = Column(Integer, nullable=False, default=0)
+    title = Column(String)
+    author = Column(String)
+    depth = Column(Integer, nullable=False, default=0)
+    reason = Column(String, nullable=False)
+    status = Column(String, nullable=False, default='pending')
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(Float, nullable=False)
+
+
+Index('ix_retry_status_next_attempt_at', RetryEntry.status, RetryEntry.next_attempt_at)
+
+
+# SQLite pragmas of the storage profiles, applied to every new connection
+STORAGE_PROFILES = {
+    # WAL with synchronous NORMAL: a committed transaction survives a crash of the process, a power loss or OS crash
+    # can lose the last commits (but never corrupts the file)
+    "default": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64 * 1024,  # negative values are in KiB, i.e. 64 MiB
+        "mmap_size": 256 * 1024 ** 2,
+        "temp_store": "MEMORY",
+    },
+    # for bulk crawls: no fsync at all. A crash of the process loses nothing, but an OS crash or power loss can
+    # corrupt the database file, which must then be rebuilt, e.g. with the reextract command or a new crawl
+    "bulk": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -256 * 1024,
+        "mmap_size": 1024 ** 3,
+        "temp_store": "MEMORY",
+    },
+}
+storage_profile = "default"
+
+DEFAULT_DATABASE_PATH = "scraped_books.db"
+
+
+def apply_storage_profile(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in STORAGE_PROFILES[storage_profile].items():
+        cursor.execute(f"PRAGMA {pragma} = {value}")
+    cursor.close()
+
+
+def set_storage_profile(profile):
+    """Switch the pragmas of the database connections, the open connections are replaced on their next checkout"""
+    global storage_profile
+    if profile not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown storage profile {profile}, expected one of {', '.join(STORAGE_PROFILES)}")
+    storage_profile = profile
+    if engine is not None:
+        engine.dispose()
+
+
+def migrate_columns(bind):
+    """Add the columns that are missing in a database file created before they were defined, they are all nullable"""
+    inspector = inspect(bind)
+    with bind.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} "
+                                            f"{column.type.compile(bind.dialect)}"))
+
+
+def migrate_indexes(bind):
+    """Create the indexes that are missing in a database file created before they were defined"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
+
+def create_database_engine(path):
+    """Create the engine of the database file, with the tables and indexes, using the storage profile's pragmas"""
+    database_engine = create_engine(f'sqlite:///{path}')
+    event.listen(database_engine, "connect", apply_storage_profile)
+    Base.metadata.create_all(database_engine)
+    migrate_columns(database_engine)
+    migrate_indexes(database_engine)
+    return database_engine
+
+
+# the engine of the crawled database, connected on first use, so that importing the module doesn't touch the file
+database_path = DEFAULT_DATABASE_PATH
+engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    global engine
+    with _engine_lock:
+        if engine is None:
+            engine = create_database_engine(database_path)
+        return engine
+
+
+def set_database_path(path):
+    """Crawl into another database file, e.g. the shard's own database. Call it before the first session."""
+    global database_path, engine
+    with _engine_lock:
+        if engine is not None:
+            engine.dispose()
+            engine = None
+        database_path = path
 
 
 def create_session():
-    Session = sessionmaker(bind=engine)
+    Session = sessionmaker(bind=get_engine())
     session = Session()
     return session
@@ -0,0 +1,262 @@
+"""Export the books, authors and recommendation graph of the database to Parquet files for the analysis.
+
+python main.py export [--database scraped_books.db] [--output data/export] [--compact]
+
+Books and authors get integer ids that stay the same across exports, the edge tables reference them. Every export
+adds a part to each table with only the rows that are new or changed since the last export, --compact rewrites every
+table as a single part. The parts can't take a deletion back, so an export that finds books or edges deleted since
+the last one, e.g. a retried default book or a dropped recommendation, compacts. The ids of deleted books are not
+given out again. `load_export` reads the parts back as Arrow tables.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import select
+
+from database import Book, Author, create_database_engine, DEFAULT_DATABASE_PATH, REFRESH_COLUMNS
+
+DEFAULT_EXPORT_DIR = "data/export"
+MANIFEST_FILE = "manifest.json"
+COMPRESSION = "zstd"
+
+# exported tables
+BOOKS = "books"
+AUTHORS = "authors"
+BOOK_AUTHORS = "book_authors"
+RECOMMENDATIONS = "recommendations"
+TABLES = (BOOKS, AUTHORS, BOOK_AUTHORS, RECOMMENDATIONS)
+# the edge tables and their (source, target) id columns
+EDGE_COLUMNS = {
+    BOOK_AUTHORS: ("book_id", "author_id"),
+    RECOMMENDATIONS: ("book_id", "recommended_id"),
+}
+
+
+class ExportState:
+    """The ids given out and what the earlier exports hold, read from their parts"""
+
+    def __init__(self, directory, manifest):
+        self.book_ids = {}
+        self.book_hashes = np.zeros(0, dtype=np.uint64)
+        self.author_ids = {}
+        self.edge_keys = {table: np.zeros(0, dtype=np.int64) for table in EDGE_COLUMNS}
+        # the next id to give out, above the ids of the deleted books too
+        self.next_ids = {BOOKS: 0, AUTHORS: 0, **manifest.get("next_ids", {})}
+
+        books = read_parts(directory, manifest, BOOKS, ["id", "isbn", "row_hash"])
+        if books is not None:
+            ids = books["id"].to_numpy()
+            self.book_ids = dict(zip(books["isbn"].to_pylist(), ids.tolist()))
+            self.next_ids[BOOKS] = max(self.next_ids[BOOKS], int(ids.max()) + 1)
+            self.book_hashes = np.zeros(self.next_ids[BOOKS], dtype=np.uint64)
+            self.book_hashes[ids] = books["row_hash"].to_numpy()  # the later parts overwrite the earlier versions
+        authors = read_parts(directory, manifest, AUTHORS, ["id", "name"])
+        if authors is not None:
+            ids = authors["id"].to_numpy()
+            self.author_ids = dict(zip(authors["name"].to_pylist(), ids.tolist()))
+            self.next_ids[AUTHORS] = max(self.next_ids[AUTHORS], int(ids.max()) + 1)
+        for table, columns in EDGE_COLUMNS.items():
+            edges = read_parts(directory, manifest, table, list(columns))
+            if edges is not None:
+                self.edge_keys[table] = np.sort(edge_keys(*(edges[column].to_numpy() for column in columns)))
+
+
+def edge_keys(sources, targets):
+    """Pack the (source, target) id pairs into one int64 each"""
+    return (sources.astype(np.int64) << 32) | targets.astype(np.int64)
+
+
+def assign_ids(keys, ids, next_ids, table):
+    """Map the keys to their ids, giving the new keys the next free ids of the table in order"""
+    for key in keys:
+        if key not in ids:
+            ids[key] = next_ids[table]
+            next_ids[table] += 1
+    return np.array([ids[key] for key in keys], dtype=np.int32)
+
+
+def id_index(ids):
+    """Index of the keys by their id, to look many keys up at once, the ids of deleted keys map to no key"""
+    id_values = np.fromiter(ids.values(), dtype=np.int64, count=len(ids))
+    keys = np.full(int(id_values.max()) + 1 if len(ids) else 0, None, dtype=object)
+    keys[id_values] = list(ids)
+    return pd.Index(keys)
+
+
+def read_manifest(directory):
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {"parts": {table: [] for table in TABLES}, "exports": []}
+    with open(path) as f:
+        return json.load(f)
+
+
+def read_parts(directory, manifest, table, columns=None):
+    """Concatenate the table's parts in export order, None if there are none"""
+    parts = [pq.read_table(os.path.join(directory, table, part), columns=columns, memory_map=True)
+             for part in manifest["parts"][table]]
+    return pa.concat_tables(parts) if parts else None
+
+
+def latest_rows(table):
+    """Keep the last version of every id, the rows come out sorted by id"""
+    ids = table["id"].to_numpy()
+    _, last_from_end = np.unique(ids[::-1], return_index=True)
+    return table.take(len(ids) - 1 - last_from_end)
+
+
+def load_export(directory=DEFAULT_EXPORT_DIR, tables=TABLES):
+    """Read the exported tables, the books and authors at their latest version and sorted by id"""
+    manifest = read_manifest(directory)
+    loaded = {}
+    for table in tables:
+        rows = read_parts(directory, manifest, table)
+        if rows is not None and table in (BOOKS, AUTHORS):
+            rows = latest_rows(rows)
+        loaded[table] = rows
+    return loaded
+
+
+def book_rows(connection, state, compact):
+    """The books that are new or changed since the last export, or all of them when compacting"""
+    columns = [column for column in Book.__table__.columns if column.name not in REFRESH_COLUMNS]
+    books = pd.read_sql_query(select(*columns), connection, dtype_backend="numpy_nullable")
+    hashes = pd.util.hash_pandas_object(books, index=False).to_numpy()
+    known = len(state.book_hashes)
+    ids = assign_ids(books["isbn"].tolist(), state.book_ids, state.next_ids, BOOKS)
+
+    changed = np.ones(len(books), dtype=bool)
+    if not compact:
+        existing = ids < known
+        changed[existing] = state.book_hashes[ids[existing]] != hashes[existing]
+    books.insert(0, "id", ids)
+    books["row_hash"] = hashes
+    return pa.Table.from_pandas(books[changed], preserve_index=False)
+
+
+def author_rows(connection, state, compact):
+    names = [name for (name,) in connection.execute(select(Author.name))]
+    known = state.next_ids[AUTHORS]
+    ids = assign_ids(names, state.author_ids, state.next_ids, AUTHORS)
+    new = np.ones(len(names), dtype=bool) if compact else ids >= known
+    return pa.table({"id": ids[new], "name": pa.array([name for name, is_new in zip(names, new) if is_new],
+                                                      type=pa.string())})
+
+
+def edge_ids(connection, state, table):
+    """The (source ids, target ids) of the table's edges and how many edges were left out for a missing end.
+
+    SQLite doesn't enforce the foreign keys, an edge may point at a book or author that isn't saved."""
+    # the edges are read through the driver's cursor, without building a result row for each of them
+    cursor = connection.connection.cursor()
+    if table == BOOK_AUTHORS:
+        rows = cursor.execute("SELECT book_isbn, author_name FROM book_author").fetchall()
+        source_ids, target_ids = state.book_ids, state.author_ids
+    else:
+        rows = cursor.execute("SELECT book_isbn, recommended_isbn FROM recommendation").fetchall()
+        source_ids = target_ids = state.book_ids
+    cursor.close()
+    sources = id_index(source_ids).get_indexer([source for source, _ in rows])
+    targets = id_index(target_ids).get_indexer([target for _, target in rows])
+    linked = (sources >= 0) & (targets >= 0)
+    return sources[linked].astype(np.int32), targets[linked].astype(np.int32), len(rows) - int(linked.sum())
+
+
+def edge_rows(connection, state, table, compact):
+    """The edges that are not in the export yet, or all of them when compacting"""
+    sources, targets, dangling = edge_ids(connection, state, table)
+    if dangling:
+        logging.warning(f"Left {dangling} {table} edges out of the export, their book or author is not saved")
+
+    if not compact:
+        new = ~np.isin(edge_keys(sources, targets), state.edge_keys[table], assume_unique=True)
+        sources, targets = sources[new], targets[new]
+    source_column, target_column = EDGE_COLUMNS[table]
+    return pa.table({source_column: sources, target_column: targets})
+
+
+def deleted_rows(connection, state):
+    """How many of the exported books and edges are no longer in the database"""
+    isbns = {isbn for (isbn,) in connection.execute(select(Book.isbn))}
+    deleted = {BOOKS: sum(1 for isbn in state.book_ids if isbn not in isbns)}
+    for table in EDGE_COLUMNS:
+        sources, targets, _ = edge_ids(connection, state, table)
+        deleted[table] = int(np.count_nonzero(~np.isin(state.edge_keys[table], edge_keys(sources, targets))))
+    return deleted
+
+
+def write_part(directory, table, part, rows):
+    os.makedirs(os.path.join(directory, table), exist_ok=True)
+    path = os.path.join(directory, table, part)
+    pq.write_table(rows, path + ".tmp", compression=COMPRESSION)
+    os.replace(path + ".tmp", path)
+
+
+def export_database(database_path=DEFAULT_DATABASE_PATH, directory=DEFAULT_EXPORT_DIR, compact=False):
+    """Export the rows changed since the last export to a new part of every table, return the exported row counts.
+
+    The manifest is replaced last, so an export that fails leaves the earlier ones as they were."""
+    manifest = read_manifest(directory)
+    state = ExportState(directory, manifest)
+    engine = create_database_engine(database_path)
+    try:
+        with engine.connect() as connection:
+            deleted = {} if compact else deleted_rows(connection, state)
+            if any(deleted.values()):
+                logging.info(f"{', '.join(f'{count} {table}' for table, count in deleted.items() if count)} "
+                             f"deleted since the last export COMPACTING")
+                compact = True
+            exported = {BOOKS: book_rows(connection, state, compact), AUTHORS: author_rows(connection, state, compact)}
+            for table in EDGE_COLUMNS:
+                exported[table] = edge_rows(connection, state, table, compact)
+    finally:
+        engine.dispose()
+
+    os.makedirs(directory, exist_ok=True)
+    export_number = len(manifest["exports"])
+    part = f"part-{export_number:05d}.parquet"
+    replaced_parts = {table: manifest["parts"][table] for table in TABLES} if compact else {}
+    for table, rows in exported.items():
+        if compact:
+            manifest["parts"][table] = []
+        if rows.num_rows or compact:
+            write_part(directory, table, part, rows)
+            manifest["parts"][table].append(part)
+
+    counts = {table: rows.num_rows for table, rows in exported.items()}
+    manifest["next_ids"] = state.next_ids
+    manifest["exports"].append({"exported_at": time.time(), "database": os.path.abspath(database_path),
+                                "compact": compact, "rows": counts})
+    with open(os.path.join(directory, MANIFEST_FILE + ".tmp"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(os.path.join(directory, MANIFEST_FILE + ".tmp"), os.path.join(directory, MANIFEST_FILE))
+
+    for table, parts in replaced_parts.items():
+        for old_part in parts:
+            os.remove(os.path.join(directory, table, old_part))
+    logging.info(f"Exported {', '.join(f'{count} {table}' for table, count in counts.items())} to {directory}")
+    return counts
+
+
+def add_arguments(parser):
+    parser.add_argument("--database", default=DEFAULT_DATABASE_PATH)
+    parser.add_argument("--output", default=DEFAULT_EXPORT_DIR, help="export directory")
+    parser.add_argument("--compact", action="store_true", help="rewrite every table as a single part")
+
+
+def run(args):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(levelname)s:%(message)s')
+    export_database(args.database, args.output, args.compact)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    run(parser.parse_args())
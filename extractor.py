@@ -0,0 +1,209 @@
+import logging
+
+from bs4 import BeautifulSoup
+from lxml import etree
+
+import utils
+from utils import KEY_MAPPINGS, TITLE, AUTHORS, NUM_OF_RATINGS, RATING, DESCRIPTION, RECOMMENDATIONS, PAGE_COUNT, \
+    normalize_book_title_string, normalize_author_string, convert_page_count, convert_rating, convert_review_count
+
+# BeautifulSoup does not count these strings as text
+NON_TEXT_TAGS = {"script", "style", "template"}
+# the block elements that make lxml close an open <p>, html.parser keeps them inside it up to the </p>
+BLOCK_TAGS = {"address", "article", "aside", "blockquote", "center", "details", "dialog", "dir", "div", "dl",
+              "fieldset", "figcaption", "figure", "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6", "header",
+              "hgroup", "hr", "listing", "main", "menu", "nav", "ol", "p", "pre", "section", "table", "ul"}
+
+TITLE_SECTION = "title"
+AUTHORS_SECTION = "authors"
+DETAILS_SECTION = "details"
+DESCRIPTION_SECTION = "description"
+REVIEWS_SECTION = "reviews"
+BANNER_SECTION = "banner"
+
+
+def has_class(element, class_value):
+    """Match a class the way BeautifulSoup's `class_=` does: a single class or the whole class string"""
+    classes = element.get("class", "").split()
+    return class_value in classes or " ".join(classes) == class_value
+
+
+# (tag, predicate) of the first element in the document that holds each section of the book page
+SECTION_MATCHERS = {
+    TITLE_SECTION: ("h1", lambda e: has_class(e, "text-xl sm:text-l text-800 mb-0")),
+    AUTHORS_SECTION: ("div", lambda e: has_class(e, "text-s product-autor")),
+    DETAILS_SECTION: ("ul", lambda e: has_class(e, "description-dot-list")),
+    DESCRIPTION_SECTION: ("p", lambda e: has_class(e, "mb-0")),
+    REVIEWS_SECTION: ("div", lambda e: has_class(e, "product-rating")),
+    BANNER_SECTION: ("div", lambda e: e.get("id") == "product-page-banner-container"),
+}
+
+
+def parse_page(page_bytes, encoding="utf-8"):
+    parser = etree.HTMLParser(encoding=encoding, remove_pis=True, no_network=True)
+    return etree.fromstring(page_bytes, parser)
+
+
+def find_sections(root):
+    """Walk the tree once and return the first element of every section, stopping when all are found"""
+    sections = {}
+    for element in root.iter(etree.Element):
+        for section, (tag, predicate) in SECTION_MATCHERS.items():
+            if section not in sections and element.tag == tag and predicate(element):
+                sections[section] = element
+        if len(sections) == len(SECTION_MATCHERS):
+            break
+    return sections
+
+
+def find_first(element, tag, predicate):
+    for descendant in element.iterdescendants(tag):
+        if predicate(descendant):
+            return descendant
+    return None
+
+
+def text_nodes(element):
+    """Return the text nodes of the subtree in document order, skipping comments and script contents"""
+    nodes = []
+    if isinstance(element.tag, str) and element.tag not in NON_TEXT_TAGS and element.text:
+        nodes.append(element.text)
+    for child in element:
+        if isinstance(child.tag, str):
+            nodes.extend(text_nodes(child))
+        if child.tail:
+            nodes.append(child.tail)
+    return nodes
+
+
+def get_text(element):
+    return "".join(text_nodes(element))
+
+
+def get_stripped_text(element):
+    return "".join(node.strip() for node in text_nodes(element) if node.strip())
+
+
+def drop_tree(element):
+    """Remove the element with its subtree but keep its tail text"""
+    parent = element.getparent()
+    if element.tail:
+        previous = element.getprevious()
+        if previous is not None:
+            previous.tail = (previous.tail or "") + element.tail
+        else:
+            parent.text = (parent.text or "") + element.tail
+    parent.remove(element)
+
+
+def require_section(sections, section):
+    if section not in sections:
+        raise ValueError(f"The book page has no {section} section")
+    return sections[section]
+
+
+def extract_title(sections):
+    return normalize_book_title_string(get_text(require_section(sections, TITLE_SECTION)).strip())
+
+
+def extract_authors(sections):
+    author_tags = [tag for tag in require_section(sections, AUTHORS_SECTION).iterdescendants("a")
+                   if has_class(tag, "link link--black")]
+    return [normalize_author_string(get_stripped_text(tag)) for tag in author_tags]
+
+
+def extract_details(sections):
+    book_details = {}
+    for li in list(require_section(sections, DETAILS_SECTION).iterdescendants("li")):
+        key_span = find_first(li, "span", lambda e: has_class(e, "text-700"))
+        if key_span is None:
+            continue
+
+        key = get_text(key_span).strip()
+        drop_tree(key_span)  # Remove the key span to easily extract the remaining text
+        if key in KEY_MAPPINGS:
+            mapped_key = KEY_MAPPINGS[key]
+            book_details[mapped_key] = convert_page_count(mapped_key, get_text(li).strip())
+
+    # ensure 'PageCount' exists in book_details
+    book_details.setdefault(PAGE_COUNT, 0)
+    return book_details
+
+
+def is_closed_by_block(element):
+    """Whether lxml may have closed the element at a block element that html.parser would have kept inside it.
+
+    The tree doesn't tell where the </p> was, so a paragraph followed right away by a block element is suspect."""
+    following = element.getnext()
+    return not element.tail and following is not None and following.tag in BLOCK_TAGS
+
+
+def extract_description(sections, page_bytes=None, encoding="utf-8"):
+    """The description paragraph's text, read from the BeautifulSoup tree when lxml may have cut the paragraph short"""
+    description_tag = sections.get(DESCRIPTION_SECTION)
+    if description_tag is None:
+        return "Description Not Available"
+    if page_bytes is not None and is_closed_by_block(description_tag):
+        return utils.extract_description(BeautifulSoup(page_bytes, "html.parser", from_encoding=encoding))
+    return get_text(description_tag).strip()
+
+
+def extract_reviews(sections):
+    reviews_container = sections.get(REVIEWS_SECTION)
+    if reviews_container is None:
+        return 0, 0  # return default values if the container not found
+
+    rating_tag = find_first(reviews_container, "span", lambda e: has_class(e, "text-l text-800"))
+    review_count_tag = find_first(reviews_container, "span", lambda e: has_class(e, "text-s"))
+    rating = convert_rating(get_text(rating_tag)) if rating_tag is not None else 0
+    num_of_reviews = convert_review_count(get_text(review_count_tag)) if review_count_tag is not None else 0
+    return rating, num_of_reviews
+
+
+def extract_recommendations_list(sections):
+    recommendations_isbn = []
+    recommendations = find_first(require_section(sections, BANNER_SECTION), "div",
+                                 lambda e: has_class(e, "book-slick-slider slick-initialized slick-slider"))
+    if recommendations is None:
+        return recommendations_isbn
+
+    for cover in recommendations.iterdescendants("div"):
+        if not any(c.startswith("new-teaser") for c in cover.get("class", "").split()):
+            continue
+        cover_link = find_first(cover, "a", lambda e: has_class(e, "cover-container"))
+        if cover_link is None:
+            raise ValueError("A recommendation teaser has no cover link")
+        isbn = cover_link.get("data-product-identifier")
+        if isbn:
+            recommendations_isbn.append(isbn)
+        else:
+            logging.error("Failed to extract a recommendation ISBN from the book page.")
+    return recommendations_isbn
+
+
+def extract_book_details_from_bytes(page_bytes, recommendations=None, encoding="utf-8"):
+    """Scrape and structure the book's details from the raw bytes of its page.
+
+    Gives the same result as `utils.extract_book_details_dict`, but the page is parsed once with lxml, all the
+    sections are located in a single walk over the tree and only their subtrees are read afterwards.
+    The recommendations are extracted from the page unless they are given, e.g. by the browser-free fast path."""
+    sections = find_sections(parse_page(page_bytes, encoding))
+    title = extract_title(sections)
+    authors = extract_authors(sections)
+    details = extract_details(sections)
+    product_description = extract_description(sections, page_bytes, encoding)
+    rating, num_of_reviews = extract_reviews(sections)
+    if recommendations is None:
+        recommendations = extract_recommendations_list(sections)
+
+    # Combine all extracted details into a single dictionary
+    return {**details, TITLE: title, AUTHORS: authors,
+            NUM_OF_RATINGS: num_of_reviews, RATING: rating, DESCRIPTION: product_description,
+            RECOMMENDATIONS: recommendations}
+
+
+def extract_book_details(book_page_html, recommendations=None):
+    """Same as `extract_book_details_from_bytes` for a page source given as text"""
+    if isinstance(book_page_html, str):
+        book_page_html = book_page_html.encode("utf-8")
+    return extract_book_details_from_bytes(book_page_html, recommendations)
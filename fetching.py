@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import time
+
+import aiohttp
+
+from page_cache import lookup, store, is_offline, SEARCH
+from rate_limit import rate_limiter_for, backoff_delay, parse_retry_after, TRANSIENT_STATUS_CODES, \
+    DEFAULT_MAX_RETRIES
+from scraping import build_search_url
+
+# how many search requests may be in flight at the same time
+DEFAULT_CONCURRENCY = 8
+# how long an idle keep-alive connection stays in the pool
+KEEPALIVE_TIMEOUT = 30
+REQUEST_TIMEOUT = 30
+
+
+class SaxoHttpClient:
+    """Asyncio HTTP client sharing one keep-alive connection pool between all Saxo requests.
+
+    Use as an async context manager. The number of requests in flight is capped by `concurrency`.
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, timeout=REQUEST_TIMEOUT):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._semaphore = None
+        self._session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.concurrency,
+                                         keepalive_timeout=KEEPALIVE_TIMEOUT, ttl_dns_cache=300)
+        self._session = aiohttp.ClientSession(connector=connector,
+                                              timeout=aiohttp.ClientTimeout(total=self.timeout))
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._session.close()
+
+    async def get(self, url, max_retries=DEFAULT_MAX_RETRIES):
+        """Fetch the url and return a tuple (status_code, final_url, text).
+
+        Requests are paced by the host's rate limiter, transient failures are retried with jittered backoff."""
+        limiter = rate_limiter_for(url)
+        for attempt in range(max_retries + 1):
+            await limiter.acquire_async()
+            retry_after = 0
+            async with self._semaphore:
+                start = time.monotonic()
+                try:
+                    async with self._session.get(url) as response:
+                        text = await response.text()
+                        status, final_url = response.status, str(response.url)
+                        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    limiter.record_failure()
+                    if attempt == max_retries:
+                        raise
+                    logging.info(f"Fetching {url} failed: {e!r} RETRYING")
+                else:
+                    limiter.record_response(status, time.monotonic() - start)
+                    if status not in TRANSIENT_STATUS_CODES or attempt == max_retries:
+                        return status, final_url, text
+                    logging.info(f"Fetching {url} returned status code {status} RETRYING")
+            # sleep outside of the semaphore so that the waiting request doesn't hold a connection slot
+            await asyncio.sleep(max(retry_after, backoff_delay(attempt)))
+
+    async def query_saxo_with_title_return_search_page(self, title):
+        """Search for the book on Saxo.com """
+        cached_page = lookup(SEARCH, title)
+        if cached_page is not None:
+            return cached_page.content
+        if is_offline():
+            logging.info(f"Search page for {title} is not cached OFFLINE ABORTING")
+            return None
+
+        try:
+            status, _, text = await self.get(build_search_url(title))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.error(f"Failed to fetch search results from Saxo.com for {title}: {e!r} ABORTING")
+            return None
+
+        if status == 200:
+            store(SEARCH, title, text)
+            return text
+
+        logging.error(f"Failed to fetch search results from Saxo.com for {title}. Status code: {status} ABORTING")
+        return None
+
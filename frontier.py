@@ -0,0 +1,103 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import func, update, delete, select
+from sqlalchemy.dialects.sqlite import insert
+
+from database import FrontierEntry, frontier_parent_table
+
+# crawl depth of the recommendations of the top10k books, the top10k books themselves are at depth 0
+FIRST_LAYER_DEPTH = 1
+# books up to this depth are scraped, only the books below it push their recommendations to the frontier,
+# 1 is the original two layers: the top10k books and their recommendations
+DEFAULT_MAX_DEPTH = 1
+
+PENDING = "pending"
+IN_PROGRESS = "in_progress"
+DONE = "done"
+FAILED = "failed"
+
+ClaimedEntry = namedtuple("ClaimedEntry", ["isbn", "depth", "attempts", "parent_isbns"])
+
+# claims are serialized so that two workers never take the same entry
+_claim_lock = threading.Lock()
+
+
+def priority_for(depth):
+    """Lower priorities are scraped first: breadth-first, so shallow books are never starved by deep ones"""
+    return depth
+
+
+def push(session, isbns, parent_isbn, depth):
+    """Add the ISBNs to the frontier in the session's transaction, together with the edges from their parent.
+
+    An ISBN that is already in the frontier keeps its status, but moves up to the smaller depth and priority."""
+    isbns = list(dict.fromkeys(isbns))
+    if not isbns:
+        return
+
+    now = time.time()
+    statement = insert(FrontierEntry.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=["isbn"],
+        set_={"depth": func.min(FrontierEntry.__table__.c.depth, statement.excluded.depth),
+              "priority": func.min(FrontierEntry.__table__.c.priority, statement.excluded.priority)})
+    session.execute(statement, [{"isbn": isbn, "depth": depth, "priority": priority_for(depth), "status": PENDING,
+                                 "attempts": 0, "discovered_at": now} for isbn in isbns])
+    session.execute(insert(frontier_parent_table).prefix_with("OR IGNORE"),
+                    [{"isbn": isbn, "parent_isbn": parent_isbn} for isbn in isbns])
+
+
+def claim(session):
+    """Mark the pending entry with the lowest priority as in progress and return it, or None if there is none"""
+    table = FrontierEntry.__table__
+    with _claim_lock:
+        row = session.execute(select(table.c.isbn, table.c.depth, table.c.attempts)
+                              .where(table.c.status == PENDING)
+                              .order_by(table.c.priority, table.c.discovered_at)
+                              .limit(1)).first()
+        if row is None:
+            session.rollback()
+            return None
+
+        session.execute(update(table).where(table.c.isbn == row.isbn)
+                        .values(status=IN_PROGRESS, attempts=table.c.attempts + 1))
+        session.commit()
+
+    return ClaimedEntry(row.isbn, row.depth, row.attempts + 1, parents_of(session, row.isbn))
+
+
+def parents_of(session, isbn):
+    """ISBNs of the books that recommended the entry, kept until it's done"""
+    return [parent_isbn for (parent_isbn,) in session.execute(
+        select(frontier_parent_table.c.parent_isbn).where(frontier_parent_table.c.isbn == isbn))]
+
+
+def complete(session, isbn, status=DONE):
+    """Mark the entry as done or failed in the session's transaction, the parent edges of a done entry are dropped"""
+    table = FrontierEntry.__table__
+    session.execute(update(table).where(table.c.isbn == isbn).values(status=status))
+    if status == DONE:
+        session.execute(delete(frontier_parent_table).where(frontier_parent_table.c.isbn == isbn))
+
+
+def requeue_in_progress(session):
+    """Return the entries claimed by a run that stopped before finishing them to the pending state"""
+    table = FrontierEntry.__table__
+    requeued = session.execute(update(table).where(table.c.status == IN_PROGRESS).values(status=PENDING)).rowcount
+    session.commit()
+    if requeued:
+        logging.info(f"Requeued {requeued} frontier entries left in progress by the previous run")
+
+
+def has_unfinished_work(session):
+    table = FrontierEntry.__table__
+    return session.execute(select(table.c.isbn).where(table.c.status.in_((PENDING, IN_PROGRESS))).limit(1)).first() \
+        is not None
+
+
+def counts(session):
+    table = FrontierEntry.__table__
+    return dict(session.execute(select(table.c.status, func.count()).group_by(table.c.status)).all())
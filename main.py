@@ -1,106 +1,48 @@
-import logging
-import math
-
-import pandas as pd
-
-from database import Book, create_session
-from scraping import query_saxo_with_title_return_search_page, \
-    find_book_by_title_in_search_results_return_book_url, create_browser_and_wait_for_book_details_page_load, \
-    save_book_details_to_database
-from utils import normalize_author_string, normalize_book_title_string, extract_book_details_dict, TOP10K, \
-    default_book_dict_with_title_author, URL, ISBN, LoadStatus
-
-logging.basicConfig(filename='data/app_errors.log', level=logging.INFO,
-                    format='%(asctime)s:%(levelname)s:%(message)s')
-logging.info("Starting the scraping process")
-
-
-# todo add a check for book 34 with url error
-
-def read_input_csv(file_path):
-    """Read the CSV file to get the list of tuples (book_title, book_author) and return it as a list"""
-    df = pd.read_csv(file_path, encoding="ISO-8859-1")
-    df["book_author"] = df["book_author"].fillna('')
-    book_info = list(zip(df["book_title"], df["book_author"]))
-    return book_info
-
-
-def is_book_scraped_top10k(session, i):
-    """Check if the book is already in the database based on top10k value"""
-    return session.query(Book).filter(Book.top10k == i).first()
-
-
-def normalize_title_and_author(title, author):
-    title = normalize_book_title_string(title)
-
-    if author:
-        author = normalize_author_string(author)
-    else:
-        author = ""
-        logging.info(f"Author is missing for book {i + 1}: {title}")
-
-    return title, author
-
-
-def save_default_book(title, author, i, session):
-    default_book_dict = default_book_dict_with_title_author(title, author, i + 1)
-    save_book_details_to_database(default_book_dict, session)
+"""Scrape the top 10k books and their recommendations from Saxo.com.
+
+python main.py [crawl] [--fast ...]  crawl the input CSV and the recommended books, the default command
+python main.py status                how many books are saved, queued and failed, from the database alone
+python main.py export                export the database to Parquet for the analysis
+python main.py reextract             rebuild the database from the page cache, offline
+
+Only the module of the command that runs is imported, with the dependencies it needs, so the quick commands don't
+pay for pandas, Selenium and the rest of the crawl.
+"""
+import argparse
+import importlib
+import sys
+
+# command -> help, each is run by the `add_arguments` and `run` of the module of the same name
+COMMANDS = {
+    "crawl": "crawl the top10k books of the input CSV and the books they recommend",
+    "status": "report how far the crawl has got",
+    "export": "export the books and the recommendation graph to Parquet",
+    "reextract": "rebuild the database purely from the cached pages, without network or browser, "
+                 "keeping the books already saved",
+}
+DEFAULT_COMMAND = "crawl"
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    # the crawl options without a command, the way the crawl was started before there were commands
+    if not argv or argv[0] not in (*COMMANDS, "-h", "--help"):
+        argv = [DEFAULT_COMMAND, *argv]
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog="\n".join(__doc__.splitlines()[2:6]))
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    module = None
+    for command, help_text in COMMANDS.items():
+        command_parser = subparsers.add_parser(command, help=help_text, description=help_text)
+        # only the chosen command's module is imported, for its arguments' defaults and to run it
+        if command == argv[0]:
+            module = importlib.import_module(command)
+            module.add_arguments(command_parser)
+    args = parser.parse_args(argv)
+    module.run(args)
 
 
 if __name__ == "__main__":
-
-    input_csv = "data/top_10k_books.csv"
-
-    book_info = read_input_csv(input_csv)
-    session = create_session()
-
-    for i, (title, author) in enumerate(book_info):
-        if is_book_scraped_top10k(session, i + 1):
-            print(f"Book {i + 1} already scraped")
-            continue
-
-        print(f"Scraping book {i + 1} out of {len(book_info)}")
-        # normalize the strings
-        if not title:
-            logging.critical(f"Title is missing for book {i + 1} ABORTING")
-            continue
-        title, author = normalize_title_and_author(title, author)
-
-        # get the search page html
-        search_page_html = query_saxo_with_title_return_search_page(title)
-        if search_page_html is None:
-            continue
-
-        # get the book page url
-        book_page_url = find_book_by_title_in_search_results_return_book_url(search_page_html, author, title)
-        if book_page_url == 'N/A':
-            logging.info(f"Book {i + 1} not found in the search results SAVING DEFAULT")
-            save_default_book(title, author, i, session)  # TODO WRITE A SCRIPT TO CORRECT INEXISTENT 10K
-            continue
-
-        if book_page_url is False:
-            logging.info(f"Getting results for book {i + 1}, Title: {title}, Author: {author} failed SAVING DEFAULT")
-            save_default_book(title, author, i, session)
-            continue
-
-        # get the fully loaded book page html
-        (status, book_page_html) = create_browser_and_wait_for_book_details_page_load(book_page_url, session)
-        if status is LoadStatus.ERROR:
-            logging.error(f"Failed to get the book page html for book {i + 1}: {title}, {author} SAVING DEFAULT")
-            save_default_book(title, author, i, session)
-            continue
-        # if same book already exists in db
-        if status is LoadStatus.EXISTING:
-            book_details_dict = extract_book_details_dict(book_page_html)
-            book_details_dict[TOP10K] = i + 1
-            book_details_dict[URL] = book_page_url
-            book_details_dict[ISBN] = book_details_dict[ISBN] + f"_{i + 1}"
-            logging.info(f"Book already exists {i + 1}:{book_details_dict[ISBN]}, {title}, {author} ADDING _TOP10K to ISBN")
-            save_book_details_to_database(book_details_dict, session)
-            continue
-        # extract the book details normally
-        else:
-            book_details_dict = extract_book_details_dict(book_page_html)
-            book_details_dict[TOP10K] = i + 1
-            book_details_dict[URL] = book_page_url
-            save_book_details_to_database(book_details_dict, session)
+    main()
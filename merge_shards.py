@@ -0,0 +1,196 @@
+"""Merge the databases of a sharded crawl into one.
+
+python merge_shards.py scraped_books.db scraped_books_shard_1_of_4.db scraped_books_shard_2_of_4.db ...
+"""
+import argparse
+import logging
+
+from sqlalchemy import select, update, delete, func, or_
+from sqlalchemy.dialects.sqlite import insert
+
+import frontier
+import retry_queue
+from database import Book, Author, FrontierEntry, RetryEntry, book_author, recommendation_table, \
+    frontier_parent_table, create_database_engine
+
+# url of the default books saved when a book could not be found or loaded
+DEFAULT_BOOK_URL = 'N/A'
+
+
+class MergedBooks:
+    """ISBN -> (top10k, url) of the books in the merged database, and top10k -> ISBN of the book holding it"""
+
+    def __init__(self, connection):
+        self.books = {isbn: (top10k, url) for isbn, top10k, url in
+                      connection.execute(select(Book.isbn, Book.top10k, Book.url))}
+        self.top10k_isbns = {top10k: isbn for isbn, (top10k, _) in self.books.items() if top10k}
+
+    def add(self, isbn, top10k, url):
+        self.books[isbn] = (top10k, url)
+        if top10k:
+            self.top10k_isbns[top10k] = isbn
+
+    def remove(self, isbn):
+        top10k, _ = self.books.pop(isbn)
+        if top10k:
+            del self.top10k_isbns[top10k]
+
+
+def delete_default_top10k_book(connection, merged, isbn):
+    """Delete a default top10k book replaced by a scraped one, with its edges and its retry, like a retry does"""
+    connection.execute(delete(book_author).where(book_author.c.book_isbn == isbn))
+    connection.execute(delete(recommendation_table).where(
+        or_(recommendation_table.c.book_isbn == isbn, recommendation_table.c.recommended_isbn == isbn)))
+    connection.execute(delete(RetryEntry.__table__).where(RetryEntry.isbn == isbn))
+    connection.execute(delete(Book.__table__).where(Book.isbn == isbn))
+    merged.remove(isbn)
+
+
+def merge_book(connection, merged, row):
+    """Merge a shard's book row and return the ISBN it's stored under, or None if it's dropped.
+
+    Books are deduplicated by ISBN. A top10k position is never lost: a book that is a top10k book in one shard
+    and a plain one in another keeps the position, and a book that holds two positions gets the second one under
+    the `{isbn}_{top10k}` ISBN the crawl gives a top10k book it finds already saved. A top10k row seen in
+    two shards, i.e. from overlapping row ranges, is kept once, a scraped book is kept as a plain book when it loses
+    the position so that the edges to it survive. A default book is replaced by a scraped one."""
+    values = dict(row._mapping)
+    isbn, top10k, url = values["isbn"], values["top10k"] or 0, values["url"]
+
+    holder_isbn = merged.top10k_isbns.get(top10k) if top10k else None
+    if holder_isbn is not None and holder_isbn != isbn:
+        _, holder_url = merged.books[holder_isbn]
+        if holder_url == DEFAULT_BOOK_URL and url != DEFAULT_BOOK_URL:
+            delete_default_top10k_book(connection, merged, holder_isbn)
+        elif url == DEFAULT_BOOK_URL:
+            return None  # a default book is saved under its row number, nothing else points to it
+        else:
+            top10k = values["top10k"] = 0
+
+    if isbn not in merged.books:
+        connection.execute(insert(Book.__table__), values)
+        merged.add(isbn, top10k, url)
+        return isbn
+
+    existing_top10k, existing_url = merged.books[isbn]
+    if top10k and existing_top10k and existing_top10k != top10k:
+        isbn = values["isbn"] = f"{isbn}_{top10k}"
+        connection.execute(insert(Book.__table__).prefix_with("OR IGNORE"), values)
+        merged.add(isbn, top10k, url)
+        return isbn
+
+    if existing_url == DEFAULT_BOOK_URL and url != DEFAULT_BOOK_URL:
+        connection.execute(update(Book.__table__).where(Book.isbn == isbn)
+                           .values({**values, "top10k": top10k or existing_top10k}))
+        merged.add(isbn, top10k or existing_top10k, url)
+    elif top10k:
+        connection.execute(update(Book.__table__).where(Book.isbn == isbn).values(top10k=top10k))
+        merged.add(isbn, top10k, existing_url)
+    return isbn
+
+
+def merge_frontier(connection, shard_connection, stored_isbns):
+    """Carry the unfinished frontier entries over, so that the crawl can go on from the merged database"""
+    table = FrontierEntry.__table__
+    rows = [dict(row._mapping, status=frontier.PENDING) for row in shard_connection.execute(
+        select(table).where(table.c.status.in_((frontier.PENDING, frontier.IN_PROGRESS))))]
+    if rows:
+        statement = insert(table)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=["isbn"],
+            set_={"depth": func.min(table.c.depth, statement.excluded.depth),
+                  "priority": func.min(table.c.priority, statement.excluded.priority)}), rows)
+    edges = [{"isbn": row.isbn, "parent_isbn": stored_isbns.get(row.parent_isbn) or row.parent_isbn}
+             for row in shard_connection.execute(select(frontier_parent_table))]
+    if edges:
+        connection.execute(insert(frontier_parent_table).prefix_with("OR IGNORE"), edges)
+
+
+def merge_retries(connection, shard_connection, merged):
+    """Carry the unfinished retries over whose book is still a default book, or not saved, in the merged database.
+
+    A top10k retry is only carried with its default book, which another shard may have scraped under the real ISBN."""
+    table = RetryEntry.__table__
+    rows = []
+    for row in shard_connection.execute(
+            select(table).where(table.c.status.in_((retry_queue.PENDING, retry_queue.IN_PROGRESS)))):
+        _, url = merged.books.get(row.isbn, (0, None))
+        if url == DEFAULT_BOOK_URL or (url is None and not row.top10k):
+            rows.append(dict(row._mapping, status=retry_queue.PENDING))
+    if rows:
+        statement = insert(table)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=["isbn"],
+            set_={"attempts": func.min(table.c.attempts, statement.excluded.attempts),
+                  "next_attempt_at": func.min(table.c.next_attempt_at, statement.excluded.next_attempt_at),
+                  "status": retry_queue.PENDING}), rows)
+    return len(rows)
+
+
+def complete_scraped_frontier_entries(connection):
+    """Link the pending entries some other shard scraped to their parents and drop them, like the crawl does"""
+    table = FrontierEntry.__table__
+    scraped = select(table.c.isbn).where(table.c.status == frontier.PENDING, table.c.isbn.in_(select(Book.isbn)))
+    parents = frontier_parent_table.c
+    edges = [{"book_isbn": parent_isbn, "recommended_isbn": isbn} for isbn, parent_isbn in connection.execute(
+        select(parents.isbn, parents.parent_isbn)
+        .where(parents.isbn.in_(scraped), parents.parent_isbn.in_(select(Book.isbn))))]
+    if edges:
+        connection.execute(insert(recommendation_table).prefix_with("OR IGNORE"), edges)
+    connection.execute(frontier_parent_table.delete().where(frontier_parent_table.c.isbn.in_(scraped)))
+    completed = connection.execute(table.delete().where(table.c.isbn.in_(scraped))).rowcount
+    logging.info(f"Linked {len(edges)} recommendations of {completed} frontier entries scraped by another shard")
+
+
+def merge_shard(engine, shard_path):
+    # brings a shard crawled by an older version up to the current tables and columns
+    shard_engine = create_database_engine(shard_path)
+    try:
+        with engine.begin() as connection, shard_engine.connect() as shard_connection:
+            merged = MergedBooks(connection)
+            stored_isbns = {}
+            for row in shard_connection.execute(select(Book.__table__).order_by(Book.top10k.desc())):
+                stored_isbns[row.isbn] = merge_book(connection, merged, row)
+
+            authors = [{"name": name} for (name,) in shard_connection.execute(select(Author.name))]
+            if authors:
+                connection.execute(insert(Author.__table__).prefix_with("OR IGNORE"), authors)
+
+            author_edges = [{**row._mapping, "book_isbn": stored_isbns[row.book_isbn]}
+                            for row in shard_connection.execute(select(book_author))
+                            if stored_isbns.get(row.book_isbn) is not None]
+            # both ends of a recommendation are books, an edge to or from a dropped book is dropped with it
+            recommendation_edges = [
+                {"book_isbn": stored_isbns[row.book_isbn], "recommended_isbn": stored_isbns[row.recommended_isbn]}
+                for row in shard_connection.execute(select(recommendation_table))
+                if stored_isbns.get(row.book_isbn) is not None and stored_isbns.get(row.recommended_isbn) is not None]
+            for table, edges in ((book_author, author_edges), (recommendation_table, recommendation_edges)):
+                if edges:
+                    connection.execute(insert(table).prefix_with("OR IGNORE"), edges)
+
+            merge_frontier(connection, shard_connection, stored_isbns)
+            retries = merge_retries(connection, shard_connection, merged)
+        logging.info(f"Merged {len(stored_isbns)} books and {retries} retries from {shard_path}")
+    finally:
+        shard_engine.dispose()
+
+
+def merge_shards(output_path, shard_paths):
+    """Merge the shard databases into the output database, which may already hold books"""
+    engine = create_database_engine(output_path)
+    try:
+        for shard_path in shard_paths:
+            merge_shard(engine, shard_path)
+        with engine.begin() as connection:
+            complete_scraped_frontier_entries(connection)
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(levelname)s:%(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output", help="database to merge the shards into, created if it doesn't exist")
+    parser.add_argument("shards", nargs="+", help="shard databases")
+    args = parser.parse_args()
+    merge_shards(args.output, args.shards)
@@ -0,0 +1,192 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from crawl_logging import tracing_current_book
+
+DEFAULT_STATS_FILE = "data/run_stats.json"
+DEFAULT_STATS_INTERVAL = 30.0
+
+# stages of the crawl
+SEARCH_FETCH = "search_fetch"
+TEASER_MATCH = "teaser_match"
+BROWSER_STARTUP = "browser_startup"
+PAGE_READY = "page_ready"  # waiting for the rendered book page to be complete
+EXTRACTION = "extraction"
+DB_FLUSH = "db_flush"
+RECOMMENDATION_EXPANSION = "recommendation_expansion"
+BOOK = "book"  # a book saved, from the search to the database, its outcomes are the crawl's throughput
+REFRESH = "refresh"  # a saved book scraped again by the refresh
+RETRY = "retry"  # a failed book scraped again by the retry worker
+
+# outcomes
+SUCCESS = "success"
+DEFAULT = "default"  # the default book was saved
+ERROR = "error"
+CACHED = "cached"
+LINKED = "linked"  # a recommended book that was already saved
+QUEUED = "queued"  # a recommended book pushed to the crawl frontier
+SKIPPED = "skipped"  # the book page turned out to be saved already
+NOT_MODIFIED = "not_modified"  # the server answered the conditional request with 304
+UNCHANGED = "unchanged"  # the page was fetched again, but the scraped content is the same
+UPDATED = "updated"
+GAVE_UP = "gave_up"  # a retried book that failed too often
+
+# upper bounds of the latency histogram buckets in seconds, roughly 2.5x apart, the last bucket is unbounded
+BUCKET_BOUNDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, latency):
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS, latency)] += 1
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the percentile, the max for the unbounded bucket"""
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else self.max
+        return 0.0
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+            "buckets": dict(zip([*map(str, BUCKET_BOUNDS), "inf"], self.buckets)),
+        }
+
+
+class Metrics:
+    """Latency histograms and outcome counters of the crawl stages, shared by all threads"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._latencies = {}
+        self._outcomes = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, latency):
+        with self._lock:
+            self._latencies.setdefault(stage, LatencyHistogram()).add(latency)
+
+    def count(self, stage, outcome, amount=1):
+        with self._lock:
+            self._outcomes.setdefault(stage, Counter())[outcome] += amount
+        if tracing_current_book():
+            logging.debug(f"{stage} {outcome}", extra={"stage": stage, "outcome": outcome})
+
+    @contextmanager
+    def timed(self, stage):
+        """Record the latency of the block, an exception leaving it also counts as an error of the stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.count(stage, ERROR)
+            raise
+        finally:
+            latency = time.perf_counter() - start
+            self.observe(stage, latency)
+            if tracing_current_book():
+                logging.debug(f"{stage} took {latency:.3f}s", extra={"stage": stage, "duration": latency})
+
+    def snapshot(self):
+        with self._lock:
+            elapsed = time.time() - self.started_at
+            stages = {}
+            for stage in (*self._latencies, *(s for s in self._outcomes if s not in self._latencies)):
+                outcomes = dict(self._outcomes.get(stage, {}))
+                histogram = self._latencies.get(stage)
+                completed = histogram.count if histogram is not None else sum(outcomes.values())
+                stages[stage] = {
+                    "latency": histogram.summary() if histogram is not None else None,
+                    "outcomes": outcomes,
+                    "per_minute": completed / elapsed * 60 if elapsed else 0.0,
+                }
+        books = stages.get(BOOK, {}).get("outcomes", {})
+        return {
+            "started_at": self.started_at,
+            "elapsed": elapsed,
+            "pages_per_minute": sum(books.values()) / elapsed * 60 if elapsed else 0.0,
+            "stages": stages,
+        }
+
+    def summary_lines(self):
+        snapshot = self.snapshot()
+        lines = [f"Run summary: {snapshot['elapsed'] / 60:.1f} min, {snapshot['pages_per_minute']:.1f} books/min",
+                 f"{'stage':<26}{'count':>8}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'/min':>9}  outcomes"]
+        for stage, stats in snapshot["stages"].items():
+            latency = stats["latency"]
+            outcomes = ", ".join(f"{outcome} {count}" for outcome, count in sorted(stats["outcomes"].items()))
+            if latency is None:  # a stage with counters only
+                timings = f"{sum(stats['outcomes'].values()):>8}" + f"{'-':>10}" * 4
+            else:
+                timings = f"{latency['count']:>8}" + "".join(f"{latency[key]:>9.3f}s" for key in
+                                                              ("mean", "p50", "p90", "p99"))
+            lines.append(f"{stage:<26}{timings}{stats['per_minute']:>9.1f}  {outcomes}")
+        return lines
+
+
+class StatsReporter:
+    """Dump the metrics snapshot to a JSON file every `interval` seconds and once more on close"""
+
+    def __init__(self, metrics, path=DEFAULT_STATS_FILE, interval=DEFAULT_STATS_INTERVAL):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stats-reporter", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.dump()
+
+    def dump(self):
+        snapshot = self.metrics.snapshot()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # replace the file in one go so that a reader never sees a half-written one
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(snapshot, f, indent=2)
+        os.replace(self.path + ".tmp", self.path)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.dump()
+        for line in self.metrics.summary_lines():
+            logging.info(line)
+            print(line)
+
+
+metrics = Metrics()
+
+
+def timed(stage):
+    return metrics.timed(stage)
+
+
+def count(stage, outcome, amount=1):
+    metrics.count(stage, outcome, amount)
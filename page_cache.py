@@ -0,0 +1,248 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_DIR = "data/cache"
+# cached pages older than this are fetched again, unless the crawl is offline
+DEFAULT_TTL = 30 * 24 * 60 * 60
+# least recently used pages are evicted once the compressed pages take more space than this
+DEFAULT_MAX_BYTES = 5 * 1024 ** 3
+# eviction is checked every this many stored pages
+EVICTION_INTERVAL = 100
+# a search that found no book is tried again after this, sooner than a found book because Saxo's catalogue changes
+DEFAULT_NEGATIVE_TTL = 3 * 24 * 60 * 60
+
+# kinds of cached pages
+SEARCH = "search"  # search page html, keyed by the title query
+ISBN_SEARCH = "isbn"  # search page html and the url it redirected to, keyed by the ISBN
+PRODUCT = "product"  # rendered book page html, keyed by the requested book page url
+
+# kinds of cached search resolutions, the book page url a search led to
+TITLE_RESOLUTION = "title"  # keyed by the normalized title and author
+ISBN_RESOLUTION = "isbn"  # keyed by the ISBN
+# resolution of a search that found no matching book
+NOT_FOUND = "N/A"
+
+
+class CachedPage:
+    def __init__(self, content, meta, fetched_at):
+        self.content = content
+        self.meta = meta
+        self.fetched_at = fetched_at
+
+
+class PageCache:
+    """Compressed, content-addressed on-disk cache of fetched pages.
+
+    Page contents are stored once per sha256 of the content as gzip files, a SQLite index maps (kind, key)
+    to the content together with its metadata and fetch time.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES,
+                 negative_ttl=DEFAULT_NEGATIVE_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(directory, "blobs"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._puts_since_eviction = 0
+        self._db = sqlite3.connect(os.path.join(directory, "index.sqlite3"), check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS blob (hash TEXT PRIMARY KEY, size INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS entry (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                hash TEXT NOT NULL REFERENCES blob(hash),
+                meta TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (kind, key)
+            );
+            CREATE INDEX IF NOT EXISTS entry_accessed_at ON entry(accessed_at);
+            CREATE INDEX IF NOT EXISTS entry_hash ON entry(hash);
+            CREATE TABLE IF NOT EXISTS resolution (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                url TEXT NOT NULL,
+                resolved_at REAL NOT NULL,
+                PRIMARY KEY (kind, key)
+            );
+        """)
+
+    def blob_path(self, content_hash):
+        return os.path.join(self.directory, "blobs", content_hash[:2], content_hash + ".html.gz")
+
+    def read_blob(self, content_hash):
+        with gzip.open(self.blob_path(content_hash), "rb") as f:
+            return f.read()
+
+    def get(self, kind, key, ignore_ttl=False):
+        """Return the CachedPage or None if it's not cached or expired"""
+        with self._lock:
+            row = self._db.execute("SELECT hash, meta, fetched_at FROM entry WHERE kind = ? AND key = ?",
+                                   (kind, key)).fetchone()
+            if row is None:
+                return None
+            content_hash, meta, fetched_at = row
+            if not ignore_ttl and time.time() - fetched_at > self.ttl:
+                return None
+            self._db.execute("UPDATE entry SET accessed_at = ? WHERE kind = ? AND key = ?", (time.time(), kind, key))
+            self._db.commit()
+
+        try:
+            content = self.read_blob(content_hash).decode("utf-8")
+        except OSError as e:
+            logging.error(f"Failed to read the cached {kind} page for {key}: {e!r}")
+            return None
+        return CachedPage(content, json.loads(meta), fetched_at)
+
+    def put(self, kind, key, content, **meta):
+        data = content.encode("utf-8")
+        content_hash = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(content_hash)
+
+        with self._lock:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # write to a temporary file first so that a crash never leaves a truncated blob behind
+                with gzip.open(path + ".tmp", "wb", compresslevel=6) as f:
+                    f.write(data)
+                os.replace(path + ".tmp", path)
+            self._db.execute("INSERT OR REPLACE INTO blob (hash, size) VALUES (?, ?)",
+                             (content_hash, os.path.getsize(path)))
+            now = time.time()
+            self._db.execute("INSERT OR REPLACE INTO entry (kind, key, hash, meta, fetched_at, accessed_at) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", (kind, key, content_hash, json.dumps(meta), now, now))
+            self._db.commit()
+
+            self._puts_since_eviction += 1
+            if self._puts_since_eviction >= EVICTION_INTERVAL:
+                self._puts_since_eviction = 0
+                self._evict()
+
+    def get_resolution(self, kind, key, ignore_ttl=False):
+        """Return the book page url the search resolved to, NOT_FOUND, or None if it's not cached or expired"""
+        with self._lock:
+            row = self._db.execute("SELECT url, resolved_at FROM resolution WHERE kind = ? AND key = ?",
+                                   (kind, key)).fetchone()
+        if row is None:
+            return None
+        url, resolved_at = row
+        ttl = self.negative_ttl if url == NOT_FOUND else self.ttl
+        if not ignore_ttl and time.time() - resolved_at > ttl:
+            return None
+        return url
+
+    def put_resolution(self, kind, key, url):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO resolution (kind, key, url, resolved_at) VALUES (?, ?, ?, ?)",
+                             (kind, key, url, time.time()))
+            self._db.commit()
+
+    def keys(self, kind):
+        with self._lock:
+            return [key for (key,) in self._db.execute("SELECT key FROM entry WHERE kind = ?", (kind,))]
+
+    def entries(self, kind):
+        """Return (key, blob_path, meta) of every cached page of the kind, regardless of the TTL"""
+        with self._lock:
+            rows = self._db.execute("SELECT key, hash, meta FROM entry WHERE kind = ?", (kind,)).fetchall()
+        return [(key, self.blob_path(content_hash), json.loads(meta)) for key, content_hash, meta in rows]
+
+    def total_bytes(self):
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blob").fetchone()[0]
+
+    def _evict(self):
+        """Drop the least recently used entries and their unreferenced blobs until the cache fits in max_bytes"""
+        total_bytes = self.total_bytes()
+        if total_bytes <= self.max_bytes:
+            return
+
+        evicted = 0
+        for kind, key in self._db.execute("SELECT kind, key FROM entry ORDER BY accessed_at").fetchall():
+            self._db.execute("DELETE FROM entry WHERE kind = ? AND key = ?", (kind, key))
+            evicted += 1
+            if evicted % EVICTION_INTERVAL == 0:
+                total_bytes -= self._delete_orphan_blobs()
+                if total_bytes <= self.max_bytes:
+                    break
+        self._delete_orphan_blobs()
+        self._db.commit()
+        logging.info(f"Evicted {evicted} pages from the page cache")
+
+    def _delete_orphan_blobs(self):
+        orphans = self._db.execute("SELECT hash, size FROM blob WHERE hash NOT IN (SELECT hash FROM entry)").fetchall()
+        for content_hash, _ in orphans:
+            try:
+                os.remove(self.blob_path(content_hash))
+            except FileNotFoundError:
+                pass
+        self._db.executemany("DELETE FROM blob WHERE hash = ?", [(content_hash,) for content_hash, _ in orphans])
+        return sum(size for _, size in orphans)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_cache = None
+_offline = False
+
+
+def configure_page_cache(directory=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES,
+                         negative_ttl=DEFAULT_NEGATIVE_TTL):
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = PageCache(directory, ttl, max_bytes, negative_ttl)
+    return _cache
+
+
+def get_page_cache():
+    """Return the configured page cache or None if caching is disabled"""
+    return _cache
+
+
+def set_offline(offline=True):
+    """In offline mode pages are served only from the cache, regardless of their age"""
+    global _offline
+    _offline = offline
+
+
+def is_offline():
+    return _offline
+
+
+def lookup(kind, key):
+    """Return the cached page or None, a no-op if caching is disabled"""
+    if _cache is None:
+        return None
+    return _cache.get(kind, key, ignore_ttl=_offline)
+
+
+def store(kind, key, content, **meta):
+    if _cache is not None and not _offline:
+        _cache.put(kind, key, content, **meta)
+
+
+def lookup_resolution(kind, key):
+    """Return the cached book page url of the search, NOT_FOUND, or None, a no-op if caching is disabled"""
+    if _cache is None:
+        return None
+    return _cache.get_resolution(kind, key, ignore_ttl=_offline)
+
+
+def store_resolution(kind, key, url):
+    """Cache the book page url the search resolved to, or NOT_FOUND if it found no matching book"""
+    if _cache is not None and not _offline:
+        _cache.put_resolution(kind, key, url)
+
+
+def title_resolution_key(title, author):
+    return f"{title}\t{author}"
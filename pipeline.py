@@ -0,0 +1,227 @@
+import asyncio
+import contextvars
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from browser_pool import DEFAULT_POOL_SIZE
+from crawl_logging import book_context, worker_logging_options
+from extractor import extract_book_details
+from fetching import SaxoHttpClient, DEFAULT_CONCURRENCY
+from metrics import timed, count, SEARCH_FETCH, TEASER_MATCH, EXTRACTION, BOOK, SUCCESS, DEFAULT, ERROR, CACHED
+from page_cache import lookup_resolution, title_resolution_key, TITLE_RESOLUTION, NOT_FOUND
+import retry_queue
+import scraping
+from scraping import find_book_by_title_in_search_results_return_book_url, load_book_details_page, \
+    is_book_scraped_url, save_book_details_to_database, remember_resolution
+from utils import TOP10K, URL, ISBN, LoadStatus, default_book_dict_with_title_author
+
+DEFAULT_PARSE_WORKERS = os.cpu_count() or 1
+# capacity of the queues between the stages, a full queue makes the stage before it wait
+DEFAULT_QUEUE_SIZE = 32
+
+# put in a queue after the last book
+END_OF_QUEUE = None
+
+
+class BookJob:
+    """A top10k book on its way through the pipeline stages"""
+
+    def __init__(self, i, title, author):
+        self.i = i
+        self.title = title
+        self.author = author
+        self.search_page_html = None
+        self.book_page_url = None
+        self.status = LoadStatus.ERROR
+        self.book_page_html = None
+        self.final_url = None
+        self.recommendations = None
+        self.book_details = None
+        # why the book failed, it's queued for a retry when it's saved as default
+        self.failure = None
+
+
+def find_top10k_book_page_url(i, title, author, search_page_html):
+    """Return the book page url from the search results, 'N/A' if the book is not in them or False on failure"""
+    with book_context(i + 1):
+        book_page_url = find_book_by_title_in_search_results_return_book_url(search_page_html, author, title)
+    if book_page_url == 'N/A':
+        logging.info(f"Book {i + 1} not found in the search results SAVING DEFAULT")
+        # TODO WRITE A SCRIPT TO CORRECT INEXISTENT 10K
+
+    if book_page_url is False:
+        logging.info(f"Getting results for book {i + 1}, Title: {title}, Author: {author} failed SAVING DEFAULT")
+
+    return book_page_url
+
+
+def book_page_url_or_default(book_page_url):
+    """The book page url to load, or None if the default book should be saved"""
+    return None if book_page_url in (NOT_FOUND, False) else book_page_url
+
+
+def extract_top10k_book_details(i, book_page_html, recommendations):
+    """Extract the book details in a worker process, None if the page can't be extracted"""
+    with book_context(i + 1):
+        try:
+            return extract_book_details(book_page_html, recommendations)
+        except Exception as e:
+            logging.error(f"Failed to extract the book page of book {i + 1}: {e!r} SAVING DEFAULT")
+            return None
+
+
+def save_default_book(title, author, i, session):
+    default_book_dict = default_book_dict_with_title_author(title, author, i + 1)
+    save_book_details_to_database(default_book_dict, session)
+    count(BOOK, DEFAULT)
+
+
+def save_top10k_book(job, session):
+    """Save the extracted top10k book to the database, or a default book if it could not be found or loaded"""
+    i, title, author = job.i, job.title, job.author
+    if job.failure is not None and scraping.retry_queue_enabled:
+        retry_queue.push(session, i + 1, job.failure, top10k=i + 1, title=title, author=author)
+        session.commit()
+    if job.book_page_url is None:
+        save_default_book(title, author, i, session)
+        return
+
+    if job.book_details is None:
+        logging.error(f"Failed to get the book page html for book {i + 1}: {title}, {author} SAVING DEFAULT")
+        save_default_book(title, author, i, session)
+        return
+
+    save_top10k_book_details(job, session)
+    count(BOOK, SUCCESS)
+
+
+def save_top10k_book_details(job, session):
+    """Save the extracted details of the top10k book, under an ISBN suffixed with its row if its page is saved"""
+    i, title, author = job.i, job.title, job.author
+    book_details_dict = job.book_details
+    book_details_dict[TOP10K] = i + 1
+    book_details_dict[URL] = job.book_page_url
+    # if same book already exists in db
+    if is_book_scraped_url(session, job.final_url):
+        book_details_dict[ISBN] = book_details_dict[ISBN] + f"_{i + 1}"
+        logging.info(f"Book already exists {i + 1}:{book_details_dict[ISBN]}, {title}, {author} ADDING _TOP10K to ISBN")
+    # otherwise the book details are saved normally
+    save_book_details_to_database(book_details_dict, session)
+
+
+async def run_stage(work, inbox, outbox, workers):
+    """Run `workers` coroutines passing the jobs from inbox through `work` to outbox.
+
+    `work` returns the job to pass on or None to drop it. The stage ends when END_OF_QUEUE comes in,
+    then it's passed on to the next stage."""
+
+    async def worker():
+        while True:
+            job = await inbox.get()
+            if job is END_OF_QUEUE:
+                await inbox.put(END_OF_QUEUE)  # let the other workers of the stage see it too
+                return
+            try:
+                with book_context(job.i + 1):
+                    job = await work(job)
+            except Exception as e:
+                logging.error(f"Pipeline stage {work.__name__} failed for book {job.i + 1}: {e!r} SKIPPING")
+                job = None
+            if job is not None and outbox is not None:
+                await outbox.put(job)
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    if outbox is not None:
+        await outbox.put(END_OF_QUEUE)
+
+
+async def run_pipeline(rows, session, search_workers=DEFAULT_CONCURRENCY, parse_workers=DEFAULT_PARSE_WORKERS,
+                       render_workers=DEFAULT_POOL_SIZE, queue_size=DEFAULT_QUEUE_SIZE):
+    """Scrape the top10k books in stages connected by bounded queues.
+
+    search fetch (async HTTP) -> teaser match (process pool) -> book page load (browser pool threads)
+    -> extraction (process pool) -> save (a single database writer thread)
+    Each stage has its own number of workers, so the network, the CPUs and the database are busy at the same time.
+    """
+    loop = asyncio.get_running_loop()
+    queues = [asyncio.Queue(queue_size) for _ in range(5)]
+    to_search, to_match, to_load, to_extract, to_save = queues
+
+    with ProcessPoolExecutor(max_workers=parse_workers, **worker_logging_options()) as parse_executor, \
+            ThreadPoolExecutor(max_workers=render_workers) as render_executor, \
+            ThreadPoolExecutor(max_workers=1) as db_executor:
+        async with SaxoHttpClient(concurrency=search_workers) as client:
+
+            async def search(job):
+                # a title searched before doesn't need the search page again, the url it resolved to is cached
+                resolved_url = lookup_resolution(TITLE_RESOLUTION, title_resolution_key(job.title, job.author))
+                if resolved_url is not None:
+                    if resolved_url == NOT_FOUND:
+                        logging.info(f"Book {job.i + 1} was not found in the search results before SAVING DEFAULT")
+                    job.book_page_url = book_page_url_or_default(resolved_url)
+                    count(SEARCH_FETCH, CACHED)
+                    return job
+
+                with timed(SEARCH_FETCH):
+                    job.search_page_html = await client.query_saxo_with_title_return_search_page(job.title)
+                if job.search_page_html is None:
+                    count(SEARCH_FETCH, ERROR)
+                    if not scraping.retry_queue_enabled:
+                        count(BOOK, ERROR)
+                        return None
+                    # saved as default and queued for a retry
+                    job.failure = retry_queue.SEARCH_FAILED
+                return job
+
+            async def match(job):
+                logging.info(f"Scraping book {job.i + 1}", extra={"stage": TEASER_MATCH})
+                if job.search_page_html is not None:
+                    with timed(TEASER_MATCH):
+                        book_page_url = await loop.run_in_executor(parse_executor, find_top10k_book_page_url, job.i,
+                                                                   job.title, job.author, job.search_page_html)
+                    count(TEASER_MATCH, {NOT_FOUND: DEFAULT, False: ERROR}.get(book_page_url, SUCCESS))
+                    remember_resolution(TITLE_RESOLUTION, title_resolution_key(job.title, job.author), book_page_url)
+                    job.book_page_url = book_page_url_or_default(book_page_url)
+                    job.search_page_html = None
+                    if book_page_url is False:
+                        job.failure = retry_queue.MATCH_FAILED
+                return job
+
+            # the threads run in a copy of the task's context, so that they log for the task's book
+            async def load(job):
+                if job.book_page_url is not None:
+                    (job.status, job.book_page_html, job.final_url, job.recommendations) = \
+                        await loop.run_in_executor(render_executor, contextvars.copy_context().run,
+                                                   load_book_details_page, job.book_page_url)
+                    if job.status is not LoadStatus.NEW:
+                        job.failure = retry_queue.LOAD_FAILED
+                return job
+
+            async def extract(job):
+                if job.status is LoadStatus.NEW:
+                    with timed(EXTRACTION):
+                        job.book_details = await loop.run_in_executor(parse_executor, extract_top10k_book_details,
+                                                                      job.i, job.book_page_html, job.recommendations)
+                    count(EXTRACTION, ERROR if job.book_details is None else SUCCESS)
+                    if job.book_details is None:
+                        job.failure = retry_queue.EXTRACTION_FAILED
+                job.book_page_html = None
+                return job
+
+            async def save(job):
+                await loop.run_in_executor(db_executor, contextvars.copy_context().run, save_top10k_book, job, session)
+
+            async def feed():
+                for i, title, author in rows:
+                    await to_search.put(BookJob(i, title, author))
+                await to_search.put(END_OF_QUEUE)
+
+            await asyncio.gather(
+                feed(),
+                run_stage(search, to_search, to_match, search_workers),
+                run_stage(match, to_match, to_load, parse_workers),
+                run_stage(load, to_load, to_extract, render_workers),
+                run_stage(extract, to_extract, to_save, parse_workers),
+                run_stage(save, to_save, None, 1),
+            )
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+# requests per second to start with, and the bounds the adaptive rate stays in
+DEFAULT_INITIAL_RATE = 2.0
+DEFAULT_MIN_RATE = 0.2
+DEFAULT_MAX_RATE = 20.0
+# additive increase per fast successful request and multiplicative decrease on throttling or errors
+RATE_INCREASE = 0.05
+RATE_DECREASE = 0.5
+# a response this many times slower than the usual latency counts as the server struggling
+SLOW_RESPONSE_FACTOR = 3.0
+SLOW_RESPONSE_DECREASE = 0.8
+# smoothing of the latency moving average
+LATENCY_SMOOTHING = 0.1
+
+# status codes worth retrying, and how
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+DEFAULT_MAX_RETRIES = 4
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+
+class AdaptiveRateLimiter:
+    """Token bucket whose rate adapts to how the host responds (additive increase, multiplicative decrease).
+
+    The rate grows while responses succeed at the usual latency and is cut on 429/5xx responses, errors
+    and latency spikes. Thread-safe, with a blocking `acquire` for threads and `acquire_async` for asyncio.
+    """
+
+    def __init__(self, initial_rate=DEFAULT_INITIAL_RATE, min_rate=DEFAULT_MIN_RATE, max_rate=DEFAULT_MAX_RATE):
+        self.rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.average_latency = None
+        self._tokens = 1.0
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Take a token and return how long to wait until it's actually available"""
+        with self._lock:
+            now = time.monotonic()
+            # the bucket holds at most one token, so the requests are spread evenly instead of bursting
+            self._tokens = min(1.0, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= 1.0
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self):
+        delay = self._reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def record_response(self, status_code, latency):
+        with self._lock:
+            if status_code in TRANSIENT_STATUS_CODES:
+                self._decrease(RATE_DECREASE)
+                return
+
+            if self.average_latency is not None and latency > SLOW_RESPONSE_FACTOR * self.average_latency:
+                self._decrease(SLOW_RESPONSE_DECREASE)
+            else:
+                self.rate = min(self.max_rate, self.rate + RATE_INCREASE)
+            self.average_latency = latency if self.average_latency is None else \
+                (1 - LATENCY_SMOOTHING) * self.average_latency + LATENCY_SMOOTHING * latency
+
+    def record_failure(self):
+        """A timeout or connection error"""
+        with self._lock:
+            self._decrease(RATE_DECREASE)
+
+    def _decrease(self, factor):
+        self.rate = max(self.min_rate, self.rate * factor)
+        logging.info(f"Backing off, request rate lowered to {self.rate:.2f}/s")
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_settings = {"initial_rate": DEFAULT_INITIAL_RATE, "min_rate": DEFAULT_MIN_RATE, "max_rate": DEFAULT_MAX_RATE}
+
+
+def configure_rate_limits(initial_rate=DEFAULT_INITIAL_RATE, min_rate=DEFAULT_MIN_RATE, max_rate=DEFAULT_MAX_RATE):
+    """Set the rates of the limiters created from now on"""
+    with _limiters_lock:
+        _settings.update(initial_rate=initial_rate, min_rate=min_rate, max_rate=max_rate)
+        _limiters.clear()
+
+
+def rate_limiter_for(url):
+    """Return the limiter shared by all the HTTP and browser fetches of the url's host"""
+    host = urlsplit(url).netloc
+    with _limiters_lock:
+        if host not in _limiters:
+            _limiters[host] = AdaptiveRateLimiter(**_settings)
+        return _limiters[host]
+
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter for the attempt-th retry, counting from 0"""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def parse_retry_after(value):
+    """Seconds to wait according to a Retry-After header given in seconds, 0 if it's missing or a date"""
+    try:
+        return min(BACKOFF_MAX, max(0.0, float(value)))
+    except (TypeError, ValueError):
+        return 0.0
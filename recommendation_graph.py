@@ -0,0 +1,207 @@
+"""The recommendation graph as compressed sparse rows over NumPy arrays, for the analysis of the crawled books.
+
+python recommendation_graph.py [--export data/export | --database scraped_books.db] [--save data/graph] [--top 20]
+
+Book i recommends the books indices[indptr[i]:indptr[i + 1]], isbns[i] is its ISBN. A graph saved with `save` is
+memory-mapped by `RecommendationGraph.load`, so it isn't rebuilt from the database for every analysis.
+"""
+import argparse
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from database import create_database_engine, DEFAULT_DATABASE_PATH
+
+DEFAULT_GRAPH_DIR = "data/graph"
+DEFAULT_DAMPING = 0.85
+DEFAULT_TOLERANCE = 1e-9
+DEFAULT_MAX_ITERATIONS = 100
+GRAPH_ARRAYS = ("indptr", "indices", "isbns")
+
+
+class RecommendationGraph:
+    def __init__(self, indptr, indices, isbns):
+        self.indptr = indptr
+        self.indices = indices
+        self.isbns = isbns
+        self._index_of = None
+        self._transposed = None
+
+    @classmethod
+    def from_edges(cls, sources, targets, isbns):
+        """Build the graph from the (source, target) book numbers of the edges, isbns[i] is the ISBN of book i"""
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int32)
+        order = np.lexsort((targets, sources))
+        indptr = np.zeros(len(isbns) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(isbns)), out=indptr[1:])
+        return cls(indptr, targets[order], np.asarray(isbns, dtype=str))
+
+    @classmethod
+    def from_export(cls, directory):
+        """Build the graph from the Parquet export of export.py"""
+        from export import load_export, BOOKS, RECOMMENDATIONS
+        tables = load_export(directory, (BOOKS, RECOMMENDATIONS))
+        books, edges = tables[BOOKS], tables[RECOMMENDATIONS]
+        if books is None:
+            return cls.from_edges([], [], [])
+        # the ids of deleted books stay free, so they are compacted into the book numbers of the graph
+        ids = books["id"].to_numpy()
+        book_numbers = np.full(ids.max() + 1, -1, dtype=np.int64)
+        book_numbers[ids] = np.arange(len(ids))
+        isbns = books["isbn"].to_pylist()
+        if edges is None:
+            return cls.from_edges([], [], isbns)
+        sources = book_numbers[edges["book_id"].to_numpy()]
+        targets = book_numbers[edges["recommended_id"].to_numpy()]
+        linked = (sources >= 0) & (targets >= 0)
+        return cls.from_edges(sources[linked], targets[linked], isbns)
+
+    @classmethod
+    def from_database(cls, database_path=DEFAULT_DATABASE_PATH):
+        """Build the graph from the book and recommendation tables, without the edges to or from unsaved books"""
+        engine = create_database_engine(database_path)
+        try:
+            with engine.connect() as connection:
+                cursor = connection.connection.cursor()
+                isbns = [isbn for (isbn,) in cursor.execute("SELECT isbn FROM book")]
+                edges = cursor.execute("SELECT book_isbn, recommended_isbn FROM recommendation").fetchall()
+                cursor.close()
+        finally:
+            engine.dispose()
+        index = pd.Index(isbns)
+        sources = index.get_indexer([source for source, _ in edges])
+        targets = index.get_indexer([target for _, target in edges])
+        linked = (sources >= 0) & (targets >= 0)
+        if not linked.all():
+            logging.warning(f"Left {len(edges) - int(linked.sum())} recommendations out of the graph, "
+                            f"their book is not saved")
+        return cls.from_edges(sources[linked], targets[linked], isbns)
+
+    def save(self, directory=DEFAULT_GRAPH_DIR):
+        os.makedirs(directory, exist_ok=True)
+        for name in GRAPH_ARRAYS:
+            path = os.path.join(directory, name)
+            with open(path + ".tmp.npy", "wb") as f:
+                np.save(f, getattr(self, name))
+            os.replace(path + ".tmp.npy", path + ".npy")
+
+    @classmethod
+    def load(cls, directory=DEFAULT_GRAPH_DIR, mmap=True):
+        """Load a saved graph, its arrays memory-mapped read-only unless `mmap` is False"""
+        return cls(*(np.load(os.path.join(directory, name + ".npy"), mmap_mode="r" if mmap else None)
+                     for name in GRAPH_ARRAYS))
+
+    @property
+    def num_books(self):
+        return len(self.indptr) - 1
+
+    @property
+    def num_edges(self):
+        return len(self.indices)
+
+    def index_of(self, isbn):
+        if self._index_of is None:
+            self._index_of = {isbn: i for i, isbn in enumerate(self.isbns.tolist())}
+        return self._index_of[isbn]
+
+    def recommendations(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def out_degree(self):
+        return np.diff(self.indptr)
+
+    def in_degree(self):
+        return np.bincount(self.indices, minlength=self.num_books)
+
+    def edge_sources(self):
+        """The source book of every edge, in the order of `indices`"""
+        return np.repeat(np.arange(self.num_books, dtype=np.int32), self.out_degree())
+
+    def transposed(self):
+        """The graph of the recommended-by edges, built once"""
+        if self._transposed is None:
+            self._transposed = RecommendationGraph.from_edges(self.indices, self.edge_sources(), self.isbns)
+            self._transposed._transposed = self
+        return self._transposed
+
+    def pagerank(self, damping=DEFAULT_DAMPING, tolerance=DEFAULT_TOLERANCE, max_iterations=DEFAULT_MAX_ITERATIONS):
+        """PageRank by power iteration, the rank of the books without recommendations is spread over all books"""
+        n = self.num_books
+        if n == 0:
+            return np.zeros(0)
+        out_degree = self.out_degree()
+        dangling = out_degree == 0
+        inverse_out_degree = np.zeros(n)
+        np.divide(1.0, out_degree, out=inverse_out_degree, where=~dangling)
+        sources = self.edge_sources()
+
+        rank = np.full(n, 1.0 / n)
+        for _ in range(max_iterations):
+            spread = np.bincount(self.indices, weights=(rank * inverse_out_degree)[sources], minlength=n)
+            new_rank = damping * (spread + rank[dangling].sum() / n) + (1 - damping) / n
+            converged = np.abs(new_rank - rank).sum() < tolerance
+            rank = new_rank
+            if converged:
+                break
+        return rank
+
+    def co_recommendation_counts(self, min_count=1):
+        """Pairs of books recommended together by the same books, as (first, second, count) arrays with
+        first < second, sorted by the count"""
+        sources = self.edge_sources()
+        # how many of the source book's recommendations come after each edge
+        following = self.indptr[sources + 1] - np.arange(self.num_edges) - 1
+        pairs = []
+        for offset in range(1, int(following.max(initial=0)) + 1):
+            edges = np.flatnonzero(following >= offset)
+            first, second = self.indices[edges], self.indices[edges + offset]
+            pairs.append((np.minimum(first, second).astype(np.int64) << 32) | np.maximum(first, second))
+        if not pairs:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64)
+
+        keys, counts = np.unique(np.concatenate(pairs), return_counts=True)
+        keep = counts >= min_count
+        keys, counts = keys[keep], counts[keep]
+        order = np.argsort(-counts, kind="stable")
+        keys, counts = keys[order], counts[order]
+        return (keys >> 32).astype(np.int32), (keys & 0xFFFFFFFF).astype(np.int32), counts
+
+    def also_recommended(self, i, k=10):
+        """The k books most often recommended next to book i, as (books, counts) arrays"""
+        recommenders = self.transposed().recommendations(i)
+        if len(recommenders) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        counts = np.bincount(np.concatenate([self.recommendations(r) for r in recommenders]),
+                             minlength=self.num_books)
+        counts[i] = 0
+        books = np.flatnonzero(counts)
+        books = books[np.argsort(-counts[books], kind="stable")[:k]]
+        return books, counts[books]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--export", default=None, help="build the graph from this export directory")
+    source.add_argument("--database", default=None, help="build the graph from this database")
+    parser.add_argument("--save", default=DEFAULT_GRAPH_DIR, help="directory the graph is saved to and loaded from")
+    parser.add_argument("--top", type=int, default=20, help="books listed by PageRank")
+    args = parser.parse_args()
+
+    if args.export:
+        graph = RecommendationGraph.from_export(args.export)
+        graph.save(args.save)
+    elif args.database or not os.path.exists(os.path.join(args.save, "indptr.npy")):
+        graph = RecommendationGraph.from_database(args.database or DEFAULT_DATABASE_PATH)
+        graph.save(args.save)
+    else:
+        graph = RecommendationGraph.load(args.save)
+
+    print(f"{graph.num_books} books, {graph.num_edges} recommendations")
+    rank = graph.pagerank()
+    in_degree = graph.in_degree()
+    for i in np.argsort(-rank)[:args.top]:
+        print(f"{graph.isbns[i]:<20}{rank[i]:.6f}  recommended by {in_degree[i]}")
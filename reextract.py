@@ -0,0 +1,144 @@
+"""Rebuild the database purely from the cached pages, without network or browser, the `reextract` command of
+main.py"""
+import gzip
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import frontier
+from crawl import add_input_arguments, open_input, books_to_scrape
+from crawl_logging import worker_logging_options
+from database import create_session
+from extractor import extract_book_details_from_bytes
+from frontier import DEFAULT_MAX_DEPTH
+from page_cache import configure_page_cache, get_page_cache, set_offline, lookup_resolution, title_resolution_key, \
+    PRODUCT, TITLE_RESOLUTION
+from scraping import query_saxo_with_title_return_search_page, find_book_by_title_in_search_results_return_book_url, \
+    query_saxo_with_isbn_return_book_page_url, get_book_by_isbn, is_book_scraped_url, save_book_details_to_database, \
+    link_recommended_book, frontier_parents, remember_resolution, set_max_crawl_depth
+from utils import ISBN, TOP10K, URL, default_book_dict_with_title_author, default_book_dict_with_isbn
+
+
+def extract_cached_book_page(blob_path, recommendations):
+    """Decompress a cached book page and extract its details, return None if the extraction fails"""
+    try:
+        with gzip.open(blob_path, "rb") as f:
+            return extract_book_details_from_bytes(f.read(), recommendations)
+    except Exception as e:
+        logging.error(f"Failed to extract the cached book page {blob_path}: {e!r}")
+        return None
+
+
+def extract_cached_book_pages(cache, workers=None):
+    """Extract every cached book page in a process pool, return {book_page_url: (book_details, final_url)}"""
+    entries = cache.entries(PRODUCT)
+    blob_paths = [blob_path for _, blob_path, _ in entries]
+    recommendations = [meta["recommendations"] for _, _, meta in entries]
+
+    with ProcessPoolExecutor(max_workers=workers, **worker_logging_options()) as executor:
+        extracted = executor.map(extract_cached_book_page, blob_paths, recommendations, chunksize=32)
+        book_pages = {url: (book_details, meta["final_url"])
+                      for (url, _, meta), book_details in zip(entries, extracted) if book_details is not None}
+
+    logging.info(f"Extracted {len(book_pages)} of {len(entries)} cached book pages")
+    return book_pages
+
+
+def resolve_cached_top10k_book_page_url(title, author):
+    """The book page url of a top10k book from the cached resolution of its search, or from its cached search page.
+
+    Returns 'N/A' or False like the search itself, None if neither is cached."""
+    resolved_url = lookup_resolution(TITLE_RESOLUTION, title_resolution_key(title, author))
+    if resolved_url is not None:
+        return resolved_url
+    search_page_html = query_saxo_with_title_return_search_page(title)
+    if search_page_html is None:
+        return None
+    book_page_url = find_book_by_title_in_search_results_return_book_url(search_page_html, author, title)
+    return remember_resolution(TITLE_RESOLUTION, title_resolution_key(title, author), book_page_url)
+
+
+def save_cached_top10k_book(i, title, author, session, book_pages):
+    """Save a top10k book from the extracted pages the way the crawl does, its recommendations go to the frontier"""
+    book_page_url = resolve_cached_top10k_book_page_url(title, author)
+    if book_page_url is None:
+        return
+    if book_page_url in ('N/A', False) or book_page_url not in book_pages:
+        logging.info(f"Book {i + 1} is not in the cache SAVING DEFAULT")
+        save_book_details_to_database(default_book_dict_with_title_author(title, author, i + 1), session)
+        return
+
+    book_details, final_url = book_pages[book_page_url]
+    book_details = {**book_details, TOP10K: i + 1, URL: book_page_url}
+    # if same book already exists in db
+    if is_book_scraped_url(session, final_url):
+        book_details[ISBN] = book_details[ISBN] + f"_{i + 1}"
+    save_book_details_to_database(book_details, session)
+
+
+def save_cached_recommended_book(entry, session, book_pages):
+    """Save a book taken from the crawl frontier from the extracted pages, like scrape_and_save_recommended_book"""
+    book_isbn = entry.isbn
+    parents = frontier_parents(session, entry.parent_isbns)
+    if get_book_by_isbn(session, book_isbn) is not None:
+        link_recommended_book(parents, book_isbn, session)
+        frontier.complete(session, book_isbn)
+        session.commit()
+        return
+
+    book_page_url = query_saxo_with_isbn_return_book_page_url(book_isbn)
+    if book_page_url is None:
+        frontier.complete(session, book_isbn, frontier.FAILED)
+        session.commit()
+        return
+
+    frontier.complete(session, book_isbn)
+    if book_page_url == 'N/A' or book_page_url not in book_pages:
+        book_details = default_book_dict_with_isbn(book_isbn)
+    else:
+        book_details, final_url = book_pages[book_page_url]
+        if is_book_scraped_url(session, final_url):
+            session.commit()
+            return
+        book_details = {**book_details, TOP10K: 0, URL: book_page_url}
+    if not save_book_details_to_database(book_details, session, parents, entry.depth):
+        # the failed save rolled the completion back
+        frontier.complete(session, book_isbn, frontier.FAILED)
+        session.commit()
+
+
+def rebuild_database_from_cache(rows, session, workers=None):
+    """Rebuild the database from the cached pages only, without any network or browser access.
+
+    `rows` are the (i, normalized title, normalized author) of the top10k books to save. Their recommendations are
+    saved through the crawl frontier down to the max crawl depth. The books already in the database are kept."""
+    cache = get_page_cache()
+    if cache is None:
+        raise RuntimeError("The page cache must be configured to rebuild the database from it")
+
+    set_offline(True)
+    book_pages = extract_cached_book_pages(cache, workers)
+
+    for i, title, author in rows:
+        save_cached_top10k_book(i, title, author, session, book_pages)
+
+    frontier.requeue_in_progress(session)
+    while True:
+        entry = frontier.claim(session)
+        if entry is None:
+            return
+        save_cached_recommended_book(entry, session, book_pages)
+
+
+def add_arguments(parser):
+    add_input_arguments(parser)
+    parser.add_argument("--workers", type=int, default=None, help="number of processes extracting the cached pages")
+    parser.add_argument("--max-depth", type=int, default=DEFAULT_MAX_DEPTH,
+                        help="crawl depth of the recommendations, 1 saves the recommendations of the top10k books")
+
+
+def run(args):
+    book_info, row_range = open_input(args)
+    configure_page_cache(args.cache_dir)
+    set_max_crawl_depth(args.max_depth)
+    session = create_session()
+    rebuild_database_from_cache(list(books_to_scrape(book_info, session, row_range)), session, args.workers)
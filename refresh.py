@@ -0,0 +1,194 @@
+"""Scrape the saved books again once they are stale and write only what changed, instead of crawling from scratch.
+
+The stalest books are refreshed first. Their pages are requested conditionally with the validators of the last
+scrape, and a page the server reports unchanged, or whose scraped content hashes the same, only gets its timestamp
+updated. A changed book gets its changed columns updated, its new recommendations linked and the ones no longer on
+its page unlinked, the unseen ones of a top10k book are pushed to the crawl frontier.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from sqlalchemy import select, or_
+
+import scraping
+from crawl_logging import book_context
+from database import Book, create_session
+from extractor import extract_book_details
+from metrics import timed, count, REFRESH, NOT_MODIFIED, UNCHANGED, UPDATED, ERROR
+from page_cache import store, PRODUCT
+from scraping import http_get, fetch_book_details_page_over_http, render_book_details_page, book_row, \
+    link_authors_to_book, link_children_book_recommendations, save_recommended_books
+from utils import book_content_hash, LoadStatus, URL, TOP10K, AUTHORS, RECOMMENDATIONS
+
+DEFAULT_REFRESH_AGE = 7 * 24 * 60 * 60
+DEFAULT_REFRESH_WORKERS = 2
+# url of the default books, they have no page to refresh
+DEFAULT_BOOK_URL = 'N/A'
+# the book columns that are not scraped from its page
+UNCOMPARED_COLUMNS = ("isbn", "url", "top10k", "content_hash")
+
+
+def stale_books(session, max_age=DEFAULT_REFRESH_AGE, limit=None):
+    """ISBNs of the scraped books not refreshed for `max_age` seconds, the stalest first. Books saved before the
+    scrape time was recorded count as the stalest."""
+    query = (select(Book.isbn)
+             .where(Book.url != DEFAULT_BOOK_URL,
+                    or_(Book.scraped_at.is_(None), Book.scraped_at < time.time() - max_age))
+             .order_by(Book.scraped_at, Book.top10k.desc())
+             .limit(limit))
+    return [isbn for (isbn,) in session.execute(query)]
+
+
+def conditional_headers(book):
+    headers = {}
+    if book.etag:
+        headers["If-None-Match"] = book.etag
+    if book.last_modified:
+        headers["If-Modified-Since"] = book.last_modified
+    return headers
+
+
+def fetch_book_page_if_modified(book):
+    """Fetch the book page unless the server reports it unchanged since the last scrape.
+
+    Returns NOT_MODIFIED, None if the page couldn't be loaded, or (html, recommendations, validators) where
+    recommendations is None when they must be extracted from the html."""
+    try:
+        response = http_get(book.url, headers=conditional_headers(book))
+    except requests.RequestException as e:
+        logging.info(f"Refreshing the book page {book.url} failed: {e!r} FALLING BACK TO BROWSER")
+        response = None
+    if response is not None and response.status_code == 304:
+        return NOT_MODIFIED
+
+    validators = (None, None)
+    loaded_page = None
+    if response is not None:
+        validators = (response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        loaded_page = fetch_book_details_page_over_http(book.url, response)
+    if loaded_page is None:
+        loaded_page = (*render_book_details_page(book.url), None)
+
+    (status, html, final_url, recommendations) = loaded_page
+    if status is not LoadStatus.NEW:
+        return None
+    store(PRODUCT, book.url, html, final_url=final_url, recommendations=recommendations)
+    return (html, recommendations, validators)
+
+
+def update_changed_columns(book, book_details):
+    """Set the scraped columns whose value changed, return their names"""
+    changed_columns = []
+    for column, value in book_row(book_details).items():
+        if column in UNCOMPARED_COLUMNS:
+            continue
+        # compared as stored, e.g. the rating is scraped as a number into a text column
+        if value is not None:
+            value = Book.__table__.c[column].type.python_type(value)
+        if getattr(book, column) != value:
+            setattr(book, column, value)
+            changed_columns.append(column)
+    return changed_columns
+
+
+def write_book_changes(book, book_details, session, depth):
+    """Update the changed columns of the saved book, link its new authors and recommendations and unlink the
+    recommendations that are no longer on its page.
+
+    A book above the max crawl depth pushes its unseen recommendations to the crawl frontier. Returns the changed
+    columns, the new authors, the new recommendations and the dropped ones."""
+    changed_columns = update_changed_columns(book, book_details)
+    linked_authors = {author.name for author in book.authors}
+    new_authors = [name for name in book_details[AUTHORS] if name not in linked_authors]
+    linked_isbns = {recommended_book.isbn for recommended_book in book.recommendations}
+    new_recommendations = [isbn for isbn in book_details[RECOMMENDATIONS] if isbn not in linked_isbns]
+    dropped_recommendations = linked_isbns - set(book_details[RECOMMENDATIONS])
+    for recommended_book in [b for b in book.recommendations if b.isbn in dropped_recommendations]:
+        book.recommendations.remove(recommended_book)
+    link_authors_to_book(book, new_authors, session)
+    if depth < scraping.max_crawl_depth:
+        save_recommended_books(book, new_recommendations, session, depth + 1)
+    else:
+        link_children_book_recommendations(book, new_recommendations, session)
+    book.content_hash = book_content_hash(book_details)
+    return changed_columns, new_authors, new_recommendations, sorted(dropped_recommendations)
+
+
+def refresh_book(isbn, session):
+    """Scrape the saved book again and write what changed, return the outcome"""
+    book = session.get(Book, isbn)
+    page = fetch_book_page_if_modified(book)
+    if page is None:
+        logging.info(f"Refreshing the book {isbn} failed to load its page {book.url} KEEPING")
+        return ERROR
+    if page is NOT_MODIFIED:
+        book.scraped_at = time.time()
+        session.commit()
+        return NOT_MODIFIED
+
+    html, recommendations, (book.etag, book.last_modified) = page
+    book.scraped_at = time.time()
+    book_details = extract_book_details(html, recommendations)
+    book_details[URL], book_details[TOP10K] = book.url, book.top10k
+    new_hash = book_content_hash(book_details)
+    if new_hash == book.content_hash:
+        session.commit()
+        return UNCHANGED
+
+    # the depth of a book outside the top10k isn't kept, it's taken to be the last crawled layer
+    depth = 0 if book.top10k else scraping.max_crawl_depth
+    changed_columns, new_authors, new_recommendations, dropped_recommendations = write_book_changes(
+        book, book_details, session, depth)
+    session.commit()
+    if not (changed_columns or new_authors or new_recommendations or dropped_recommendations):
+        return UNCHANGED
+    logging.info(f"Refreshed the book {isbn}: changed {', '.join(changed_columns) or 'no columns'}, "
+                 f"{len(new_authors)} new authors, {len(new_recommendations)} new recommendations, "
+                 f"{len(dropped_recommendations)} dropped recommendations",
+                 extra={"stage": REFRESH, "outcome": UPDATED})
+    return UPDATED
+
+
+def refresh_worker(isbns, stop):
+    session = create_session()
+    try:
+        while not stop.is_set():
+            try:
+                isbn = isbns.get_nowait()
+            except queue.Empty:
+                return
+            with book_context(isbn=isbn):
+                try:
+                    with timed(REFRESH):
+                        outcome = refresh_book(isbn, session)
+                except Exception as e:
+                    session.rollback()
+                    logging.error(f"Refreshing the book {isbn} failed: {e!r} SKIPPING")
+                    continue
+                count(REFRESH, outcome)
+    finally:
+        session.close()
+
+
+def refresh_stale_books(session, max_age=DEFAULT_REFRESH_AGE, limit=None, workers=DEFAULT_REFRESH_WORKERS,
+                        stop=None):
+    """Refresh the stale books in `workers` threads, each with its own session, until they are done or `stop` is set"""
+    stop = stop or threading.Event()
+    isbns = queue.Queue()
+    for isbn in stale_books(session, max_age, limit):
+        isbns.put(isbn)
+    session.rollback()
+    logging.info(f"Refreshing {isbns.qsize()} books not scraped for {max_age / (24 * 60 * 60):g} days")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(refresh_worker, isbns, stop) for _ in range(workers)]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            stop.set()
+            raise
@@ -0,0 +1,152 @@
+"""Scrape the books that failed during the crawl again in the background, so the crawl itself never waits on them.
+
+The failed books wait in the retry queue with growing delays. A book that succeeds replaces its default book: the
+default of a top10k book, saved under its input row, is deleted and the scraped book saved under its real ISBN, the
+next export compacts for the deletion. The default of a recommended book is filled in place, so the books that
+recommend it stay linked to it.
+"""
+import logging
+
+import frontier
+import retry_queue
+import scraping
+from crawl_logging import book_context
+from database import Book, create_session
+from extractor import extract_book_details
+from metrics import timed, count, RETRY, SUCCESS, DEFAULT, ERROR, GAVE_UP
+from page_cache import NOT_FOUND
+from pipeline import BookJob, find_top10k_book_page_url, extract_top10k_book_details, save_top10k_book_details
+from refresh import write_book_changes, DEFAULT_BOOK_URL
+from retry_queue import SEARCH_FAILED, MATCH_FAILED, LOAD_FAILED, EXTRACTION_FAILED, SAVE_FAILED, FAILED, \
+    DEFAULT_MAX_ATTEMPTS
+from scraping import query_saxo_with_title_return_search_page, query_saxo_with_isbn_return_book_page_url, \
+    load_book_details_page, get_book_by_isbn, is_book_scraped_url, save_book_details_to_database, frontier_parents, \
+    link_recommended_book
+from utils import LoadStatus, TOP10K, URL
+
+DEFAULT_RETRY_WORKERS = 1
+# how long an idle retry worker waits before looking for due entries
+RETRY_IDLE_POLL = 2.0
+
+
+def default_book_of(session, isbn):
+    """The default book saved for the failed book, None if there is none"""
+    if scraping.write_behind is not None:
+        scraping.write_behind.flush()  # the default book may still be buffered
+    book = session.get(Book, isbn)
+    return book if book is not None and book.url == DEFAULT_BOOK_URL else None
+
+
+def retry_top10k_book(entry, session):
+    """Search, load and extract the top10k book again and save it in place of its default book.
+
+    Returns the reason it failed again, None once it's done."""
+    i = entry.top10k - 1
+    search_page_html = query_saxo_with_title_return_search_page(entry.title)
+    if search_page_html is None:
+        return SEARCH_FAILED
+    book_page_url = find_top10k_book_page_url(i, entry.title, entry.author, search_page_html)
+    if book_page_url is False:
+        return MATCH_FAILED
+    if book_page_url == NOT_FOUND:
+        logging.info(f"Book {entry.top10k} is not in the search results KEEPING DEFAULT")
+        return None
+
+    job = BookJob(i, entry.title, entry.author)
+    job.book_page_url = book_page_url
+    (job.status, book_page_html, job.final_url, recommendations) = load_book_details_page(book_page_url)
+    if job.status is not LoadStatus.NEW:
+        return LOAD_FAILED
+    job.book_details = extract_top10k_book_details(i, book_page_html, recommendations)
+    if job.book_details is None:
+        return EXTRACTION_FAILED
+
+    default_book = default_book_of(session, entry.isbn)
+    if default_book is not None:
+        session.delete(default_book)
+        session.flush()
+    save_top10k_book_details(job, session)
+    # the save rolls back the deletion if it fails
+    session.commit()
+    if default_book is not None and default_book_of(session, entry.isbn) is not None:
+        return SAVE_FAILED
+    return None
+
+
+def retry_recommended_book(entry, session):
+    """Search, load and extract the recommended book again and fill in its default book, or save it if it has none.
+
+    Returns the reason it failed again, None once it's done."""
+    book_page_url = query_saxo_with_isbn_return_book_page_url(entry.isbn)
+    if book_page_url is None:
+        return SEARCH_FAILED
+    if book_page_url == NOT_FOUND:
+        logging.info(f"Book {entry.isbn} is not in the search results KEEPING DEFAULT")
+        return None
+
+    (status, book_page_html, final_url, recommendations) = load_book_details_page(book_page_url)
+    if status is not LoadStatus.NEW:
+        return LOAD_FAILED
+    try:
+        book_details = extract_book_details(book_page_html, recommendations)
+    except Exception as e:
+        logging.error(f"Failed to extract the book page of book {entry.isbn}: {e!r} RETRYING LATER")
+        return EXTRACTION_FAILED
+    book_details[TOP10K], book_details[URL] = 0, book_page_url
+
+    parents = frontier_parents(session, frontier.parents_of(session, entry.isbn))
+    default_book = default_book_of(session, entry.isbn)
+    if default_book is not None:
+        default_book.url = book_page_url
+        write_book_changes(default_book, book_details, session, entry.depth)
+        link_recommended_book(parents, entry.isbn, session)
+    elif get_book_by_isbn(session, entry.isbn) is None and not is_book_scraped_url(session, final_url):
+        save_book_details_to_database(book_details, session, parents, entry.depth)
+    frontier.complete(session, entry.isbn)
+    session.commit()
+    return None
+
+
+def retry_book(entry, session, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Scrape the claimed book again and complete its entry, or schedule its next attempt"""
+    try:
+        with timed(RETRY):
+            if entry.top10k:
+                reason = retry_top10k_book(entry, session)
+            else:
+                reason = retry_recommended_book(entry, session)
+    except Exception as e:
+        session.rollback()
+        logging.error(f"Retrying the book {entry.isbn} failed: {e!r}")
+        reason = SAVE_FAILED
+
+    if reason is not None:
+        status = retry_queue.reschedule(session, entry, reason, max_attempts)
+        count(RETRY, GAVE_UP if status == FAILED else ERROR)
+        return
+    retry_queue.complete(session, entry.isbn)
+    session.commit()
+    still_default = default_book_of(session, entry.isbn) is not None
+    count(RETRY, DEFAULT if still_default else SUCCESS)
+    if not still_default:
+        logging.info(f"Retrying the book {entry.isbn} after {entry.reason} succeeded REPLACED DEFAULT")
+
+
+def drain_retry_queue(crawl_done, stop, max_attempts=DEFAULT_MAX_ATTEMPTS, follow_frontier=True):
+    """Retry the failed books as they come due, until the crawl and its frontier are done and no retry is due.
+
+    Without `follow_frontier` the frontier isn't waited for, there are no workers draining it. The retries that are
+    not due by then stay queued for the next run."""
+    session = create_session()
+    try:
+        while not stop.is_set():
+            entry = retry_queue.claim(session)
+            if entry is None:
+                if crawl_done.is_set() and not (follow_frontier and frontier.has_unfinished_work(session)):
+                    return
+                stop.wait(RETRY_IDLE_POLL)
+                continue
+            with book_context(*((entry.top10k, None) if entry.top10k else (None, entry.isbn))):
+                retry_book(entry, session, max_attempts)
+    finally:
+        session.close()
@@ -0,0 +1,110 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import func, update, select
+from sqlalchemy.dialects.sqlite import insert
+
+from database import RetryEntry
+
+# the first retry waits this long after the failure, every further one twice as long as the one before, up to the max
+RETRY_BASE_DELAY = 30.0
+RETRY_MAX_DELAY = 30 * 60.0
+DEFAULT_MAX_ATTEMPTS = 5
+
+retry_base_delay = RETRY_BASE_DELAY
+
+PENDING = "pending"
+IN_PROGRESS = "in_progress"
+DONE = "done"
+FAILED = "failed"  # gave up after the max attempts
+
+# why the book failed
+SEARCH_FAILED = "search_failed"
+MATCH_FAILED = "match_failed"  # the search results couldn't be parsed
+LOAD_FAILED = "load_failed"
+EXTRACTION_FAILED = "extraction_failed"
+SAVE_FAILED = "save_failed"
+
+ClaimedRetry = namedtuple("ClaimedRetry", ["isbn", "top10k", "title", "author", "depth", "reason", "attempts"])
+
+# claims are serialized so that two workers never take the same entry
+_claim_lock = threading.Lock()
+
+
+def set_retry_base_delay(seconds):
+    global retry_base_delay
+    retry_base_delay = seconds
+
+
+def retry_delay(attempts):
+    """How long to wait before the next attempt of a book that failed `attempts` times"""
+    return min(RETRY_MAX_DELAY, retry_base_delay * 2 ** max(attempts - 1, 0))
+
+
+def push(session, isbn, reason, top10k=0, title=None, author=None, depth=0):
+    """Queue the failed book in the session's transaction, a book that is queued already keeps its attempts"""
+    statement = insert(RetryEntry.__table__)
+    statement = statement.on_conflict_do_update(index_elements=["isbn"],
+                                                set_={"reason": statement.excluded.reason, "status": PENDING})
+    session.execute(statement, [{"isbn": str(isbn), "top10k": top10k, "title": title, "author": author,
+                                 "depth": depth, "reason": reason, "status": PENDING, "attempts": 0,
+                                 "next_attempt_at": time.time() + retry_delay(0)}])
+    logging.info(f"Book {isbn} failed with {reason} QUEUED FOR RETRY")
+
+
+def claim(session):
+    """Mark the pending entry that is due first as in progress and return it, or None if none is due yet"""
+    table = RetryEntry.__table__
+    with _claim_lock:
+        row = session.execute(select(table)
+                              .where(table.c.status == PENDING, table.c.next_attempt_at <= time.time())
+                              .order_by(table.c.next_attempt_at)
+                              .limit(1)).first()
+        if row is None:
+            session.rollback()
+            return None
+
+        session.execute(update(table).where(table.c.isbn == row.isbn)
+                        .values(status=IN_PROGRESS, attempts=table.c.attempts + 1))
+        session.commit()
+    return ClaimedRetry(row.isbn, row.top10k, row.title, row.author, row.depth, row.reason, row.attempts + 1)
+
+
+def complete(session, isbn):
+    """Mark the entry as done in the session's transaction"""
+    table = RetryEntry.__table__
+    session.execute(update(table).where(table.c.isbn == isbn).values(status=DONE))
+
+
+def reschedule(session, entry, reason, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Schedule the next attempt of the entry that failed again, or give it up after the max attempts, and commit.
+
+    Returns the entry's new status."""
+    table = RetryEntry.__table__
+    if entry.attempts >= max_attempts:
+        status = FAILED
+        session.execute(update(table).where(table.c.isbn == entry.isbn).values(status=status, reason=reason))
+        logging.info(f"Retrying the book {entry.isbn} failed {entry.attempts} times, last with {reason} GIVING UP")
+    else:
+        status = PENDING
+        session.execute(update(table).where(table.c.isbn == entry.isbn)
+                        .values(status=status, reason=reason,
+                                next_attempt_at=time.time() + retry_delay(entry.attempts)))
+    session.commit()
+    return status
+
+
+def requeue_in_progress(session):
+    """Return the entries claimed by a run that stopped before finishing them to the pending state"""
+    table = RetryEntry.__table__
+    requeued = session.execute(update(table).where(table.c.status == IN_PROGRESS).values(status=PENDING)).rowcount
+    session.commit()
+    if requeued:
+        logging.info(f"Requeued {requeued} retries left in progress by the previous run")
+
+
+def counts(session):
+    table = RetryEntry.__table__
+    return dict(session.execute(select(table.c.status, func.count()).group_by(table.c.status)).all())
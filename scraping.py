@@ -3,29 +3,134 @@ import json
 import logging
 import time
 import traceback
+from collections import namedtuple
 from enum import Enum
 
 import requests
 from bs4 import BeautifulSoup
 from selenium.common.exceptions import TimeoutException
-from selenium.webdriver import Chrome
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 
+from book_index import book_index
+from browser_pool import get_browser_pool, page_ready_timeout
 from database import Book, Author
-from utils import translate_danish_to_english, is_book_correct, \
-    extract_book_details_dict, ISBN, TITLE, PAGE_COUNT, PUBLISHED_DATE, PUBLISHER, FORMAT, NUM_OF_RATINGS, RATING, \
-    DESCRIPTION, TOP10K, AUTHORS, RECOMMENDATIONS, default_book_dict_with_isbn, URL, LoadStatus
+from crawl_logging import tracing_current_book
+from extractor import extract_book_details
+import frontier
+import retry_queue
+from frontier import FIRST_LAYER_DEPTH, DEFAULT_MAX_DEPTH
+from metrics import timed, count, SEARCH_FETCH, PAGE_READY, EXTRACTION, DB_FLUSH, RECOMMENDATION_EXPANSION, BOOK, \
+    SUCCESS, DEFAULT, ERROR, LINKED, QUEUED, SKIPPED
+from page_cache import lookup, store, is_offline, lookup_resolution, store_resolution, SEARCH, ISBN_SEARCH, PRODUCT, \
+    ISBN_RESOLUTION
+from rate_limit import rate_limiter_for, backoff_delay, parse_retry_after, TRANSIENT_STATUS_CODES, \
+    DEFAULT_MAX_RETRIES
+from teasers import iter_teaser_payloads
+from utils import translate_danish_to_english, is_book_correct, extract_static_recommendations_list, \
+    extract_recommendations_source_url, parse_recommendations_response, ISBN, TITLE, PAGE_COUNT, PUBLISHED_DATE, \
+    PUBLISHER, FORMAT, NUM_OF_RATINGS, RATING, DESCRIPTION, TOP10K, AUTHORS, RECOMMENDATIONS, \
+    default_book_dict_with_isbn, book_content_hash, URL, SAXO_BASE_URL, LoadStatus
+
+SAXO_SEARCH_PATH = "/dk/products/search?query="
+# the site the crawl talks to, a local stand-in server in load tests
+saxo_base_url = SAXO_BASE_URL
+
+# a timed out page load is retried this many times before the book is saved as default, unless the retry queue
+# takes the book
+BROWSER_MAX_RETRIES = 1
+# a book page is ready once the details the extractor reads are in it, checked in one round trip to the browser
+PAGE_READY_SCRIPT = """return document.querySelector('ul.description-dot-list') !== null && (
+    document.querySelector('#product-page-banner-container .book-slick-slider.slick-initialized') !== null ||
+    (document.readyState === 'complete' && document.getElementById('product-page-banner-container') === null))"""
+PAGE_READY_POLL_INTERVAL = 0.1
+
+# shared session so that sequential requests reuse the keep-alive connection instead of a new handshake each time
+http_session = requests.Session()
+
+# whether book pages are first fetched over plain HTTP, falling back to the browser only when needed
+fast_path_enabled = False
+
+
+def enable_fast_path(enabled=True):
+    global fast_path_enabled
+    fast_path_enabled = enabled
+
+
+# books above this crawl depth push their unseen recommendations to the crawl frontier
+max_crawl_depth = DEFAULT_MAX_DEPTH
+
+
+def set_max_crawl_depth(depth):
+    global max_crawl_depth
+    max_crawl_depth = depth
+
+
+# buffers the database writes when set, otherwise every book is committed directly through the ORM session
+write_behind = None
+
+
+def enable_write_behind(writer):
+    global write_behind
+    write_behind = writer
+
+
+# whether the failed books are queued to be scraped again in the background, instead of retrying them on the spot
+retry_queue_enabled = False
+
+
+def enable_retry_queue(enabled=True):
+    global retry_queue_enabled
+    retry_queue_enabled = enabled
+
+
+def http_get(url, max_retries=DEFAULT_MAX_RETRIES, **kwargs):
+    """GET the url paced by the host's rate limiter, retrying transient failures with jittered exponential backoff.
+
+    Returns the last response, also when it's still a failure after the retries."""
+    limiter = rate_limiter_for(url)
+    kwargs.setdefault("timeout", 30)
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        start = time.monotonic()
+        retry_after = 0
+        try:
+            response = http_session.get(url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            limiter.record_failure()
+            if attempt == max_retries:
+                raise
+            logging.info(f"Fetching {url} failed: {e!r} RETRYING")
+        else:
+            limiter.record_response(response.status_code, time.monotonic() - start)
+            if response.status_code not in TRANSIENT_STATUS_CODES or attempt == max_retries:
+                return response
+            logging.info(f"Fetching {url} returned status code {response.status_code} RETRYING")
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        time.sleep(max(retry_after, backoff_delay(attempt)))
+
+
+def set_saxo_base_url(base_url):
+    global saxo_base_url
+    saxo_base_url = base_url.rstrip("/")
+
+
+def build_search_url(query):
+    return saxo_base_url + SAXO_SEARCH_PATH + query.replace(' ', '+')
 
 
 def query_saxo_with_title_return_search_page(title):
     """Search for the book on Saxo.com """
-    search_url = f"https://www.saxo.com/dk/products/search?query={title.replace(' ', '+')}"
-    response = requests.get(search_url)
+    cached_page = lookup(SEARCH, title)
+    if cached_page is not None:
+        return cached_page.content
+    if is_offline():
+        logging.info(f"Search page for {title} is not cached OFFLINE ABORTING")
+        return None
+
+    response = http_get(build_search_url(title))
 
     if response.status_code == 200:
+        store(SEARCH, title, response.text)
         return response.text
 
     else:
@@ -34,20 +139,28 @@ def query_saxo_with_title_return_search_page(title):
         return None
 
 
-def is_query_redirecting_to_book_page(response):
-    return 'search?query' not in response.url
+def is_query_redirecting_to_book_page(url):
+    return 'search?query' not in url
 
 
 def query_saxo_with_isbn_return_book_page_url(isbn):
     """Search for the book on Saxo.com """
-    search_url = f"https://www.saxo.com/dk/products/search?query={isbn}"
-    response = requests.get(search_url)
+    resolved_url = lookup_resolution(ISBN_RESOLUTION, isbn)
+    if resolved_url is not None:
+        return resolved_url
+    cached_page = lookup(ISBN_SEARCH, isbn)
+    if cached_page is not None:
+        return remember_resolution(ISBN_RESOLUTION, isbn, resolve_isbn_search_page(
+            isbn, cached_page.meta["final_url"], cached_page.content))
+    if is_offline():
+        logging.info(f"Search page for {isbn} is not cached OFFLINE ABORTING")
+        return None
 
-    if response.status_code == 200 and is_query_redirecting_to_book_page(response):
-        return response.url
+    response = http_get(build_search_url(isbn))
 
-    elif response.status_code == 200:  # if the page returns the search page and doesnt redirect to the single entry
-        return find_book_by_isbn_in_search_results_return_book_url(response.text, isbn)
+    if response.status_code == 200:
+        store(ISBN_SEARCH, isbn, response.text, final_url=response.url)
+        return remember_resolution(ISBN_RESOLUTION, isbn, resolve_isbn_search_page(isbn, response.url, response.text))
 
     else:
         logging.exception(
@@ -55,18 +168,35 @@ def query_saxo_with_isbn_return_book_page_url(isbn):
         return None
 
 
+def remember_resolution(kind, key, book_page_url):
+    """Cache the url or 'N/A' the search resolved to and return it, a failed search (None or False) is not cached"""
+    if book_page_url is not None and book_page_url is not False:
+        store_resolution(kind, key, book_page_url)
+    return book_page_url
+
+
+def resolve_isbn_search_page(isbn, final_url, html_content_search_page):
+    """Return the book page url from the response of an ISBN search"""
+    if is_query_redirecting_to_book_page(final_url):
+        return final_url
+
+    # if the page returns the search page and doesnt redirect to the single entry
+    return find_book_by_isbn_in_search_results_return_book_url(html_content_search_page, isbn)
+
+
 def find_book_by_title_in_search_results_return_book_url(html_content_search_page, author=None, title=None):
     try:
-        soup_search_page = BeautifulSoup(html_content_search_page, "html.parser")
-        for book in soup_search_page.find_all("div", class_="product-list-teaser"):
-            book_parsed = translate_danish_to_english(book.find("a").get("data-val"))
+        book_parsed = ""
+        for teaser_payload in iter_teaser_payloads(html_content_search_page):
+            book_parsed = translate_danish_to_english(teaser_payload)
             book_parsed = json.loads(book_parsed)
-            print(book_parsed)
 
             # verify that the book matches the search criteria (author and paperbook)
             if 'Authors' in book_parsed and 'Work' in book_parsed:
                 if is_book_correct(author, book_parsed):
                     return book_parsed["Url"]
+            if tracing_current_book():
+                logging.debug(f"Search result {book_parsed.get('Url')} doesn't match the author {author}")
 
         logging.info(
             f"Failed to find the book in the search results. Title: {title}, Author: {author}, Book details: {book_parsed} SAVING DEFAULT")
@@ -80,11 +210,9 @@ def find_book_by_title_in_search_results_return_book_url(html_content_search_pag
 def find_book_by_isbn_in_search_results_return_book_url(html_content_search_page, isbn):
     try:
         book_parsed = ""
-        soup_search_page = BeautifulSoup(html_content_search_page, "html.parser")
-        for book in soup_search_page.find_all("div", class_="product-list-teaser"):
-            book_parsed = translate_danish_to_english(book.find("a").get("data-val"))
+        for teaser_payload in iter_teaser_payloads(html_content_search_page):
+            book_parsed = translate_danish_to_english(teaser_payload)
             book_parsed = json.loads(book_parsed)
-            print(book_parsed)
 
             # verify that the book matches the search criteria isbn
             if 'Id' in book_parsed and book_parsed['Id'] == isbn:
@@ -113,52 +241,148 @@ def if_paperbook_option_exists_return_new_url(html_content):
         # If not found, try to find a class 'icon-book'
         book_link = product_variant_div.find("a", class_="icon-book")
         if book_link:
-            return "https://www.saxo.com" + book_link.get("href")
+            return saxo_base_url + book_link.get("href")
 
     return None
 
 
 def is_book_scraped_url(session, url):
-    return session.query(Book).filter(Book.url == url).first()
+    return book_index(session).has_url(url)
 
 
-def create_browser_and_wait_for_book_details_page_load(book_detail_page_url, session):
-    """Create a browser and wait for the page to load, then return the page source"""
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")
-    with Chrome(options=chrome_options) as browser:
-        browser.get(book_detail_page_url)
-        print(browser.current_url)
-
+def wait_for_book_details_page_load(browser):
+    """Wait until the details list and the initialized recommendation carousel are in the page, a page without a
+    carousel is ready once it's completely loaded. The timeout adapts to how long the recent pages took."""
+    timeout = page_ready_timeout.current()
+    start = time.monotonic()
+    with timed(PAGE_READY):
         try:
-            WebDriverWait(browser, 30).until(lambda d: d.execute_script('return document.readyState') == 'complete')
-            WebDriverWait(browser, 30).until(EC.presence_of_element_located((By.CLASS_NAME, "book-slick-slider")))
+            WebDriverWait(browser, timeout, poll_frequency=PAGE_READY_POLL_INTERVAL).until(
+                lambda d: d.execute_script(PAGE_READY_SCRIPT))
+        except TimeoutException:
+            page_ready_timeout.record_timeout(timeout)
+            raise
+    page_ready_timeout.record(time.monotonic() - start)
 
-            # check if paperbook version of the book exists if so -- reiterate
-            new_url = if_paperbook_option_exists_return_new_url(browser.page_source)
-            if new_url is None:
-                html = browser.page_source
-            else:
-                return create_browser_and_wait_for_book_details_page_load(new_url, session)
 
-            # if book is already scraped, return False with html to still scrape its recommendations
-            if is_book_scraped_url(session, browser.current_url):
-                print(f"Book {browser.current_url} already scraped")
-                return (LoadStatus.EXISTING, html)
+def fetch_book_details_page_over_http(book_detail_page_url, response=None):
+    """Fetch the book page without a browser and return (status, html, final_url, recommendations).
 
-        except TimeoutException:
-            print('kurdefiks')
-            logging.info(f"Failed to load the page. URL: {book_detail_page_url} SAVING DEFAULT")
-            return (LoadStatus.ERROR, None)
+    The recommendations are read from the static carousel or the data request the carousel loads. Returns None
+    if the static page is not enough to produce them. `response` is the url's response if it's fetched already."""
+    visited_urls = set()
+    url = book_detail_page_url
+    try:
+        if response is None:
+            response = http_get(url)
+        while True:
+            visited_urls.add(url)
+            if response.status_code != 200:
+                logging.info(f"Fast path got status code {response.status_code} for {url} FALLING BACK TO BROWSER")
+                return None
+
+            new_url = if_paperbook_option_exists_return_new_url(response.text)
+            if new_url is None or new_url in visited_urls:
+                break
+            url = new_url
+            response = http_get(url)
+
+        soup = BeautifulSoup(response.text, "html.parser")
+        if soup.find("ul", class_="description-dot-list") is None:
+            return None
 
-    # otherwise, return the html
-    return (LoadStatus.NEW, html)
+        recommendations = extract_static_recommendations_list(soup)
+        if recommendations is None:
+            recommendations_url = extract_recommendations_source_url(soup, response.url)
+            if recommendations_url is None:
+                return None
+            recommendations_response = http_get(recommendations_url, headers={"X-Requested-With": "XMLHttpRequest"})
+            if recommendations_response.status_code != 200:
+                return None
+            recommendations = parse_recommendations_response(recommendations_response.text)
+            if recommendations is None:
+                return None
+
+    except requests.RequestException as e:
+        logging.info(f"Fast path failed for {book_detail_page_url}: {e!r} FALLING BACK TO BROWSER")
+        return None
+
+    return (LoadStatus.NEW, response.text, response.url, recommendations)
+
+
+def load_book_details_page(book_detail_page_url):
+    """Load the book page and return (status, html, final_url, recommendations).
+
+    Cached pages are served first, then the fast path is tried when enabled before rendering the page in a browser.
+    recommendations is None when they must be extracted from the html."""
+    cached_page = lookup(PRODUCT, book_detail_page_url)
+    if cached_page is not None:
+        return (LoadStatus.NEW, cached_page.content, cached_page.meta["final_url"], cached_page.meta["recommendations"])
+    if is_offline():
+        logging.info(f"Book page {book_detail_page_url} is not cached OFFLINE SAVING DEFAULT")
+        return (LoadStatus.ERROR, None, None, None)
+
+    loaded_page = fetch_book_details_page_over_http(book_detail_page_url) if fast_path_enabled else None
+    if loaded_page is None:
+        loaded_page = (*render_book_details_page(book_detail_page_url), None)
+
+    (status, html, final_url, recommendations) = loaded_page
+    if status is LoadStatus.NEW:
+        store(PRODUCT, book_detail_page_url, html, final_url=final_url, recommendations=recommendations)
+    return loaded_page
+
+
+def render_book_details_page(book_detail_page_url, max_retries=None):
+    """Render the book page in a pooled browser and return (status, html, final_url).
+
+    If a paperbook variant of the book exists, the same browser is navigated to it instead. Page loads are paced
+    by the host's rate limiter and a timed out load is retried with backoff, unless the retry queue takes it."""
+    if max_retries is None:
+        max_retries = 0 if retry_queue_enabled else BROWSER_MAX_RETRIES
+    limiter = rate_limiter_for(book_detail_page_url)
+    for attempt in range(max_retries + 1):
+        with get_browser_pool().browser() as browser:
+            visited_urls = set()
+            url = book_detail_page_url
+            try:
+                while True:
+                    visited_urls.add(url)
+                    limiter.acquire()
+                    start = time.monotonic()
+                    browser.get(url)
+                    logging.debug(f"Rendering {browser.current_url}", extra={"stage": PAGE_READY})
+                    wait_for_book_details_page_load(browser)
+                    limiter.record_response(200, time.monotonic() - start)
+
+                    # check if paperbook version of the book exists if so -- reiterate
+                    new_url = if_paperbook_option_exists_return_new_url(browser.page_source)
+                    if new_url is None or new_url in visited_urls:
+                        return (LoadStatus.NEW, browser.page_source, browser.current_url)
+                    url = new_url
+
+            except TimeoutException:
+                limiter.record_failure()
+                if attempt < max_retries:
+                    logging.info(f"Loading the page timed out. URL: {url} RETRYING")
+
+        if attempt < max_retries:
+            time.sleep(backoff_delay(attempt))
+
+    logging.info(f"Failed to load the page. URL: {book_detail_page_url} SAVING DEFAULT")
+    return (LoadStatus.ERROR, None, None)
 
 
 # SAVING THE BOOK TO THE DATABASE ############################
 
-def save_book_details_to_database(book_details, session, parent=None):
-    """Save or update book details in the database."""
+def save_book_details_to_database(book_details, session, parents=(), depth=0):
+    """Save or update book details in the database.
+
+    `parents` are the books that recommended it and `depth` is its crawl depth, 0 for the top10k books. The books
+    above the max crawl depth link their recommendations that exist and push the others to the crawl frontier.
+    Returns False if the save failed, its transaction is rolled back then."""
+    if write_behind is not None:
+        return save_book_details_write_behind(book_details, session, parents, depth)
+
     try:
         book = get_book_by_isbn(session, book_details[ISBN])
         if book is None:
@@ -168,31 +392,43 @@ def save_book_details_to_database(book_details, session, parent=None):
 
             link_authors_to_book(book, book_details[AUTHORS], session)
 
-        if parent:  # this statement essentially means that the book is a second-layer recommended book
+        expand_recommendations = depth < max_crawl_depth
+        if parents and not expand_recommendations:  # a book in the last layer only links the existing books
             link_children_book_recommendations(book, book_details[RECOMMENDATIONS], session)
 
+        for parent in parents:
             if book not in parent.recommendations:
                 parent.recommendations.append(book)
-                session.flush()
 
         if book_details[TOP10K] != 0:  # this means that the book is in the first-layer list
-            # if book is in the top10k list, then scrape its recommendations too
             book.top10k = book_details[TOP10K]
-            session.flush()
-            save_recommended_books(book, book_details[RECOMMENDATIONS], session)
+        session.flush()
 
-        session.commit()
+        if expand_recommendations:
+            with timed(RECOMMENDATION_EXPANSION):
+                save_recommended_books(book, book_details[RECOMMENDATIONS], session, depth + 1)
+
+        with timed(DB_FLUSH):
+            session.commit()
+        return True
     except Exception as e:
         session.rollback()
-        logging.error(f"Error saving details for '{book_details[TITLE]}', ISBN: {book_details[ISBN]}", e)
+        logging.error(f"Error saving details for '{book_details[TITLE]}', ISBN: {book_details[ISBN]}: {e!r}")
+        return False
 
 
 def get_book_by_isbn(session, isbn):
-    return session.query(Book).filter_by(isbn=isbn).first()
+    # the index answers the (most common) negative case, a known book is then read from the identity map or by its key
+    return session.get(Book, isbn) if book_index(session).has_isbn(isbn) else None
 
 
 def create_new_book(book_details):
-    return Book(
+    return Book(**book_row(book_details))
+
+
+def book_row(book_details):
+    """Map the book details to the columns of the book table"""
+    return dict(
         isbn=book_details[ISBN],
         title=book_details[TITLE],
         page_count=book_details[PAGE_COUNT],
@@ -203,13 +439,14 @@ def create_new_book(book_details):
         rating=book_details[RATING],
         description=book_details[DESCRIPTION],
         url=book_details[URL],
-        top10k=book_details[TOP10K]
+        top10k=book_details[TOP10K],
+        content_hash=book_content_hash(book_details)
     )
 
 
 def get_or_create_book(session, book_details):
     """Retrieve a book by ISBN or create a new one if not found."""
-    book = session.query(Book).filter_by(isbn=book_details[ISBN]).first()
+    book = get_book_by_isbn(session, book_details[ISBN])
     if not book:
         book = create_new_book(book_details)
         session.add(book)
@@ -226,8 +463,9 @@ def link_children_book_recommendations(parent_book, recommended_books, session):
 
 
 def link_authors_to_book(book, authors, session):
-    for author_name in authors:
-        author = session.query(Author).filter_by(name=author_name).first()
+    # the new authors are only added to the index on the next flush, so the names are deduplicated here
+    for author_name in dict.fromkeys(authors):
+        author = session.get(Author, author_name) if book_index(session).has_author(author_name) else None
         if not author:
             author = Author(name=author_name)
             session.add(author)
@@ -235,46 +473,179 @@ def link_authors_to_book(book, authors, session):
             book.authors.append(author)
 
 
-def save_recommended_books(parent_book, recommended_isbns, session):
-    """Save the recommended books to the database if they don't exist yet"""
+def save_recommended_books(parent_book, recommended_isbns, session, depth=FIRST_LAYER_DEPTH):
+    """Link the recommended books that are already in the database and push the others to the crawl frontier"""
+    unseen_isbns = []
     for recommended_isbn in recommended_isbns:
         # check if the recommended book is already in the database
         existing_recommended_book = get_book_by_isbn(session, recommended_isbn)
-        if existing_recommended_book and existing_recommended_book not in parent_book.recommendations:
+        if existing_recommended_book is None:
+            unseen_isbns.append(recommended_isbn)
+        elif existing_recommended_book not in parent_book.recommendations:
             parent_book.recommendations.append(existing_recommended_book)
-            continue
+            count(RECOMMENDATION_EXPANSION, LINKED)
+
+    # if not, it's scraped later by the frontier workers
+    frontier.push(session, unseen_isbns, parent_book.isbn, depth)
+    count(RECOMMENDATION_EXPANSION, QUEUED, len(unseen_isbns))
+
+
+def link_recommended_book(parents, book_isbn, session):
+    """Link a book that is already saved to the books that recommended it"""
+    if write_behind is not None:
+        for parent in parents:
+            write_behind.add_recommendation(parent.isbn, book_isbn)
+        return
+
+    book = get_book_by_isbn(session, book_isbn)
+    for parent in parents:
+        if book is not None and book not in parent.recommendations:
+            parent.recommendations.append(book)
+
+
+# WRITE-BEHIND MODE ############################
+
+class BookRef(namedtuple("BookRef", ["isbn"])):
+    """Stands in for the parent Book of a recommended book when the writes are buffered"""
+
+
+def save_book_details_write_behind(book_details, session, parents=(), depth=0):
+    """Buffer the book, its authors and recommendation edges, mirroring save_book_details_to_database"""
+    index = book_index(session)
+    isbn = book_details[ISBN]
+    try:
+        if not index.has_isbn(isbn):
+            authors = list(dict.fromkeys(book_details[AUTHORS]))
+            write_behind.add_book(book_row(book_details), authors)
+            index.add_book(isbn, book_details[URL], book_details[TOP10K])
+            for author_name in authors:
+                index.add_author(author_name)
+
+        expand_recommendations = depth < max_crawl_depth
+        if parents and not expand_recommendations:  # a book in the last layer only links the existing books
+            for recommended_isbn in book_details[RECOMMENDATIONS]:
+                if index.has_isbn(recommended_isbn):
+                    write_behind.add_recommendation(isbn, recommended_isbn)
+
+        for parent in parents:
+            write_behind.add_recommendation(parent.isbn, isbn)
+
+        if book_details[TOP10K] != 0:  # this means that the book is in the first-layer list
+            write_behind.set_top10k(isbn, book_details[TOP10K])
+            index.add_book(isbn, book_details[URL], book_details[TOP10K])
+
+        if expand_recommendations:
+            with timed(RECOMMENDATION_EXPANSION):
+                save_recommended_books_write_behind(BookRef(isbn), book_details[RECOMMENDATIONS], session, depth + 1)
+        return True
+    except Exception as e:
+        session.rollback()
+        logging.error(f"Error buffering details for '{book_details[TITLE]}', ISBN: {isbn}: {e!r}")
+        return False
+
+
+def save_recommended_books_write_behind(parent_book, recommended_isbns, session, depth=FIRST_LAYER_DEPTH):
+    unseen_isbns = []
+    for recommended_isbn in recommended_isbns:
+        if book_index(session).has_isbn(recommended_isbn):
+            write_behind.add_recommendation(parent_book.isbn, recommended_isbn)
+            count(RECOMMENDATION_EXPANSION, LINKED)
+        else:
+            unseen_isbns.append(recommended_isbn)
+
+    frontier.push(session, unseen_isbns, parent_book.isbn, depth)
+    count(RECOMMENDATION_EXPANSION, QUEUED, len(unseen_isbns))
+    session.commit()
+
+
+# CRAWL FRONTIER ############################
+
+def frontier_parents(session, parent_isbns):
+    """Return the books (or references to the buffered books) that recommended a frontier entry"""
+    if write_behind is not None:
+        return [BookRef(parent_isbn) for parent_isbn in parent_isbns]
+
+    parents = []
+    for parent_isbn in parent_isbns:
+        parent = get_book_by_isbn(session, parent_isbn)
+        if parent is not None:
+            parents.append(parent)
+    return parents
 
-        # if not, scrape the details and save it
-        scrape_and_save_recommended_book(parent_book, recommended_isbn, session)
-        time.sleep(1)
 
+def save_recommended_book_details(book_details, session, parents, depth):
+    """Save the recommended book, raising if the save failed so that its frontier entry is failed instead"""
+    if not save_book_details_to_database(book_details, session, parents, depth):
+        raise RuntimeError(f"Saving the book {book_details[ISBN]} failed")
 
-def scrape_and_save_recommended_book(parent_book, book_isbn, session):  # todo optimize
-    """Scrape the details of a recommended book if it does not exist in the database"""
+
+def scrape_and_save_recommended_book(entry, session):
+    """Scrape a book taken from the crawl frontier and save it, linked to the books that recommended it.
+
+    The frontier entry is completed in the same transaction as the book, so a crash leaves it to be scraped again.
+    A failed save rolls the completion back, the entry is then failed in a transaction of its own."""
+    book_isbn = entry.isbn
     try:
-        book_page_url = query_saxo_with_isbn_return_book_page_url(book_isbn)
+        parents = frontier_parents(session, entry.parent_isbns)
+        recommended_by = ", ".join(entry.parent_isbns)
+
+        # e.g. saved as a top10k book after it was pushed to the frontier
+        if book_index(session).has_isbn(book_isbn):
+            link_recommended_book(parents, book_isbn, session)
+            frontier.complete(session, book_isbn)
+            session.commit()
+            return
+
+        with timed(SEARCH_FETCH):
+            book_page_url = query_saxo_with_isbn_return_book_page_url(book_isbn)
+        if book_page_url is None:
+            logging.info(f"Searching the book {book_isbn} recommended by {recommended_by} failed FAILED")
+            count(BOOK, ERROR)
+            frontier.complete(session, book_isbn, frontier.FAILED)
+            if retry_queue_enabled:
+                retry_queue.push(session, book_isbn, retry_queue.SEARCH_FAILED, depth=entry.depth)
+            session.commit()
+            return
+
         if book_page_url == 'N/A':
             logging.info(
-                f"Book {book_isbn} recommended by {parent_book.isbn} not found in the search results SAVING DEFAULT")
+                f"Book {book_isbn} recommended by {recommended_by} not found in the search results SAVING DEFAULT")
             default_book_dict = default_book_dict_with_isbn(book_isbn)
-            save_book_details_to_database(default_book_dict, session, parent=parent_book)
+            frontier.complete(session, book_isbn)
+            save_recommended_book_details(default_book_dict, session, parents, entry.depth)
+            session.commit()
+            count(BOOK, DEFAULT)
             return
 
         # get the fully loaded book page html
-        (status, book_page_html) = create_browser_and_wait_for_book_details_page_load(book_page_url, session)
+        (status, book_page_html, final_url, recommendations) = load_book_details_page(book_page_url)
+        # the entry's update starts the write transaction, so it isn't held while the page loads
+        frontier.complete(session, book_isbn)
         if status == LoadStatus.ERROR:
-            logging.info(f"Book {book_isbn} recommended by {parent_book.isbn} failed to load page SAVING DEFAULT")
+            logging.info(f"Book {book_isbn} recommended by {recommended_by} failed to load page SAVING DEFAULT")
+            if retry_queue_enabled:
+                retry_queue.push(session, book_isbn, retry_queue.LOAD_FAILED, depth=entry.depth)
             default_book_dict = default_book_dict_with_isbn(book_isbn)
-            save_book_details_to_database(default_book_dict, session, parent=parent_book)
-            return
-        elif status == LoadStatus.EXISTING:
+            save_recommended_book_details(default_book_dict, session, parents, entry.depth)
+            outcome = DEFAULT
+        elif is_book_scraped_url(session, final_url):
             logging.info(f"The book {book_isbn} already exists in the db failed SKIPPING")
-            return
+            outcome = SKIPPED
         else:
-            book_details_dict = extract_book_details_dict(book_page_html)
+            with timed(EXTRACTION):
+                book_details_dict = extract_book_details(book_page_html, recommendations)
             book_details_dict[TOP10K] = 0
             book_details_dict[URL] = book_page_url
-            save_book_details_to_database(book_details_dict, session, parent=parent_book)
+            save_recommended_book_details(book_details_dict, session, parents, entry.depth)
+            outcome = SUCCESS
+        session.commit()
+        count(BOOK, outcome)
 
     except Exception as e:
-        logging.error(f"Scraping the recommended book with ISBN failed {book_isbn}: {e} ABORTING")
+        session.rollback()
+        logging.error(f"Scraping the recommended book with ISBN failed {book_isbn}: {e!r} ABORTING")
+        count(BOOK, ERROR)
+        frontier.complete(session, book_isbn, frontier.FAILED)
+        if retry_queue_enabled:
+            retry_queue.push(session, book_isbn, retry_queue.SAVE_FAILED, depth=entry.depth)
+        session.commit()
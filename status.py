@@ -0,0 +1,83 @@
+"""How far the crawl has got, read straight from the SQLite file, the `status` command of main.py.
+
+Only the standard library is imported, so checking on a crawl doesn't pay for SQLAlchemy, pandas and the scraping
+stack. A missing database file is reported, not created.
+"""
+import csv
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+# the defaults of database.py, crawl.py and metrics.py, repeated here to keep their imports out of the status check
+DEFAULT_DATABASE_PATH = "scraped_books.db"
+DEFAULT_INPUT_CSV = "data/top_10k_books.csv"
+DEFAULT_STATS_FILE = "data/run_stats.json"
+
+
+def count_input_rows(path):
+    """Books in the input CSV, None if there is no input"""
+    if not os.path.exists(path):
+        return None
+    with open(path, newline="", encoding="ISO-8859-1") as f:
+        return max(sum(1 for _ in csv.reader(f)) - 1, 0)
+
+
+def crawl_status(database_path):
+    """Counts of the saved books, recommendations, frontier and retry entries, the tables missing in the file are left
+    out"""
+    status = {}
+    with closing(sqlite3.connect(database_path)) as connection:
+        tables = {name for (name,) in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if "book" in tables:
+            status["books"], status["top10k_books"], status["default_books"] = connection.execute(
+                "SELECT COUNT(*), COUNT(NULLIF(top10k, 0)), COUNT(CASE WHEN url = 'N/A' THEN 1 END) FROM book"
+            ).fetchone()
+        if "recommendation" in tables:
+            status["recommendations"] = connection.execute("SELECT COUNT(*) FROM recommendation").fetchone()[0]
+        if "frontier" in tables:
+            status["frontier"] = dict(connection.execute("SELECT status, COUNT(*) FROM frontier GROUP BY status"))
+        if "retry" in tables:
+            status["retry"] = dict(connection.execute("SELECT status, COUNT(*) FROM retry GROUP BY status"))
+    return status
+
+
+def last_run(stats_file):
+    """(books per minute, minutes run, minutes since the stats were written) of the last run, None without stats"""
+    if not os.path.exists(stats_file):
+        return None
+    with open(stats_file) as f:
+        stats = json.load(f)
+    return stats["pages_per_minute"], stats["elapsed"] / 60, (time.time() - os.path.getmtime(stats_file)) / 60
+
+
+def add_arguments(parser):
+    parser.add_argument("--database", default=DEFAULT_DATABASE_PATH)
+    parser.add_argument("--input-csv", default=DEFAULT_INPUT_CSV)
+    parser.add_argument("--stats-file", default=DEFAULT_STATS_FILE)
+
+
+def run(args):
+    if not os.path.exists(args.database):
+        print(f"{args.database} doesn't exist, nothing is crawled into it yet")
+        return
+    status = crawl_status(args.database)
+    size = sum(os.path.getsize(path) for path in (args.database, args.database + "-wal") if os.path.exists(path))
+    print(f"{'database':<18}{args.database}, {size / 1024 ** 2:.1f} MiB")
+    if "books" in status:
+        input_rows = count_input_rows(args.input_csv)
+        print(f"{'books':<18}{status['books']}, {status['default_books']} of them default books")
+        print(f"{'top10k books':<18}{status['top10k_books']}"
+              + (f" of {input_rows} input rows" if input_rows is not None else ""))
+    if "recommendations" in status:
+        print(f"{'recommendations':<18}{status['recommendations']}")
+    for queue in ("frontier", "retry"):
+        if status.get(queue):
+            print(f"{queue:<18}" + ", ".join(f"{entry_status} {count}"
+                                             for entry_status, count in sorted(status[queue].items())))
+    run_stats = last_run(args.stats_file)
+    if run_stats is not None:
+        books_per_minute, minutes, minutes_ago = run_stats
+        print(f"{'last run':<18}{books_per_minute:.1f} books/min over {minutes:.1f} min, "
+              f"stats written {minutes_ago:.0f} min ago")
@@ -0,0 +1,54 @@
+import html
+import re
+
+TEASER_CLASS = "product-list-teaser"
+
+# the markup that matters for the teasers: comments and script/style contents are skipped like an HTML parser
+# does, div and anchor start tags are captured with their attributes (quoted values may contain '>'),
+# div end tags are captured to know where a teaser ends
+TOKEN_PATTERN = re.compile(r'<!--.*?-->'
+                           r'|<(script|style)(?=[\s/>])[^>]*>.*?</\1\s*>'
+                           r'|<(div|a)(?=[\s/>])((?:[^>"\']|"[^"]*"|\'[^\']*\')*)>'
+                           r'|(</div\s*>)',
+                           flags=re.DOTALL | re.IGNORECASE)
+ATTRIBUTE_PATTERN = re.compile(r'([^\s=/>]+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+)))?')
+
+
+def parse_attributes(attributes):
+    """Return the attributes of a start tag as a dict with lowercase names and unescaped values"""
+    parsed = {}
+    for name, double_quoted, single_quoted, unquoted in ATTRIBUTE_PATTERN.findall(attributes):
+        parsed[name.lower()] = html.unescape(double_quoted or single_quoted or unquoted)
+    return parsed
+
+
+def iter_teaser_payloads(search_page_html):
+    """Yield the `data-val` JSON string of every search result teaser, in document order, without building a tree.
+
+    The payload is read from the first link of the teaser, None is yielded for a teaser whose first link has no
+    `data-val` or that has no link at all. The page is scanned lazily, so a caller that stops at the first
+    matching teaser doesn't scan the rest of the page."""
+    if isinstance(search_page_html, bytes):
+        search_page_html = search_page_html.decode("utf-8", errors="replace")
+
+    open_divs = 0  # divs open inside the current teaser, 0 outside of a teaser
+    for token in TOKEN_PATTERN.finditer(search_page_html):
+        tag = token.group(2)
+        if token.group(4) is not None:
+            if open_divs:
+                open_divs -= 1
+                if not open_divs:
+                    yield None  # the teaser ended without a link
+        elif tag is None:
+            continue
+        elif tag.lower() == "div":
+            if open_divs:
+                open_divs += 1
+            elif TEASER_CLASS in parse_attributes(token.group(3)).get("class", "").split():
+                open_divs = 1
+        elif open_divs:
+            open_divs = 0
+            yield parse_attributes(token.group(3)).get("data-val")
+
+    if open_divs:
+        yield None
@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+# the modules live flat in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def session(tmp_path):
+    """A session of a fresh database file, with the module state of the crawl back at its defaults afterwards"""
+    import database
+    import scraping
+    from book_index import reset_book_index
+
+    previous_path = database.database_path
+    database.set_database_path(str(tmp_path / "books.db"))
+    reset_book_index()
+    session = database.create_session()
+    yield session
+    session.close()
+    scraping.enable_write_behind(None)
+    scraping.enable_retry_queue(False)
+    scraping.set_max_crawl_depth(scraping.DEFAULT_MAX_DEPTH)
+    reset_book_index()
+    database.set_database_path(previous_path)
+
+
+@pytest.fixture
+def make_book_details():
+    """Build the scraped details of a book, the given fields over the defaults"""
+    from utils import BOOK_NOT_AVAILABLE, ISBN, TITLE, URL, AUTHORS, RECOMMENDATIONS
+
+    def make(isbn, **fields):
+        details = {**BOOK_NOT_AVAILABLE, ISBN: isbn, TITLE: f"Book {isbn}", URL: f"/dk/book_{isbn}",
+                   AUTHORS: [f"Author of {isbn}"], RECOMMENDATIONS: []}
+        details.update(fields)
+        return details
+
+    return make
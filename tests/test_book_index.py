@@ -0,0 +1,61 @@
+from book_index import book_index
+from database import Book, Author, create_session
+
+
+def add_book(session, isbn, url, top10k=0):
+    book = Book(isbn=isbn, title=f"Book {isbn}", url=url, top10k=top10k)
+    session.add(book)
+    session.flush()
+    return book
+
+
+def test_uncommitted_rows_are_seen_only_by_their_session(session):
+    other_session = create_session()
+    try:
+        add_book(session, "1000", "/dk/a", top10k=3)
+        session.add(Author(name="Author"))
+        session.flush()
+        for index, seen in ((book_index(session), True), (book_index(other_session), False)):
+            assert index.has_isbn("1000") is seen
+            assert index.has_url("/dk/a") is seen
+            assert index.has_top10k(3) is seen
+            assert index.has_author("Author") is seen
+
+        session.commit()
+        assert book_index(other_session).has_isbn("1000")
+        assert book_index(other_session).has_author("Author")
+    finally:
+        other_session.close()
+
+
+def test_rolled_back_rows_are_dropped(session):
+    add_book(session, "1000", "/dk/a")
+    session.rollback()
+    assert not book_index(session).has_isbn("1000")
+    assert not book_index(create_session()).has_url("/dk/a")
+
+
+def test_changed_url_replaces_the_old_one_unless_another_book_has_it(session):
+    book = add_book(session, "1000", "N/A")
+    add_book(session, "2000", "N/A")
+    session.commit()
+
+    book.url = "/dk/a"
+    session.commit()
+    index = book_index(session)
+    assert index.has_url("/dk/a")
+    assert index.has_url("N/A")  # still the url of book 2000
+
+    book.url = "/dk/b"
+    session.commit()
+    assert not index.has_url("/dk/a")
+    assert index.has_url("/dk/b")
+
+
+def test_deleted_book_is_removed(session):
+    add_book(session, "1000", "/dk/a", top10k=3)
+    session.commit()
+    session.delete(session.get(Book, "1000"))
+    session.commit()
+    index = book_index(session)
+    assert not index.has_isbn("1000") and not index.has_url("/dk/a") and not index.has_top10k(3)
@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+
+from browser_pool import BrowserPool, PooledBrowser
+
+
+class FakeDriver:
+    def __init__(self):
+        self.quit_called = False
+
+    def execute_script(self, script):
+        return 1
+
+    def quit(self):
+        self.quit_called = True
+
+
+class FakeBrowserPool(BrowserPool):
+    """A pool of fake drivers, no Chrome needed"""
+
+    def _start_browser(self):
+        return PooledBrowser(FakeDriver())
+
+
+def checkout_in_thread(pool):
+    result = {}
+
+    def checkout():
+        try:
+            result["browser"] = pool.checkout()
+        except RuntimeError as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=checkout, daemon=True)
+    thread.start()
+    return thread, result
+
+
+@pytest.mark.parametrize("retire", [
+    lambda pool, browser: pool.checkin(browser, broken=True),
+    lambda pool, browser: pool.checkin(browser),  # recycled after max_pages_per_browser
+])
+def test_retiring_a_browser_wakes_a_waiting_checkout(retire):
+    pool = FakeBrowserPool(size=1, max_pages_per_browser=1)
+    browser = pool.checkout()
+    thread, result = checkout_in_thread(pool)
+    thread.join(0.1)
+    assert thread.is_alive()  # the pool is full
+
+    retire(pool, browser)
+    thread.join(2)
+    assert not thread.is_alive()
+    assert result["browser"] is not browser
+    assert browser.driver.quit_called
+    assert pool._started == 1
+
+
+def test_checkin_hands_the_browser_to_a_waiting_checkout():
+    pool = FakeBrowserPool(size=1)
+    browser = pool.checkout()
+    thread, result = checkout_in_thread(pool)
+    pool.checkin(browser)
+    thread.join(2)
+    assert result["browser"] is browser
+
+
+def test_close_wakes_a_waiting_checkout():
+    pool = FakeBrowserPool(size=1)
+    pool.checkout()
+    thread, result = checkout_in_thread(pool)
+    thread.join(0.1)
+    pool.close()
+    thread.join(2)
+    assert not thread.is_alive()
+    assert isinstance(result["error"], RuntimeError)
+
+
+def test_failed_start_frees_the_slot():
+    pool = FakeBrowserPool(size=1)
+    starts = iter([RuntimeError("no driver"), None])
+
+    def start_browser():
+        error = next(starts)
+        if error is not None:
+            raise error
+        return PooledBrowser(FakeDriver())
+
+    pool._start_browser = start_browser
+    with pytest.raises(RuntimeError):
+        pool.checkout()
+    assert pool.checkout() is not None
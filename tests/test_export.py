@@ -0,0 +1,112 @@
+import pytest
+
+import database
+import scraping
+from database import Book, recommendation_table
+from export import export_database, load_export, BOOKS, BOOK_AUTHORS, RECOMMENDATIONS
+from utils import RECOMMENDATIONS as RECOMMENDED_ISBNS, TOP10K
+
+
+def save_graph(session, make_book_details):
+    """Top10k book 1000 recommending 2000 and 3000"""
+    for isbn in ("2000", "3000"):
+        scraping.save_book_details_to_database(make_book_details(isbn), session, depth=scraping.max_crawl_depth)
+    scraping.save_book_details_to_database(
+        make_book_details("1000", **{RECOMMENDED_ISBNS: ["2000", "3000"], TOP10K: 1}), session)
+
+
+def recommendation_isbns(export):
+    isbns = dict(zip(export[BOOKS]["id"].to_pylist(), export[BOOKS]["isbn"].to_pylist()))
+    recommendations = export[RECOMMENDATIONS]
+    return sorted((isbns[source], isbns[target]) for source, target in zip(
+        recommendations["book_id"].to_pylist(), recommendations["recommended_id"].to_pylist()))
+
+
+def test_dangling_edges_are_left_out(session, make_book_details, tmp_path):
+    save_graph(session, make_book_details)
+    session.execute(Book.__table__.delete().where(Book.isbn == "3000"))
+    session.execute(database.book_author.insert().values(book_isbn="9999", author_name="Author of 1000"))
+    session.commit()
+
+    counts = export_database(database.database_path, str(tmp_path / "export"))
+    export = load_export(str(tmp_path / "export"))
+    assert counts[RECOMMENDATIONS] == 1
+    assert counts[BOOK_AUTHORS] == 2
+    assert recommendation_isbns(export) == [("1000", "2000")]
+    assert min(export[BOOK_AUTHORS]["book_id"].to_pylist()) >= 0
+
+
+def test_deletions_compact_the_export_and_keep_the_ids(session, make_book_details, tmp_path):
+    directory = str(tmp_path / "export")
+    save_graph(session, make_book_details)
+    export_database(database.database_path, directory)
+    ids = dict(zip(*(load_export(directory)[BOOKS][column].to_pylist() for column in ("isbn", "id"))))
+
+    # a retried default book is replaced by the book under its real ISBN
+    session.delete(session.get(Book, "3000"))
+    session.commit()
+    scraping.save_book_details_to_database(make_book_details("4000"), session, depth=scraping.max_crawl_depth)
+    export_database(database.database_path, directory)
+
+    export = load_export(directory)
+    new_ids = dict(zip(*(export[BOOKS][column].to_pylist() for column in ("isbn", "id"))))
+    assert sorted(new_ids) == ["1000", "2000", "4000"]
+    assert new_ids["1000"] == ids["1000"] and new_ids["2000"] == ids["2000"]
+    assert new_ids["4000"] not in ids.values()
+    assert recommendation_isbns(export) == [("1000", "2000")]
+
+    # the ids stay stable across the next incremental export as well
+    scraping.save_book_details_to_database(make_book_details("5000"), session, depth=scraping.max_crawl_depth)
+    counts = export_database(database.database_path, directory)
+    assert counts[BOOKS] == 1
+    export = load_export(directory)
+    assert dict(zip(*(export[BOOKS][column].to_pylist() for column in ("isbn", "id"))))["4000"] == new_ids["4000"]
+
+
+def test_dropped_recommendation_compacts_the_export(session, make_book_details, tmp_path):
+    directory = str(tmp_path / "export")
+    save_graph(session, make_book_details)
+    export_database(database.database_path, directory)
+
+    book = session.get(Book, "1000")
+    book.recommendations.remove(session.get(Book, "3000"))
+    session.commit()
+    export_database(database.database_path, directory)
+    assert recommendation_isbns(load_export(directory)) == [("1000", "2000")]
+
+
+def test_graph_from_the_export_and_the_database_agree(session, make_book_details, tmp_path):
+    from recommendation_graph import RecommendationGraph
+
+    save_graph(session, make_book_details)
+    session.execute(recommendation_table.insert().values(book_isbn="2000", recommended_isbn="9999"))
+    session.commit()
+    directory = str(tmp_path / "export")
+    export_database(database.database_path, directory)
+
+    for graph in (RecommendationGraph.from_database(database.database_path), RecommendationGraph.from_export(directory)):
+        edges = sorted((graph.isbns[source], graph.isbns[target])
+                       for source, target in zip(graph.edge_sources(), graph.indices))
+        assert edges == [("1000", "2000"), ("1000", "3000")]
+
+
+def test_graph_from_the_export_has_no_nodes_for_deleted_books(session, make_book_details, tmp_path):
+    from recommendation_graph import RecommendationGraph
+
+    save_graph(session, make_book_details)
+    directory = str(tmp_path / "export")
+    export_database(database.database_path, directory)
+    session.execute(recommendation_table.delete().where(recommendation_table.c.recommended_isbn == "2000"))
+    session.execute(Book.__table__.delete().where(Book.isbn == "2000"))
+    session.commit()
+    export_database(database.database_path, directory)
+
+    from_database = RecommendationGraph.from_database(database.database_path)
+    from_export = RecommendationGraph.from_export(directory)
+    for graph in (from_database, from_export):
+        assert sorted(graph.isbns.tolist()) == ["1000", "3000"]
+    degrees = [dict(zip(graph.isbns.tolist(), zip(graph.in_degree().tolist(), graph.out_degree().tolist())))
+               for graph in (from_database, from_export)]
+    assert degrees[0] == degrees[1] == {"1000": (0, 1), "3000": (1, 0)}
+    ranks = [dict(zip(graph.isbns.tolist(), graph.pagerank().tolist())) for graph in (from_database, from_export)]
+    assert ranks[0] == pytest.approx(ranks[1])
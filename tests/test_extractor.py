@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+from extractor import extract_book_details, extract_book_details_from_bytes
+from utils import extract_book_details_dict, DESCRIPTION
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "fixtures")
+DESCRIPTION_START = '<p class="mb-0">It is a truth'
+
+
+@pytest.fixture(scope="module")
+def product_page():
+    with open(os.path.join(FIXTURES, "product.html"), encoding="utf-8") as f:
+        return f.read()
+
+
+def with_description(page, markup):
+    """The page with `markup` put right after the start of the description paragraph"""
+    assert DESCRIPTION_START in page
+    return page.replace(DESCRIPTION_START, DESCRIPTION_START[:-len("It is a truth")] + markup, 1)
+
+
+def test_same_details_as_the_reference(product_page):
+    assert extract_book_details(product_page) == extract_book_details_dict(product_page)
+
+
+@pytest.mark.parametrize("markup", [
+    "It <div>was a <b>dark</b> and stormy</div> night. ",
+    "It <ul><li>was</li><li>listed</li></ul> here. ",
+    "It <p>was nested</p> deeply. ",
+    "It <blockquote>was quoted</blockquote>",
+])
+def test_block_elements_in_the_description_are_kept(product_page, markup):
+    page = with_description(product_page, markup)
+    expected = extract_book_details_dict(page)
+    assert extract_book_details(page) == expected
+    assert extract_book_details_from_bytes(page.encode("utf-8")) == expected
+    assert expected[DESCRIPTION].startswith("It ") and len(expected[DESCRIPTION]) > 100
+
+
+def test_description_followed_by_a_block_element(product_page):
+    end = product_page.index("</p>", product_page.index(DESCRIPTION_START)) + len("</p>")
+    page = product_page[:end] + "<div>Not in the description</div>" + product_page[end:]
+    assert extract_book_details(page) == extract_book_details_dict(page)
+    assert "Not in the description" not in extract_book_details(page)[DESCRIPTION]
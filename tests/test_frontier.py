@@ -0,0 +1,97 @@
+import threading
+
+import crawl
+import frontier
+import retry_queue
+import scraping
+from database import Book, RetryEntry, create_session
+from utils import LoadStatus
+
+
+def test_claims_breadth_first_and_keeps_the_smaller_depth(session):
+    frontier.push(session, ["deep", "shallow"], "1000", depth=2)
+    frontier.push(session, ["shallow"], "2000", depth=1)
+    session.commit()
+
+    entry = frontier.claim(session)
+    assert (entry.isbn, entry.depth, entry.attempts) == ("shallow", 1, 1)
+    assert sorted(entry.parent_isbns) == ["1000", "2000"]
+    assert frontier.claim(session).isbn == "deep"
+    assert frontier.claim(session) is None
+
+
+def test_completed_entry_is_not_pushed_again(session):
+    frontier.push(session, ["2000"], "1000", depth=1)
+    session.commit()
+    frontier.complete(session, frontier.claim(session).isbn)
+    session.commit()
+    assert frontier.parents_of(session, "2000") == []
+
+    frontier.push(session, ["2000"], "3000", depth=1)
+    session.commit()
+    assert frontier.claim(session) is None
+    assert not frontier.has_unfinished_work(session)
+    assert frontier.counts(session) == {frontier.DONE: 1}
+
+
+def test_entries_in_progress_are_requeued_on_restart(session):
+    frontier.push(session, ["2000"], "1000", depth=1)
+    session.commit()
+    frontier.claim(session)
+    assert frontier.claim(session) is None
+
+    frontier.requeue_in_progress(session)
+    entry = frontier.claim(session)
+    assert (entry.isbn, entry.attempts) == ("2000", 2)
+
+
+def test_concurrent_workers_never_claim_the_same_entry(session):
+    isbns = [str(i) for i in range(50)]
+    frontier.push(session, isbns, "parent", depth=1)
+    session.commit()
+    claimed = []
+
+    def work():
+        worker_session = create_session()
+        try:
+            while True:
+                entry = frontier.claim(worker_session)
+                if entry is None:
+                    return
+                claimed.append(entry.isbn)
+        finally:
+            worker_session.close()
+
+    workers = [threading.Thread(target=work) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert sorted(claimed) == sorted(isbns)
+
+
+def test_failed_save_fails_the_entry_and_the_drain_ends(session, make_book_details, monkeypatch):
+    frontier.push(session, ["2000"], "1000", depth=1)
+    session.commit()
+    scraping.enable_retry_queue(True)
+    monkeypatch.setattr(crawl, "FRONTIER_IDLE_POLL", 0.01)
+    monkeypatch.setattr(scraping, "query_saxo_with_isbn_return_book_page_url", lambda isbn: "/dk/book_2000")
+    monkeypatch.setattr(scraping, "load_book_details_page",
+                        lambda url: (LoadStatus.NEW, "<html/>", url, []))
+    monkeypatch.setattr(scraping, "extract_book_details", lambda html, recommendations: make_book_details("2000"))
+
+    def fail(*args):
+        raise RuntimeError("disk full")
+    monkeypatch.setattr(scraping, "link_authors_to_book", fail)
+
+    producers_done = threading.Event()
+    producers_done.set()
+    drain = threading.Thread(target=crawl.drain_frontier, args=(producers_done, threading.Event(), 0))
+    drain.start()
+    drain.join(timeout=10)
+    assert not drain.is_alive()
+
+    session.expire_all()
+    assert frontier.counts(session) == {frontier.FAILED: 1}
+    assert session.get(RetryEntry, "2000").reason == retry_queue.SAVE_FAILED
+    assert session.get(Book, "2000") is None
@@ -0,0 +1,83 @@
+import time
+
+from sqlalchemy import select
+
+import retry_queue
+from database import Book, RetryEntry, recommendation_table, create_database_engine
+from merge_shards import merge_shards
+
+
+def create_shard(path, books=(), recommendations=(), retries=()):
+    """A shard database with the given (isbn, top10k, url) books, (book, recommended) edges and retry entries"""
+    engine = create_database_engine(str(path))
+    with engine.begin() as connection:
+        if books:
+            connection.execute(Book.__table__.insert(), [{"isbn": isbn, "title": f"Book {isbn}", "top10k": top10k,
+                                                          "url": url} for isbn, top10k, url in books])
+        if recommendations:
+            connection.execute(recommendation_table.insert(), [{"book_isbn": source, "recommended_isbn": target}
+                                                               for source, target in recommendations])
+        if retries:
+            connection.execute(RetryEntry.__table__.insert(), [
+                {"isbn": isbn, "top10k": top10k, "reason": retry_queue.LOAD_FAILED, "status": status,
+                 "attempts": 1, "next_attempt_at": time.time(), "depth": 1} for isbn, top10k, status in retries])
+    engine.dispose()
+    return str(path)
+
+
+def read(path, statement):
+    engine = create_database_engine(path)
+    with engine.connect() as connection:
+        rows = sorted(tuple(row) for row in connection.execute(statement))
+    engine.dispose()
+    return rows
+
+
+def test_unfinished_retries_of_default_books_are_merged(tmp_path):
+    shard_1 = create_shard(tmp_path / "shard_1.db",
+                           books=[("1", 1, "N/A"), ("2", 2, "N/A"), ("978a", 0, "N/A"), ("978b", 0, "/dk/b")],
+                           retries=[("1", 1, retry_queue.IN_PROGRESS), ("2", 2, retry_queue.PENDING),
+                                    ("978a", 0, retry_queue.PENDING), ("978b", 0, retry_queue.DONE),
+                                    ("978c", 0, retry_queue.PENDING)])
+    # the second shard has scraped book 2 and 978a, e.g. from an overlapping row range
+    shard_2 = create_shard(tmp_path / "shard_2.db", books=[("978x", 2, "/dk/x"), ("978a", 0, "/dk/a")])
+    output = str(tmp_path / "merged.db")
+    merge_shards(output, [shard_2, shard_1])
+
+    table = RetryEntry.__table__
+    assert read(output, select(table.c.isbn, table.c.status)) == [
+        ("1", retry_queue.PENDING), ("978c", retry_queue.PENDING)]
+
+
+def test_recommendations_point_at_merged_books(tmp_path):
+    # both shards found a book for row 5, the second one is kept as a plain book with its edges
+    shard_1 = create_shard(tmp_path / "shard_1.db", books=[("978a", 5, "/dk/a"), ("978b", 0, "/dk/b")],
+                           recommendations=[("978a", "978b")])
+    shard_2 = create_shard(tmp_path / "shard_2.db",
+                           books=[("978c", 5, "/dk/c"), ("978d", 6, "/dk/d"), ("978e", 0, "/dk/e")],
+                           recommendations=[("978d", "978c"), ("978c", "978e"), ("978d", "978e"),
+                                            ("978d", "978missing")])
+    output = str(tmp_path / "merged.db")
+    merge_shards(output, [shard_1, shard_2])
+
+    isbns = {isbn for (isbn,) in read(output, select(Book.isbn))}
+    edges = read(output, select(recommendation_table))
+    assert edges == [("978a", "978b"), ("978c", "978e"), ("978d", "978c"), ("978d", "978e")]
+    assert all(source in isbns and target in isbns for source, target in edges)
+    assert read(output, select(Book.isbn, Book.top10k).where(Book.isbn.in_(["978a", "978c"]))) == [
+        ("978a", 5), ("978c", 0)]
+
+
+def test_scraped_top10k_book_replaces_the_default_book_of_an_earlier_shard(tmp_path):
+    # row 7 failed in the first shard and was scraped by the second, e.g. from an overlapping row range
+    shard_1 = create_shard(tmp_path / "shard_1.db", books=[("7", 7, "N/A"), ("978b", 8, "/dk/b")],
+                           retries=[("7", 7, retry_queue.PENDING)])
+    shard_2 = create_shard(tmp_path / "shard_2.db", books=[("978a", 7, "/dk/a"), ("978c", 0, "/dk/c")],
+                           recommendations=[("978a", "978c")])
+    output = str(tmp_path / "merged.db")
+    merge_shards(output, [shard_1, shard_2])
+
+    assert read(output, select(Book.isbn, Book.top10k, Book.url)) == [
+        ("978a", 7, "/dk/a"), ("978b", 8, "/dk/b"), ("978c", 0, "/dk/c")]
+    assert read(output, select(recommendation_table)) == [("978a", "978c")]
+    assert read(output, select(RetryEntry.isbn)) == []
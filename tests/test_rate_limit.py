@@ -0,0 +1,56 @@
+import pytest
+
+from rate_limit import AdaptiveRateLimiter, backoff_delay, parse_retry_after, rate_limiter_for, \
+    configure_rate_limits, RATE_INCREASE, BACKOFF_MAX
+
+
+@pytest.fixture
+def limiter():
+    return AdaptiveRateLimiter(initial_rate=2.0, min_rate=0.5, max_rate=2.1)
+
+
+def test_rate_grows_on_success_up_to_the_max(limiter):
+    limiter.record_response(200, 0.1)
+    assert limiter.rate == pytest.approx(2.0 + RATE_INCREASE)
+    for _ in range(10):
+        limiter.record_response(200, 0.1)
+    assert limiter.rate == 2.1
+
+
+def test_rate_backs_off_on_throttling_errors_and_slow_responses(limiter):
+    limiter.record_response(200, 0.1)
+    rate = limiter.rate
+    limiter.record_response(200, 1.0)  # ten times the usual latency
+    assert limiter.rate < rate
+    limiter.record_response(503, 0.1)
+    limiter.record_failure()
+    limiter.record_response(429, 0.1)
+    assert limiter.rate == 0.5
+
+
+def test_requests_are_spread_at_the_rate(limiter, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("rate_limit.time.monotonic", lambda: now[0])
+    limiter._updated_at = now[0]
+    assert limiter._reserve() == 0.0
+    assert limiter._reserve() == pytest.approx(0.5)  # the next token in 1 / 2.0 s
+    now[0] += 1.0
+    assert limiter._reserve() == pytest.approx(0.0)
+
+
+def test_backoff_and_retry_after_are_bounded():
+    assert all(0 <= backoff_delay(attempt) <= min(BACKOFF_MAX, 2 ** attempt) for attempt in range(10))
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("1e9") == BACKOFF_MAX
+    assert parse_retry_after("Wed, 21 Oct 2026 07:28:00 GMT") == 0.0
+    assert parse_retry_after(None) == 0.0
+
+
+def test_limiters_are_shared_per_host():
+    configure_rate_limits(initial_rate=1.0)
+    try:
+        assert rate_limiter_for("https://www.saxo.com/dk/a") is rate_limiter_for("https://www.saxo.com/dk/b")
+        assert rate_limiter_for("https://www.saxo.com/") is not rate_limiter_for("http://127.0.0.1:8765/")
+        assert rate_limiter_for("https://www.saxo.com/").rate == 1.0
+    finally:
+        configure_rate_limits()
@@ -0,0 +1,66 @@
+import refresh
+import scraping
+from database import Book
+from metrics import UNCHANGED, UPDATED
+from refresh import refresh_book, write_book_changes
+from utils import book_content_hash, ISBN, TITLE, AUTHORS, RECOMMENDATIONS, TOP10K
+
+
+def save_books(session, make_book_details, recommendations):
+    """Save the recommended books, then the top10k book 1 recommending them"""
+    for isbn in recommendations:
+        scraping.save_book_details_to_database(make_book_details(isbn), session, depth=scraping.max_crawl_depth)
+    scraping.save_book_details_to_database(make_book_details("1000", **{RECOMMENDATIONS: recommendations,
+                                                                          TOP10K: 1}), session)
+    return session.get(Book, "1000")
+
+
+def recommended_isbns(book):
+    return sorted(recommended_book.isbn for recommended_book in book.recommendations)
+
+
+def test_dropped_recommendations_are_unlinked(session, make_book_details):
+    book = save_books(session, make_book_details, ["2000", "3000"])
+    assert recommended_isbns(book) == ["2000", "3000"]
+
+    details = make_book_details("1000", **{RECOMMENDATIONS: ["3000"], TOP10K: 1})
+    _, _, new_recommendations, dropped_recommendations = write_book_changes(book, details, session, depth=1)
+    session.commit()
+    session.expire_all()
+
+    assert new_recommendations == []
+    assert dropped_recommendations == ["2000"]
+    assert recommended_isbns(session.get(Book, "1000")) == ["3000"]
+    assert session.get(Book, "2000") is not None  # only the edge goes
+
+
+def test_refresh_writes_a_changed_recommendation_list(session, make_book_details, monkeypatch):
+    save_books(session, make_book_details, ["2000", "3000"])
+    scraping.save_book_details_to_database(make_book_details("4000"), session, depth=scraping.max_crawl_depth)
+    details = make_book_details("1000", **{RECOMMENDATIONS: ["3000", "4000"]})
+    monkeypatch.setattr(refresh, "fetch_book_page_if_modified", lambda book: ("<html/>", None, (None, None)))
+    monkeypatch.setattr(refresh, "extract_book_details", lambda html, recommendations: dict(details))
+
+    assert refresh_book("1000", session) == UPDATED
+    session.expire_all()
+    assert recommended_isbns(session.get(Book, "1000")) == ["3000", "4000"]
+    assert refresh_book("1000", session) == UNCHANGED
+
+
+def test_suffixed_isbn_is_unchanged_on_refresh(session, make_book_details, monkeypatch):
+    scraping.save_book_details_to_database(make_book_details("1000_7", **{TITLE: "Book", AUTHORS: ["Author"],
+                                                                           TOP10K: 7}), session)
+    scraped = make_book_details("1000", **{TITLE: "Book", AUTHORS: ["Author"], TOP10K: 7})
+    monkeypatch.setattr(refresh, "fetch_book_page_if_modified", lambda book: ("<html/>", None, (None, None)))
+    monkeypatch.setattr(refresh, "extract_book_details", lambda html, recommendations: dict(scraped))
+
+    def write_book_changes_of_unchanged_book(*args):
+        raise AssertionError("the content hash differs")
+
+    monkeypatch.setattr(refresh, "write_book_changes", write_book_changes_of_unchanged_book)
+    assert refresh_book("1000_7", session) == UNCHANGED
+
+
+def test_content_hash_ignores_the_isbn(make_book_details):
+    details = make_book_details("1000")
+    assert book_content_hash(details) == book_content_hash({**details, ISBN: "1000_7"})
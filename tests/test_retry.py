@@ -0,0 +1,120 @@
+import pytest
+
+import database
+import frontier
+import retry
+import retry_queue
+import scraping
+from database import Book, RetryEntry
+from pipeline import save_default_book
+from utils import default_book_dict_with_isbn, LoadStatus, RECOMMENDATIONS, TITLE, TOP10K
+from write_behind import WriteBehindWriter
+
+BOOK_PAGE_URL = "/dk/book_9780000000001"
+
+
+@pytest.fixture(autouse=True)
+def retries_due_right_away(monkeypatch):
+    scraping.enable_retry_queue(True)
+    monkeypatch.setattr(retry_queue, "retry_base_delay", 0)
+
+
+def load_page(status=LoadStatus.NEW):
+    return lambda url: (status, "<html/>", url, [])
+
+
+def retry_status(session, isbn):
+    session.expire_all()
+    entry = session.get(RetryEntry, isbn)
+    return entry.status, entry.attempts
+
+
+@pytest.fixture
+def failed_top10k_book(session, monkeypatch):
+    """Book 7 saved as a default book after its search failed"""
+    save_default_book("Some Title", ["Some Author"], 6, session)
+    retry_queue.push(session, 7, retry_queue.SEARCH_FAILED, top10k=7, title="Some Title", author="Some Author")
+    session.commit()
+    monkeypatch.setattr(retry, "query_saxo_with_title_return_search_page", lambda title: "<html/>")
+    monkeypatch.setattr(retry, "find_top10k_book_page_url", lambda i, title, author, html: BOOK_PAGE_URL)
+    return session
+
+
+def test_retried_top10k_book_replaces_its_default_book(failed_top10k_book, make_book_details, monkeypatch):
+    session = failed_top10k_book
+    details = make_book_details("9780000000001", **{TITLE: "Some Title"})
+    monkeypatch.setattr(retry, "load_book_details_page", load_page())
+    monkeypatch.setattr(retry, "extract_top10k_book_details", lambda i, html, recommendations: dict(details))
+
+    retry.retry_book(retry_queue.claim(session), session)
+
+    session.expire_all()
+    assert session.get(Book, "7") is None
+    book = session.get(Book, "9780000000001")
+    assert (book.top10k, book.url, book.title) == (7, BOOK_PAGE_URL, "Some Title")
+    assert session.query(Book).filter(Book.top10k == 7).count() == 1
+    assert retry_status(session, "7") == (retry_queue.DONE, 1)
+
+
+def test_failed_retry_keeps_the_default_book_and_backs_off(failed_top10k_book, monkeypatch):
+    session = failed_top10k_book
+    monkeypatch.setattr(retry, "load_book_details_page", load_page(LoadStatus.ERROR))
+
+    retry.retry_book(retry_queue.claim(session), session, max_attempts=2)
+    assert retry_status(session, "7") == (retry_queue.PENDING, 1)
+    assert session.get(RetryEntry, "7").reason == retry_queue.LOAD_FAILED
+    retry.retry_book(retry_queue.claim(session), session, max_attempts=2)
+    assert retry_status(session, "7") == (retry_queue.FAILED, 2)
+    assert retry_queue.claim(session) is None
+    assert session.get(Book, "7").url == "N/A"
+
+
+def test_retried_recommended_book_fills_its_default_book_in_place(session, make_book_details, monkeypatch):
+    isbn = "9780000000002"
+    scraping.save_book_details_to_database(make_book_details("3000", **{RECOMMENDATIONS: [], TOP10K: 1}), session)
+    parent = session.get(Book, "3000")
+    scraping.save_book_details_to_database({**default_book_dict_with_isbn(isbn)}, session, [parent],
+                                           depth=scraping.max_crawl_depth)
+    retry_queue.push(session, isbn, retry_queue.LOAD_FAILED, depth=scraping.max_crawl_depth)
+    session.commit()
+
+    details = make_book_details(isbn, **{TITLE: "Recommended", RECOMMENDATIONS: ["3000"]})
+    monkeypatch.setattr(retry, "query_saxo_with_isbn_return_book_page_url", lambda isbn: BOOK_PAGE_URL)
+    monkeypatch.setattr(retry, "load_book_details_page", load_page())
+    monkeypatch.setattr(retry, "extract_book_details", lambda html, recommendations: dict(details))
+
+    retry.retry_book(retry_queue.claim(session), session)
+
+    session.expire_all()
+    book = session.get(Book, isbn)
+    assert (book.title, book.url) == ("Recommended", BOOK_PAGE_URL)
+    assert [b.isbn for b in session.get(Book, "3000").recommendations] == [isbn]
+    assert [b.isbn for b in book.recommendations] == ["3000"]
+    assert retry_status(session, isbn) == (retry_queue.DONE, 1)
+
+
+def test_retried_recommended_book_is_linked_to_its_parents_under_write_behind(session, make_book_details, tmp_path,
+                                                                            monkeypatch):
+    isbn = "9780000000002"
+    writer = WriteBehindWriter(database.get_engine(), journal_path=str(tmp_path / "journal.jsonl"))
+    scraping.enable_write_behind(writer)
+    scraping.save_book_details_to_database(make_book_details("3000", **{TOP10K: 1}), session)
+    scraping.save_book_details_to_database({**default_book_dict_with_isbn(isbn)}, session,
+                                           depth=scraping.max_crawl_depth)
+    # the book's frontier entry failed and still knows the book that recommended it
+    frontier.push(session, [isbn], "3000", depth=scraping.max_crawl_depth)
+    retry_queue.push(session, isbn, retry_queue.SAVE_FAILED, depth=scraping.max_crawl_depth)
+    session.commit()
+
+    details = make_book_details(isbn, **{TITLE: "Recommended"})
+    monkeypatch.setattr(retry, "query_saxo_with_isbn_return_book_page_url", lambda isbn: BOOK_PAGE_URL)
+    monkeypatch.setattr(retry, "load_book_details_page", load_page())
+    monkeypatch.setattr(retry, "extract_book_details", lambda html, recommendations: dict(details))
+
+    retry.retry_book(retry_queue.claim(session), session)
+    writer.close()
+
+    session.expire_all()
+    assert session.get(Book, isbn).title == "Recommended"
+    assert [b.isbn for b in session.get(Book, "3000").recommendations] == [isbn]
+    assert retry_status(session, isbn) == (retry_queue.DONE, 1)
@@ -0,0 +1,73 @@
+import json
+
+import pytest
+from sqlalchemy import select
+
+from database import Book, book_author, recommendation_table, create_database_engine
+from write_behind import WriteBehindWriter, BOOK, AUTHOR, BOOK_AUTHOR, RECOMMENDATION, TOP10K
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_database_engine(str(tmp_path / "books.db"))
+    yield engine
+    engine.dispose()
+
+
+def book_row(isbn, top10k=0):
+    return {"isbn": isbn, "title": f"Book {isbn}", "url": f"/dk/book_{isbn}", "top10k": top10k}
+
+
+def saved(engine):
+    with engine.connect() as connection:
+        return ({isbn: top10k for isbn, top10k in connection.execute(select(Book.isbn, Book.top10k))},
+                sorted(tuple(row) for row in connection.execute(select(book_author))),
+                sorted(tuple(row) for row in connection.execute(select(recommendation_table))))
+
+
+def crash(writer):
+    """Stop the writer the way a killed process does, without flushing its buffer"""
+    writer._stopped.set()
+    writer._timer.join()
+    writer._journal.close()
+
+
+def test_journal_of_a_crashed_run_is_replayed(engine, tmp_path):
+    journal_path = str(tmp_path / "journal.jsonl")
+    writer = WriteBehindWriter(engine, batch_size=1000, flush_interval=3600, journal_path=journal_path)
+    writer.add_book(book_row("1000"), ["Author"])
+    writer.add_book(book_row("2000"), [])
+    writer.add_recommendation("1000", "2000")
+    writer.set_top10k("1000", 1)
+    crash(writer)
+    assert saved(engine) == ({}, [], [])
+
+    writer = WriteBehindWriter(engine, journal_path=journal_path)
+    assert saved(engine) == ({"1000": 1, "2000": 0}, [("1000", "Author")], [("1000", "2000")])
+    writer.close()
+
+
+def test_replay_is_idempotent_and_skips_a_truncated_record(engine, tmp_path):
+    journal_path = tmp_path / "journal.jsonl"
+    records = [[BOOK, book_row("1000")], [AUTHOR, {"name": "Author"}],
+               [BOOK_AUTHOR, {"book_isbn": "1000", "author_name": "Author"}],
+               [BOOK, book_row("2000")], [RECOMMENDATION, {"book_isbn": "1000", "recommended_isbn": "2000"}],
+               [TOP10K, {"b_isbn": "1000", "top10k": 1}]]
+    journal = "".join(json.dumps(record) + "\n" for record in records)
+    for _ in range(2):  # e.g. a crash after the batch was committed but before the journal was cleared
+        journal_path.write_text(journal + '["book", {"isbn": "30', encoding="utf-8")
+        WriteBehindWriter(engine, journal_path=str(journal_path)).close()
+
+    assert saved(engine) == ({"1000": 1, "2000": 0}, [("1000", "Author")], [("1000", "2000")])
+    assert not journal_path.exists()
+
+
+def test_journal_is_cleared_once_the_batch_is_written(engine, tmp_path):
+    journal_path = tmp_path / "journal.jsonl"
+    writer = WriteBehindWriter(engine, batch_size=2, flush_interval=3600, journal_path=str(journal_path))
+    writer.add_book(book_row("1000"), [])
+    assert len(journal_path.read_text(encoding="utf-8").splitlines()) == 1
+    writer.add_book(book_row("2000"), [])  # fills the batch
+    assert journal_path.read_text(encoding="utf-8") == ""
+    assert saved(engine)[0] == {"1000": 0, "2000": 0}
+    writer.close()
@@ -1,8 +1,12 @@
+import hashlib
+import json
 import logging
 import re
 
 import unicodedata
 from enum import Enum
+from functools import lru_cache
+from urllib.parse import urljoin
 
 from bs4 import BeautifulSoup
 
@@ -31,6 +35,13 @@ AUTHORS = "Authors"
 URL = "Url"
 RECOMMENDATIONS = "Recommendations"
 
+SAXO_BASE_URL = "https://www.saxo.com"
+
+# attributes of the recommendation carousel that can point to the data request it loads client-side
+RECOMMENDATIONS_SOURCE_ATTRIBUTES = ("data-url", "data-src", "data-source", "data-endpoint", "data-ajax-url")
+# keys of the products in the carousel's JSON data that hold the ISBN
+RECOMMENDATIONS_ISBN_KEYS = ("Id", "Isbn", "ISBN", "ISBN13", "ProductIdentifier")
+
 # for creating a default book entry
 BOOK_NOT_AVAILABLE = {ISBN: 'x',
                       PAGE_COUNT: 0,
@@ -68,66 +79,97 @@ def default_book_dict_with_isbn(isbn):
     return default_book
 
 
-def normalize_special_characters(text):
-    # Normalize the text by separating characters and their diacritical marks (e.g., 'á' becomes 'a' + '´')
-    normalized_text = unicodedata.normalize('NFD', text)
-    normalized_text = ''.join(
-        char for char in normalized_text
-        if unicodedata.category(char) != 'Mn'
-        and (ord(char) < 128 or char == ',' or char == '*' or char == '-')
-    )
+def book_content_hash(book_details):
+    """Hash of what was scraped from the book page, the order of the authors and recommendations aside.
 
-    return normalized_text
+    The ISBN is left out with the url and top10k, a top10k book may be saved under its ISBN suffixed with its row."""
+    content = {key: sorted(value) if key in (AUTHORS, RECOMMENDATIONS) else value
+               for key, value in book_details.items() if key not in (ISBN, URL, TOP10K)}
+    return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode("utf-8")).hexdigest()
 
 
-def translate_danish_to_english(text):
-    translations = {
-        'æ': 'ae',
-        'ø': 'oe',
-        'å': 'aa',
-        'Æ': 'Ae',
-        'Ø': 'Oe',
-        'Å': 'Aa'
-    }
+# translation table of the Danish letters that don't decompose into a base letter and a diacritical mark
+DANISH_TO_ENGLISH = str.maketrans({
+    'æ': 'ae',
+    'ø': 'oe',
+    'å': 'aa',
+    'Æ': 'Ae',
+    'Ø': 'Oe',
+    'Å': 'Aa'
+})
 
-    for danish_char, english_char in translations.items():
-        text = text.replace(danish_char, english_char)
+# Remove common business entity suffixes and punctuation, while keeping commas
+AUTHOR_SUFFIXES = ['Ltd', 'Inc', 'Co', 'LLC', 'LLP', 'PLC']
+AUTHOR_SUFFIX_PATTERN = re.compile(r'\b(?:' + '|'.join(AUTHOR_SUFFIXES) + r')\.?\b', flags=re.IGNORECASE)
+PARENTHESIZED_PATTERN = re.compile(r'\(.*?\)')
+AUTHOR_PUNCTUATION_PATTERN = re.compile(r'[^\w\s,]')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+TITLE_SPECIAL_CHARACTERS_PATTERN = re.compile(r'[^a-zA-Z0-9\s]')
 
-    return text
+# the same authors come up in the search teasers of many books, so their normalized names are memoized
+NORMALIZATION_CACHE_SIZE = 65536
 
 
-def normalize_author_string(name):
-    name = translate_danish_to_english(name)
-    name = normalize_special_characters(name)
+def normalize_special_characters(text):
+    # Normalize the text by separating characters and their diacritical marks (e.g., 'á' becomes 'a' + '´'),
+    # then drop the marks and every other non-ASCII character
+    return unicodedata.normalize('NFD', text).encode('ascii', 'ignore').decode('ascii')
 
-    # Remove common business entity suffixes and punctuation, while keeping commas
-    suffixes = ['Ltd', 'Inc', 'Co', 'LLC', 'LLP', 'PLC']
-    pattern = r'\b(?:' + '|'.join(suffixes) + r')\.?\b'
-    name = re.sub(pattern, '', name, flags=re.IGNORECASE)
+
+def translate_danish_to_english(text):
+    return text.translate(DANISH_TO_ENGLISH)
+
+
+@lru_cache(maxsize=NORMALIZATION_CACHE_SIZE)
+def normalize_author_string(name):
+    name = normalize_special_characters(translate_danish_to_english(name))
+    name = AUTHOR_SUFFIX_PATTERN.sub('', name)
 
     # Remove any parenthesized content
-    name = re.sub(r'\(.*?\)', '', name)
+    name = PARENTHESIZED_PATTERN.sub('', name)
 
     # Remove any remaining punctuation (except for commas) and extra whitespace
-    name = re.sub(r'[^\w\s,]', '', name)  # Keep commas by adding them to the character set
-    name = re.sub(r'\s+', ' ', name).strip()
+    name = AUTHOR_PUNCTUATION_PATTERN.sub('', name)
+    name = WHITESPACE_PATTERN.sub(' ', name).strip()
 
     return name.lower()
 
 
+@lru_cache(maxsize=NORMALIZATION_CACHE_SIZE)
 def normalize_book_title_string(title):
     """ normalize a book title by trimming, converting to lowercase, and removing special characters"""
-    title = translate_danish_to_english(title)
-    title = normalize_special_characters(title)
+    title = normalize_special_characters(translate_danish_to_english(title))
 
     normalized_title = title.strip()
     normalized_title = normalized_title.lower()
     # Remove special characters except for spaces and alphanum
-    normalized_title = re.sub(r'[^a-zA-Z0-9\s]', '', normalized_title)
+    normalized_title = TITLE_SPECIAL_CHARACTERS_PATTERN.sub('', normalized_title)
 
     return normalized_title
 
 
+def normalize_special_characters_series(texts):
+    """`normalize_special_characters` of a whole pandas Series of strings at once"""
+    return texts.str.normalize('NFD').str.encode('ascii', 'ignore').str.decode('ascii')
+
+
+def normalize_author_series(names):
+    """`normalize_author_string` of a whole pandas Series of strings at once, missing values stay missing"""
+    names = normalize_special_characters_series(names.str.translate(DANISH_TO_ENGLISH))
+    names = names.str.replace(AUTHOR_SUFFIX_PATTERN, '', regex=True)
+    names = names.str.replace(PARENTHESIZED_PATTERN, '', regex=True)
+    names = names.str.replace(AUTHOR_PUNCTUATION_PATTERN, '', regex=True)
+    names = names.str.replace(WHITESPACE_PATTERN, ' ', regex=True).str.strip()
+    return names.str.lower()
+
+
+def normalize_book_title_series(titles):
+    """`normalize_book_title_string` of a whole pandas Series of strings at once, missing values stay missing"""
+    titles = normalize_special_characters_series(titles.str.translate(DANISH_TO_ENGLISH))
+    titles = titles.str.strip().str.lower()
+    return titles.str.replace(TITLE_SPECIAL_CHARACTERS_PATTERN, '', regex=True)
+
+
 def is_book_correct(authors_local, book_parsed):
     """Parse the first author and compare it to the extracted authors. Return True if the names match."""
     authors_extracted = book_parsed["Authors"]
@@ -146,15 +188,20 @@ def is_book_correct(authors_local, book_parsed):
 
 # EXTRACT THE DETAILS FROM THE BOOK PAGE ########################################
 
-def extract_book_details_dict(book_page_html):
-    """Scrape and structure the book's details from its HTML page content."""
+def extract_book_details_dict(book_page_html, recommendations=None):
+    """Scrape and structure the book's details from its HTML page content.
+
+    This is the BeautifulSoup reference implementation, the crawl uses the faster `extractor.extract_book_details`.
+
+    The recommendations are extracted from the page unless they are given, e.g. by the browser-free fast path."""
     soup = BeautifulSoup(book_page_html, "html.parser")
     title = extract_title(soup)
     authors = extract_authors(soup)
     details = extract_details(soup)
     product_description = extract_description(soup)
     rating, num_of_reviews = extract_reviews(soup)
-    recommendations = extract_recommendations_list(book_page_html)
+    if recommendations is None:
+        recommendations = extract_recommendations_list(book_page_html)
 
     # Combine all extracted details into a single dictionary
     book_details = {**details, TITLE: title, AUTHORS: authors,
@@ -198,23 +245,33 @@ def extract_reviews(soup):
 def extract_rating(reviews_container):
     rating_tag = reviews_container.find('span', class_="text-l text-800")
     if rating_tag:
-        rating_str = rating_tag.text.strip().replace(",", ".")
-        try:
-            return float(rating_str)
-        except ValueError:
-            logging.error(f"Failed to convert rating '{rating_str}' to float.")
-    return 0  # Return default if rating is not found or conversion fails
+        return convert_rating(rating_tag.text)
+    return 0  # Return default if rating is not found
+
+
+def convert_rating(rating_text):
+    rating_str = rating_text.strip().replace(",", ".")
+    try:
+        return float(rating_str)
+    except ValueError:
+        logging.error(f"Failed to convert rating '{rating_str}' to float.")
+    return 0  # Return default if conversion fails
 
 
 def extract_review_count(reviews_container):
     review_count_tag = reviews_container.find('span', class_="text-s")
     if review_count_tag:
-        review_count_str = review_count_tag.text.strip().split(" ")[0].replace("(", "").replace(")", "")
-        try:
-            return int(review_count_str)
-        except ValueError:
-            logging.error(f"Failed to convert review count '{review_count_str}' to int.")
-    return 0  # default if review count is not found or conversion fails
+        return convert_review_count(review_count_tag.text)
+    return 0  # default if review count is not found
+
+
+def convert_review_count(review_count_text):
+    review_count_str = review_count_text.strip().split(" ")[0].replace("(", "").replace(")", "")
+    try:
+        return int(review_count_str)
+    except ValueError:
+        logging.error(f"Failed to convert review count '{review_count_str}' to int.")
+    return 0  # default if conversion fails
 
 
 def details_to_dict(details_section):
@@ -270,3 +327,63 @@ def extract_recommendations_list(book_page_html):
             else:
                 logging.error("Failed to extract a recommendation ISBN from the book page.")
     return recommendations_isbn
+
+
+# FAST PATH: RECOMMENDATIONS WITHOUT A BROWSER ########################################
+
+def extract_static_recommendations_list(soup):
+    """Return the recommendation ISBNs already present in the static HTML of the carousel or None"""
+    container = soup.find("div", id="product-page-banner-container")
+    slider = container.find("div", class_="book-slick-slider") if container else None
+    if not slider:
+        return None
+
+    covers = slider.find_all("a", class_="cover-container")
+    recommendations_isbn = [cover.get('data-product-identifier') for cover in covers
+                            if cover.get('data-product-identifier')]
+    # an empty carousel in the static HTML means that it's filled client-side
+    return recommendations_isbn or None
+
+
+def extract_recommendations_source_url(soup, page_url=SAXO_BASE_URL):
+    """Return the url of the data request that fills the recommendation carousel or None if it's not in the page"""
+    container = soup.find("div", id="product-page-banner-container")
+    if not container:
+        return None
+
+    for tag in [container, *container.find_all(True)]:
+        for attribute in RECOMMENDATIONS_SOURCE_ATTRIBUTES:
+            if tag.get(attribute):
+                return urljoin(page_url, tag.get(attribute))
+    return None
+
+
+def parse_recommendations_response(response_text):
+    """Parse the ISBNs from the response of the carousel's data request (JSON or a HTML fragment) or return None"""
+    try:
+        data = json.loads(response_text)
+    except ValueError:
+        soup = BeautifulSoup(response_text, "html.parser")
+        recommendations_isbn = [tag.get('data-product-identifier')
+                                for tag in soup.find_all(attrs={"data-product-identifier": True})]
+        return recommendations_isbn or None
+
+    recommendations_isbn = []
+    collect_isbns_from_json(data, recommendations_isbn)
+    return recommendations_isbn
+
+
+def collect_isbns_from_json(data, recommendations_isbn):
+    """Walk the JSON data and append the ISBN of every product to the list, keeping their order"""
+    if isinstance(data, list):
+        for item in data:
+            collect_isbns_from_json(item, recommendations_isbn)
+    elif isinstance(data, dict):
+        for key in RECOMMENDATIONS_ISBN_KEYS:
+            isbn = str(data.get(key, ''))
+            if isbn.isdigit() and len(isbn) in (10, 13):
+                if isbn not in recommendations_isbn:
+                    recommendations_isbn.append(isbn)
+                return
+        for value in data.values():
+            collect_isbns_from_json(value, recommendations_isbn)
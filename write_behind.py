@@ -0,0 +1,127 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import insert, update, bindparam
+
+from database import Book, Author, book_author, recommendation_table
+from metrics import timed, DB_FLUSH
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 5.0
+DEFAULT_JOURNAL_PATH = "data/write_behind_journal.jsonl"
+
+# kinds of buffered records, in the order they are written in a batch
+BOOK = "book"
+AUTHOR = "author"
+BOOK_AUTHOR = "book_author"
+RECOMMENDATION = "recommendation"
+TOP10K = "top10k"
+
+
+class WriteBehindWriter:
+    """Buffer new books, authors and edges and write them in bulk, insert-or-ignore transactions.
+
+    A batch is written every `batch_size` records or `flush_interval` seconds, whichever comes first, and on close.
+    Every record is appended to a journal before it's buffered and the journal is cleared only after its batch is
+    committed, so a crash loses at most the batch in flight and the journal is replayed on the next start.
+    Replaying is idempotent, as rows that already exist are ignored.
+    """
+
+    def __init__(self, engine, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 journal_path=DEFAULT_JOURNAL_PATH):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.journal_path = journal_path
+        self._records = []
+        self._lock = threading.RLock()
+        self._last_flush = time.monotonic()
+
+        self.replay_journal()
+        self._journal = open(journal_path, "a", encoding="utf-8")
+        self._stopped = threading.Event()
+        self._timer = threading.Thread(target=self._flush_periodically, name="write-behind", daemon=True)
+        self._timer.start()
+
+    def replay_journal(self):
+        """Write the records left in the journal by a previous run that did not flush them"""
+        if not os.path.exists(self.journal_path):
+            return
+
+        records = []
+        with open(self.journal_path, encoding="utf-8") as journal:
+            for line in journal:
+                try:
+                    records.append(tuple(json.loads(line)))
+                except ValueError:
+                    logging.error(f"Skipping a truncated record in the write-behind journal: {line!r}")
+        if records:
+            logging.info(f"Replaying {len(records)} records from the write-behind journal")
+            self._write_batch(records)
+        os.remove(self.journal_path)
+
+    def add_book(self, row, author_names):
+        """Buffer a book row (a dict of the `book` columns) together with its authors"""
+        self._add(BOOK, row)
+        for name in author_names:
+            self._add(AUTHOR, {"name": name})
+            self._add(BOOK_AUTHOR, {"book_isbn": row["isbn"], "author_name": name})
+
+    def add_recommendation(self, isbn, recommended_isbn):
+        self._add(RECOMMENDATION, {"book_isbn": isbn, "recommended_isbn": recommended_isbn})
+
+    def set_top10k(self, isbn, top10k):
+        self._add(TOP10K, {"b_isbn": isbn, "top10k": top10k})
+
+    def _add(self, kind, payload):
+        with self._lock:
+            self._journal.write(json.dumps([kind, payload]) + "\n")
+            self._journal.flush()
+            self._records.append((kind, payload))
+            if len(self._records) >= self.batch_size:
+                self.flush()
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(self.flush_interval / 2):
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                try:
+                    self.flush()
+                except Exception as e:
+                    logging.error(f"Periodic write-behind flush failed, the batch stays in the journal: {e!r}")
+
+    def flush(self):
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._records:
+                return
+            self._write_batch(self._records)
+            self._records = []
+            self._journal.seek(0)
+            self._journal.truncate()
+
+    def _write_batch(self, records):
+        rows = {kind: [] for kind in (BOOK, AUTHOR, BOOK_AUTHOR, RECOMMENDATION, TOP10K)}
+        for kind, payload in records:
+            rows[kind].append(payload)
+
+        with timed(DB_FLUSH), self.engine.begin() as connection:
+            for kind, table in ((BOOK, Book.__table__), (AUTHOR, Author.__table__), (BOOK_AUTHOR, book_author),
+                                (RECOMMENDATION, recommendation_table)):
+                if rows[kind]:
+                    connection.execute(insert(table).prefix_with("OR IGNORE"), rows[kind])
+            if rows[TOP10K]:
+                book = Book.__table__
+                connection.execute(update(book).where(book.c.isbn == bindparam("b_isbn"))
+                                   .values(top10k=bindparam("top10k")), rows[TOP10K])
+        logging.info(f"Wrote a batch of {len(records)} records: " +
+                     ", ".join(f"{len(kind_rows)} {kind}" for kind, kind_rows in rows.items() if kind_rows))
+
+    def close(self):
+        self._stopped.set()
+        self._timer.join()
+        self.flush()
+        self._journal.close()
+        os.remove(self.journal_path)